@@ -0,0 +1,149 @@
+import argparse
+import os
+import sys
+from collections import Counter
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.message_source import open_source
+from common.profiling import Profiler, add_profile_arguments
+
+DATA_OUTPUT_EXTENSION = '.csv'
+DATA_OUTPUT_DELIMITER = ','
+# Classes of the classification dump and the short names used in the
+# output, like in the classification scripts.
+CLASSES = [('equal', 'eq'), ('mismatched', 'mm'), ('bgp_only', 'bgp'),
+           ('tr_only', 'tr')]
+# Class of visibility entries without a classification entry.
+UNMATCHED_CLASS = 'none'
+
+
+def build_index(messages) -> dict:
+    # Maps (scope, asn) of every classified dependency to the index of its
+    # class in CLASSES.
+    index = dict()
+    for msg in messages:
+        scope = str(msg['scope'])
+        for class_idx, (key, class_name) in enumerate(CLASSES):
+            for entry in msg[key]:
+                index[scope, int(entry[0])] = class_idx
+    return index
+
+
+def join(index: dict, messages) -> (dict, int):
+    # Streams the visibility messages against the classification index
+    # and returns a unique_ips histogram per class, and the number of
+    # bgp_only classification entries without visibility entry. Matched
+    # entries are removed from the index, so it only contains unmatched
+    # entries afterwards.
+    class_names = [class_name for key, class_name in CLASSES]
+    histograms = {class_name: Counter()
+                  for class_name in class_names + [UNMATCHED_CLASS]}
+    for msg in messages:
+        class_idx = index.pop((str(msg['scope']), int(msg['asn'])), None)
+        if class_idx is None:
+            class_name = UNMATCHED_CLASS
+        else:
+            class_name = class_names[class_idx]
+        histograms[class_name][msg['unique_ips']] += 1
+    bgp_only_idx = class_names.index('bgp')
+    unmatched = sum(1 for class_idx in index.values()
+                    if class_idx == bgp_only_idx)
+    return histograms, unmatched
+
+
+def write_distributions(histograms: dict, output_file: str) -> None:
+    with open(output_file, 'w') as f:
+        f.write(DATA_OUTPUT_DELIMITER.join(['class', 'unique_ips', 'count',
+                                            'p']) + '\n')
+        for class_name, histogram in histograms.items():
+            total = sum(histogram.values())
+            cumulative = 0
+            for value in sorted(histogram):
+                cumulative += histogram[value]
+                f.write(DATA_OUTPUT_DELIMITER.join(
+                    map(str, [class_name, value, histogram[value],
+                              cumulative / total])) + '\n')
+
+
+def write_summary(histograms: dict, unmatched: int, output_file: str) -> None:
+    # One line per class with the number of visibility entries, and the
+    # number of bgp_only classification entries without visibility entry.
+    with open(output_file, 'w') as f:
+        f.write(DATA_OUTPUT_DELIMITER.join(['class', 'count']) + '\n')
+        for class_name, histogram in histograms.items():
+            f.write(DATA_OUTPUT_DELIMITER.join(
+                [class_name, str(sum(histogram.values()))]) + '\n')
+        f.write(DATA_OUTPUT_DELIMITER.join(['bgp_unmatched', str(unmatched)])
+                + '\n')
+
+
+def main() -> None:
+    desc = """Join the bgp-only visibility dump with the classification dump
+    of the same timestamp by (scope, asn) and write the unique IP
+    distribution of each dependency class."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('classification',
+                        help='*.pickle.bz2 dump or *.msgpack stream of the '
+                             'classification topic')
+    parser.add_argument('visibility',
+                        help='*.pickle.bz2 dump or *.msgpack stream of the '
+                             'bgp-only dependencies topic')
+    parser.add_argument('-d', '--data-output', help='Data output directory',
+                        default='./')
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    profiler = Profiler.from_args(args)
+
+    data_output_dir = args.data_output
+    if not data_output_dir.endswith('/'):
+        data_output_dir += '/'
+
+    # Only the classification dump is indexed. The visibility dump is
+    # streamed against the index afterwards.
+    with profiler.stage('load'):
+        source = open_source(args.classification)
+    if source is None:
+        sys.exit(1)
+    start_ts = source.header['start_ts']
+    with profiler.stage('index') as stage:
+        index = build_index(source)
+        stage.items = len(index)
+    del source
+    profiler.count('classified dependencies', len(index))
+
+    with profiler.stage('load'):
+        source = open_source(args.visibility)
+    if source is None:
+        sys.exit(1)
+    if source.header['start_ts'] != start_ts:
+        print(f'Error: Dumps have different timestamps: {start_ts} != '
+              f'{source.header["start_ts"]}', file=sys.stderr)
+        sys.exit(1)
+    with profiler.stage('join') as stage:
+        histograms, unmatched = join(index, source)
+        stage.items = source.count
+    profiler.count('visibility entries', source.count)
+    profiler.count('unmatched visibility entries',
+                   sum(histograms[UNMATCHED_CLASS].values()))
+    profiler.count('unmatched bgp_only entries', unmatched)
+
+    output_file_prefix = source.prefix
+    os.makedirs(data_output_dir, exist_ok=True)
+    with profiler.stage('output'):
+        write_distributions(histograms,
+                            data_output_dir + 'bgp-only-join.'
+                            + output_file_prefix + DATA_OUTPUT_EXTENSION)
+        write_summary(histograms, unmatched,
+                      data_output_dir + 'bgp-only-join-summary.'
+                      + output_file_prefix + DATA_OUTPUT_EXTENSION)
+
+    profiler.print_counters()
+    profiler.write()
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
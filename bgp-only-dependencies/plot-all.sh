@@ -9,5 +9,5 @@ fi
 
 readonly DUMP=$1
 
-python3 plot-cdf.py -f figs/daily/ "$DUMP"
+python3 plot-cdf.py -f figs/daily/ -d data/daily/ "$DUMP"
 
@@ -1,61 +1,46 @@
 import argparse
-import bz2
 import os
-import pickle
 import sys
 from datetime import datetime, timezone
 
-import matplotlib.pyplot as plt
-import msgpack
 import numpy as np
 
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.figures import import_pyplot
+from common.message_source import open_source
+from common.profiling import Profiler, add_profile_arguments
+from visibility import get_ecdf, get_histogram, write_ecdf
+
 DATE_FMT = '%Y-%m-%dT%H:%M:%S'
-INPUT_EXTENSION = '.pickle.bz2'
 DATA_OUTPUT_EXTENSION = '.csv'
-DATA_OUTPUT_DELIMITER = ','
 FIG_OUTPUT_EXTENSION = '.svg'
 
 
-def main() -> None:
-    parser = argparse.ArgumentParser()
-    parser.add_argument('topic', help='*.pickle.bz2 dump of topic')
-    parser.add_argument('-f', '--fig-output', help='Figure output directory',
-                        default='./')
-    parser.add_argument('-d', '--data-output', help='Data output directory',
-                        default='./')
-
-    args = parser.parse_args()
-
-    fig_output_dir: str = args.fig_output
-    if not fig_output_dir.endswith('/'):
-        fig_output_dir += '/'
-
-    data_output_dir = args.data_output
-    if not data_output_dir.endswith('/'):
-        data_output_dir += '/'
-
-    output_file_prefix = os.path.basename(args.topic)[:-len(INPUT_EXTENSION)]
-    fig_output_file = fig_output_dir + 'bgp-only-visibility.' + \
-                      output_file_prefix + FIG_OUTPUT_EXTENSION
-
-    if not args.topic.endswith(INPUT_EXTENSION):
-        print(f'Error: Expected {INPUT_EXTENSION} input file, but got '
-              f'{args.topic}', file=sys.stderr)
-        sys.exit(1)
-
-    with bz2.open(args.topic, 'r') as f:
-        data = pickle.load(f)
-    x_vals = list()
-    for msg in data['messages']:
-        msg_data = msgpack.loads(msg[1])
-        x_vals.append(msg_data['unique_ips'])
-    x_vals.sort()
-    p_vals = (np.arange(len(x_vals)) + 1) / len(x_vals)
-
+def get_plot_points(values: np.ndarray,
+                    counts: np.ndarray,
+                    p_vals: np.ndarray) -> (np.ndarray, np.ndarray):
+    # The ECDF used to be plotted with one point per dependency, i.e., a
+    # vertical line from the first to the last sample of each value. Two
+    # points per distinct value draw the same curve.
+    total = counts.sum()
+    x_vals = np.repeat(values, 2)
+    y_vals = np.empty(len(x_vals))
+    y_vals[0::2] = p_vals - (counts - 1) / total
+    y_vals[1::2] = p_vals
+    return x_vals, y_vals
+
+
+def plot_ecdf(values: np.ndarray,
+              counts: np.ndarray,
+              p_vals: np.ndarray,
+              title: str,
+              output_file: str) -> None:
+    plt = import_pyplot()
     fa = plt.subplots()
     ax: plt.Axes = fa[1]
 
-    ax.plot(x_vals, p_vals)
+    ax.plot(*get_plot_points(values, counts, p_vals))
     ax.set_ylim(0, 1)
     ax.set_yticks(np.arange(0, 1.1, 0.1))
     ax.set_ylabel('p')
@@ -68,17 +53,77 @@ def main() -> None:
                                   np.arange(10, x_lim_max + 1, x_tick_spacing)))
     ax.set_xticks(minor_ticks, minor=True)
     ax.set_xlabel('unique IPs')
-
-    title = datetime.fromtimestamp(data['start_ts'] / 1000, tz=timezone.utc) \
-        .strftime(DATE_FMT)
     ax.set_title(title)
 
     ax.grid(which='both')
 
-    os.makedirs(fig_output_dir, exist_ok=True)
-
     # plt.show()
-    plt.savefig(fig_output_file, bbox_inches='tight')
+    plt.savefig(output_file, bbox_inches='tight')
+    plt.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('topic',
+                        help='*.pickle.bz2 dump or *.msgpack stream of topic, '
+                             'or - to read a stream from stdin')
+    parser.add_argument('-f', '--fig-output', help='Figure output directory',
+                        default='./')
+    parser.add_argument('-d', '--data-output', help='Data output directory',
+                        default='./')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='Only write data files')
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    profiler = Profiler.from_args(args)
+
+    fig_output_dir: str = args.fig_output
+    if not fig_output_dir.endswith('/'):
+        fig_output_dir += '/'
+
+    data_output_dir = args.data_output
+    if not data_output_dir.endswith('/'):
+        data_output_dir += '/'
+
+    with profiler.stage('load'):
+        source = open_source(args.topic)
+    if source is None:
+        sys.exit(1)
+
+    output_file_prefix = source.prefix
+    fig_output_file = fig_output_dir + 'bgp-only-visibility.' + \
+                      output_file_prefix + FIG_OUTPUT_EXTENSION
+    data_output_file = data_output_dir + 'bgp-only-visibility.' + \
+                       output_file_prefix + DATA_OUTPUT_EXTENSION
+
+    # Messages are counted while they are read from the source.
+    with profiler.stage('decode') as stage:
+        histogram = get_histogram(source)
+        stage.items = source.count
+    profiler.count('messages', source.count)
+    if not histogram:
+        print(f'Error: No messages in {args.topic}', file=sys.stderr)
+        sys.exit(1)
+    with profiler.stage('ecdf') as stage:
+        values, counts, p_vals = get_ecdf(histogram)
+        stage.items = len(values)
+
+    with profiler.stage('output'):
+        os.makedirs(data_output_dir, exist_ok=True)
+        write_ecdf(values, counts, p_vals, data_output_file)
+
+    if not args.no_figures:
+        title = datetime.fromtimestamp(source.header['start_ts'] / 1000,
+                                       tz=timezone.utc).strftime(DATE_FMT)
+        os.makedirs(fig_output_dir, exist_ok=True)
+        with profiler.stage('render') as stage:
+            plot_ecdf(values, counts, p_vals, title, fig_output_file)
+            stage.items = 1
+
+    profiler.print_counters()
+    profiler.write()
 
 
 if __name__ == '__main__':
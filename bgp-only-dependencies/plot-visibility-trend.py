@@ -0,0 +1,261 @@
+import argparse
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.message_source import (DUMP_EXTENSION, STREAM_EXTENSION,
+                                   get_raw_file, open_source)
+from common.profiling import Profiler, add_profile_arguments
+from visibility import get_ecdf, get_histogram, read_histogram, write_ecdf
+
+DATE_FMT = '%Y-%m-%d'
+DATA_OUTPUT_EXTENSION = '.csv'
+DATA_OUTPUT_DELIMITER = ','
+FIG_OUTPUT_EXTENSION = '.svg'
+# Same file names as the data output of plot-cdf.py, so that its output
+# directory can be used as cache.
+HISTOGRAM_FILE_PREFIX = 'bgp-only-visibility.'
+OUTPUT_FILE = '{prefix}.{topic}.{start_ts}--{end_ts}'
+DEFAULT_QUANTILES = '50,75,90,95,99'
+
+
+def parse_timestamp_argument(arg: str) -> datetime:
+    return datetime.strptime(arg, DATE_FMT)
+
+
+def parse_quantiles(arg: str) -> list:
+    quantiles = sorted({float(quantile) for quantile in arg.split(',')})
+    if not quantiles or quantiles[0] <= 0 or quantiles[-1] > 100:
+        raise argparse.ArgumentTypeError('Quantiles must be in (0, 100]')
+    return quantiles
+
+
+def get_cache_file(cache_folder: str, raw_file: str) -> str:
+    prefix = os.path.basename(raw_file)
+    for extension in [DUMP_EXTENSION, STREAM_EXTENSION]:
+        if prefix.endswith(extension):
+            prefix = prefix[:-len(extension)]
+    return cache_folder + HISTOGRAM_FILE_PREFIX + prefix + \
+           DATA_OUTPUT_EXTENSION
+
+
+def is_cached(raw_file: str, cache_file: str) -> bool:
+    return os.path.exists(cache_file) \
+        and os.path.getmtime(cache_file) >= os.path.getmtime(raw_file)
+
+
+def build_histogram(raw_file: str, cache_file: str) -> Counter:
+    # Runs in a worker process. Only the histogram is sent back.
+    histogram = get_histogram(open_source(raw_file))
+    if histogram:
+        write_ecdf(*get_ecdf(histogram), cache_file)
+    return histogram
+
+
+def load_histograms(raw_files: dict,
+                    cache_folder: str,
+                    processes: int,
+                    profiler: Profiler) -> dict:
+    # Returns a histogram per date. Histograms are read from the cache if
+    # it is newer than the dump, all others are built in parallel.
+    histograms = dict()
+    missing = list()
+    with profiler.stage('read cache') as stage:
+        for date_key, raw_file in raw_files.items():
+            cache_file = get_cache_file(cache_folder, raw_file)
+            if is_cached(raw_file, cache_file):
+                histograms[date_key] = read_histogram(cache_file)
+            else:
+                missing.append((date_key, raw_file, cache_file))
+        stage.items = len(histograms)
+    profiler.count('cached dumps', len(histograms))
+    profiler.count('read dumps', len(missing))
+    if not missing:
+        return histograms
+    with profiler.stage('build histograms') as stage:
+        jobs = [(raw_file, cache_file)
+                for date_key, raw_file, cache_file in missing]
+        if processes > 1 and len(jobs) > 1:
+            with Pool(min(processes, len(jobs))) as pool:
+                results = pool.starmap(build_histogram, jobs)
+        else:
+            results = [build_histogram(*job) for job in jobs]
+        for (date_key, raw_file, cache_file), histogram in zip(missing,
+                                                                results):
+            if not histogram:
+                print(f'Warning: No messages in {raw_file}', file=sys.stderr)
+                continue
+            histograms[date_key] = histogram
+        stage.items = len(jobs)
+    return histograms
+
+
+def get_quantiles(histogram: Counter, quantiles: list) -> list:
+    # The q-quantile is the smallest value whose ECDF is at least q.
+    values, counts, p_vals = get_ecdf(histogram)
+    return [values[min(np.searchsorted(p_vals, quantile / 100),
+                       len(values) - 1)]
+            for quantile in quantiles]
+
+
+def write_quantiles(histograms: dict,
+                    quantiles: list,
+                    output_file: str) -> None:
+    with open(output_file, 'w') as f:
+        f.write(DATA_OUTPUT_DELIMITER.join(
+            ['date', 'dependencies']
+            + [f'q{quantile:g}' for quantile in quantiles]) + '\n')
+        for date_key in sorted(histograms):
+            histogram = histograms[date_key]
+            f.write(DATA_OUTPUT_DELIMITER.join(
+                map(str, [date_key, sum(histogram.values())]
+                    + get_quantiles(histogram, quantiles))) + '\n')
+
+
+def plot_trend(histograms: dict, x_lim_max: int, output: str) -> None:
+    # Plotting libraries are only imported once a figure is rendered.
+    import matplotlib
+    # Figures are only written to files, so use a non-interactive backend.
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fa = plt.subplots()
+    fig: plt.Figure = fa[0]
+    ax: plt.Axes = fa[1]
+    colors = plt.cm.viridis(np.linspace(0, 1, len(histograms)))
+    for color, date_key in zip(colors, sorted(histograms)):
+        values, counts, p_vals = get_ecdf(histograms[date_key])
+        ax.step(values, p_vals, where='post', color=color, label=date_key)
+    ax.set_ylim(0, 1)
+    ax.set_yticks(np.arange(0, 1.1, 0.1))
+    ax.set_ylabel('p')
+    ax.set_xlim(-1, x_lim_max)
+    ax.set_xlabel('unique IPs')
+    ax.grid(which='both')
+    # A legend entry per date is only readable for short ranges.
+    if len(histograms) <= 14:
+        ax.legend(fontsize='small')
+    else:
+        sm = plt.cm.ScalarMappable(cmap=plt.cm.viridis,
+                                   norm=plt.Normalize(0, len(histograms) - 1))
+        cbar = fig.colorbar(sm, ax=ax)
+        dates = sorted(histograms)
+        cbar.set_ticks([0, len(dates) - 1])
+        cbar.set_ticklabels([dates[0], dates[-1]])
+    fig.savefig(output, bbox_inches='tight')
+    plt.close(fig)
+
+
+def main() -> None:
+    desc = """Compare the bgp-only visibility of the dumps in a date range.
+    Per-dump histograms of unique IPs are cached, so that dumps are only
+    read once."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('raw_folder')
+    parser.add_argument('topic')
+    parser.add_argument('start_ts')
+    parser.add_argument('end_ts')
+    parser.add_argument('-s', '--step', type=int, default=1,
+                        help='Days between dumps (default: 1)')
+    parser.add_argument('-f', '--fig-output', help='Figure output directory',
+                        default='./')
+    parser.add_argument('-d', '--data-output', help='Data output directory',
+                        default='./')
+    parser.add_argument('-c', '--cache',
+                        help='Histogram cache directory (default: data '
+                             'output directory)')
+    parser.add_argument('-q', '--quantiles', type=parse_quantiles,
+                        default=DEFAULT_QUANTILES,
+                        help=f'Comma-separated quantiles written per dump '
+                             f'(default: {DEFAULT_QUANTILES})')
+    parser.add_argument('-x', '--x-max', type=int,
+                        help='Upper limit of the x axis (default: largest '
+                             'quantile over all dumps)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of processes used to read dumps '
+                             '(default: number of CPUs)')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='Only write data files')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profiler = Profiler.from_args(args)
+
+    start_ts = parse_timestamp_argument(args.start_ts)
+    end_ts = parse_timestamp_argument(args.end_ts)
+    raw_folder = args.raw_folder
+    if not raw_folder.endswith('/'):
+        raw_folder += '/'
+    data_folder = args.data_output
+    if not data_folder.endswith('/'):
+        data_folder += '/'
+    figure_folder = args.fig_output
+    if not figure_folder.endswith('/'):
+        figure_folder += '/'
+    cache_folder = args.cache or data_folder
+    if not cache_folder.endswith('/'):
+        cache_folder += '/'
+    if args.step < 1:
+        print('Error: Step must be at least one day', file=sys.stderr)
+        sys.exit(1)
+
+    raw_files = dict()
+    curr_ts = start_ts
+    while curr_ts <= end_ts:
+        raw_file = get_raw_file(raw_folder, args.topic, curr_ts)
+        if raw_file:
+            raw_files[curr_ts.strftime(DATE_FMT)] = raw_file
+        else:
+            print(f'Error: No dump of {args.topic} for '
+                  f'{curr_ts.strftime(DATE_FMT)} in {raw_folder}',
+                  file=sys.stderr)
+        curr_ts += timedelta(days=args.step)
+    if not raw_files:
+        print('Error: No dumps found in range', file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(cache_folder, exist_ok=True)
+    histograms = load_histograms(raw_files, cache_folder, args.jobs,
+                                 profiler)
+    if not histograms:
+        print('Error: All dumps are empty', file=sys.stderr)
+        sys.exit(1)
+
+    output_name = OUTPUT_FILE.format(prefix='bgp-only-visibility-quantiles',
+                                     topic=args.topic,
+                                     start_ts=start_ts.strftime(DATE_FMT),
+                                     end_ts=end_ts.strftime(DATE_FMT))
+    os.makedirs(data_folder, exist_ok=True)
+    with profiler.stage('quantiles') as stage:
+        write_quantiles(histograms, args.quantiles,
+                        data_folder + output_name + DATA_OUTPUT_EXTENSION)
+        stage.items = len(histograms)
+
+    if not args.no_figures:
+        x_lim_max = args.x_max
+        if x_lim_max is None:
+            x_lim_max = max(get_quantiles(histogram, args.quantiles[-1:])[0]
+                            for histogram in histograms.values())
+        output_name = OUTPUT_FILE.format(prefix='bgp-only-visibility-trend',
+                                         topic=args.topic,
+                                         start_ts=start_ts.strftime(DATE_FMT),
+                                         end_ts=end_ts.strftime(DATE_FMT))
+        os.makedirs(figure_folder, exist_ok=True)
+        with profiler.stage('render') as stage:
+            plot_trend(histograms, x_lim_max,
+                       figure_folder + output_name + FIG_OUTPUT_EXTENSION)
+            stage.items = 1
+
+    profiler.print_counters()
+    profiler.write()
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
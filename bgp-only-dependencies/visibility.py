@@ -0,0 +1,55 @@
+import os
+from collections import Counter
+
+import numpy as np
+
+DATA_OUTPUT_DELIMITER = ','
+TMP_EXTENSION = '.tmp'
+
+
+def get_histogram(messages) -> Counter:
+    # Count the dependencies per number of unique IPs. The values are
+    # small counts, so the histogram stays small regardless of the number
+    # of messages. Histograms of several dumps can be merged by adding
+    # them.
+    histogram = Counter()
+    for msg in messages:
+        histogram[msg['unique_ips']] += 1
+    return histogram
+
+
+def get_ecdf(histogram: Counter) -> (np.ndarray, np.ndarray, np.ndarray):
+    # Returns the distinct values, their counts, and the ECDF at each
+    # value.
+    values = np.array(sorted(histogram), dtype=np.int64)
+    counts = np.array([histogram[value] for value in values], dtype=np.int64)
+    p_vals = np.cumsum(counts) / counts.sum()
+    return values, counts, p_vals
+
+
+def write_ecdf(values: np.ndarray,
+               counts: np.ndarray,
+               p_vals: np.ndarray,
+               output_file: str) -> None:
+    # Write to a temporary file first so that an interrupted run does not
+    # leave a truncated file behind, which plot-visibility-trend.py would
+    # read as a cached histogram.
+    tmp_file = output_file + TMP_EXTENSION
+    with open(tmp_file, 'w') as f:
+        f.write(DATA_OUTPUT_DELIMITER.join(['unique_ips', 'count', 'p'])
+                + '\n')
+        for row in zip(values, counts, p_vals):
+            f.write(DATA_OUTPUT_DELIMITER.join(map(str, row)) + '\n')
+    os.replace(tmp_file, output_file)
+
+
+def read_histogram(input_file: str) -> Counter:
+    # Read the histogram back from an ECDF file written by write_ecdf.
+    histogram = Counter()
+    with open(input_file, 'r') as f:
+        # Skip headers
+        f.readline()
+        for line in f:
+            value, count, p = line.split(DATA_OUTPUT_DELIMITER)
+            histogram[int(value)] = int(count)
+    return histogram
@@ -0,0 +1,199 @@
+import sqlite3
+import zlib
+from collections import defaultdict
+
+from class_state import CLASSES
+
+DAY_MS = 24 * 60 * 60 * 1000
+# First byte of a stored bitmap.
+RAW_BITMAP = b'\x00'
+ZLIB_BITMAP = b'\x01'
+
+
+def encode_days(days) -> tuple:
+    # Returns the first day and the bitmap of the days relative to it. The
+    # bitmap is stored compressed if that is smaller, which is the case for
+    # long runs of days.
+    first_day = min(days)
+    bits = 0
+    for day in days:
+        bits |= 1 << (day - first_day)
+    raw = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    compressed = zlib.compress(raw)
+    if len(compressed) < len(raw):
+        return first_day, ZLIB_BITMAP + compressed
+    return first_day, RAW_BITMAP + raw
+
+
+def decode_days(first_day: int, bitmap: bytes) -> list:
+    raw = bitmap[1:]
+    if bitmap[:1] == ZLIB_BITMAP:
+        raw = zlib.decompress(raw)
+    bits = int.from_bytes(raw, 'little')
+    days = list()
+    offset = 0
+    while bits:
+        if bits & 1:
+            days.append(first_day + offset)
+        bits >>= 1
+        offset += 1
+    return days
+
+
+def filter_days(days: list, start_day: int = None, end_day: int = None) \
+        -> list:
+    return [day for day in days
+            if (start_day is None or day >= start_day)
+            and (end_day is None or day <= end_day)]
+
+
+class AsnIndex:
+    """Inverted index from dependency ASNs to the days on which they were
+    in each class, and to the scopes that depended on them in that class.
+    Days are stored as bitmaps per (asn, class) and (asn, class, scope),
+    so the history of an ASN is read with one indexed lookup instead of
+    decoding every dump. Days are counted since the epoch.
+
+    Dumps are added to a pending batch first and merged into the database
+    by flush(), since merging rewrites the bitmaps of every ASN in the
+    batch."""
+
+    def __init__(self, db_file: str):
+        self.connection = sqlite3.connect(db_file)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS dumps ('
+            'start_ts INTEGER PRIMARY KEY, '
+            'name TEXT NOT NULL)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS asn_classes ('
+            'asn INTEGER NOT NULL, '
+            'class TEXT NOT NULL, '
+            'first_day INTEGER NOT NULL, '
+            'days BLOB NOT NULL, '
+            'PRIMARY KEY (asn, class)) WITHOUT ROWID')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS asn_scopes ('
+            'asn INTEGER NOT NULL, '
+            'class TEXT NOT NULL, '
+            'scope TEXT NOT NULL, '
+            'first_day INTEGER NOT NULL, '
+            'days BLOB NOT NULL, '
+            'PRIMARY KEY (asn, class, scope)) WITHOUT ROWID')
+        self.pending_dumps = dict()
+        # Map asn -> class -> days and asn -> (class, scope) -> days.
+        self.pending_classes = defaultdict(lambda: defaultdict(set))
+        self.pending_scopes = defaultdict(lambda: defaultdict(set))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Pending dumps are only kept if the batch completed.
+        if exc_type is None:
+            self.flush()
+        self.close()
+
+    def is_indexed(self, start_ts: int) -> bool:
+        if start_ts in self.pending_dumps:
+            return True
+        return self.connection.execute(
+            'SELECT 1 FROM dumps WHERE start_ts = ?',
+            (start_ts,)).fetchone() is not None
+
+    def add_messages(self, name: str, start_ts: int, messages) -> None:
+        day = start_ts // DAY_MS
+        for msg in messages:
+            scope = msg['scope']
+            for key, class_name in CLASSES:
+                for entry in msg[key]:
+                    asn = entry[0]
+                    self.pending_classes[asn][class_name].add(day)
+                    self.pending_scopes[asn][(class_name, scope)].add(day)
+        self.pending_dumps[start_ts] = name
+
+    def flush(self) -> int:
+        # Merges the pending dumps into the database in one transaction.
+        # Returns the number of updated ASNs.
+        updated = len(self.pending_classes)
+        with self.connection:
+            for asn, classes in self.pending_classes.items():
+                for (class_name, first_day, bitmap) in \
+                        self.connection.execute(
+                            'SELECT class, first_day, days FROM asn_classes '
+                            'WHERE asn = ?', (asn,)).fetchall():
+                    if class_name in classes:
+                        classes[class_name].update(
+                            decode_days(first_day, bitmap))
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO asn_classes '
+                    '(asn, class, first_day, days) VALUES (?, ?, ?, ?)',
+                    [(asn, class_name) + encode_days(days)
+                     for class_name, days in classes.items()])
+                scopes = self.pending_scopes[asn]
+                for (class_name, scope, first_day, bitmap) in \
+                        self.connection.execute(
+                            'SELECT class, scope, first_day, days '
+                            'FROM asn_scopes WHERE asn = ?',
+                            (asn,)).fetchall():
+                    if (class_name, scope) in scopes:
+                        scopes[(class_name, scope)].update(
+                            decode_days(first_day, bitmap))
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO asn_scopes '
+                    '(asn, class, scope, first_day, days) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(asn, class_name, scope) + encode_days(days)
+                     for (class_name, scope), days in scopes.items()])
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO dumps (start_ts, name) VALUES (?, ?)',
+                self.pending_dumps.items())
+        self.pending_dumps.clear()
+        self.pending_classes.clear()
+        self.pending_scopes.clear()
+        return updated
+
+    def get_classes(self,
+                    asn: int,
+                    start_day: int = None,
+                    end_day: int = None) -> dict:
+        # Returns the sorted days in [start_day, end_day] per class in which
+        # asn was a dependency.
+        classes = dict()
+        for class_name, first_day, bitmap in self.connection.execute(
+                'SELECT class, first_day, days FROM asn_classes '
+                'WHERE asn = ?', (asn,)):
+            days = filter_days(decode_days(first_day, bitmap), start_day,
+                               end_day)
+            if days:
+                classes[class_name] = days
+        return classes
+
+    def get_scopes(self,
+                   asn: int,
+                   class_name: str = None,
+                   start_day: int = None,
+                   end_day: int = None) -> dict:
+        # Returns the sorted days in [start_day, end_day] per (class, scope)
+        # in which the scope depended on asn.
+        query = 'SELECT class, scope, first_day, days FROM asn_scopes ' \
+                'WHERE asn = ?'
+        params = [asn]
+        if class_name is not None:
+            query += ' AND class = ?'
+            params.append(class_name)
+        scopes = dict()
+        for class_name, scope, first_day, bitmap in self.connection.execute(
+                query, params):
+            days = filter_days(decode_days(first_day, bitmap), start_day,
+                               end_day)
+            if days:
+                scopes[(class_name, scope)] = days
+        return scopes
+
+    def get_days(self) -> list:
+        return [start_ts // DAY_MS for start_ts, in self.connection.execute(
+            'SELECT start_ts FROM dumps ORDER BY start_ts')]
+
+    def close(self) -> None:
+        self.connection.close()
+
@@ -0,0 +1,187 @@
+import argparse
+import bz2
+import os
+import pickle
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+import msgpack
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import Profiler
+from common.scripts import load_script
+from figures import ImageExporter
+from set_permutator import SetPermutator
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_OUTPUT_DELIMITER = ','
+DEFAULT_SIZES = '100,1000,10000'
+CLASS_KEYS = [('equal', 'eq'), ('mismatched', 'mm'), ('bgp_only', 'bgp'),
+              ('tr_only', 'tr')]
+
+
+def decode(raw_file: str) -> list:
+    with bz2.open(raw_file, 'rb') as f:
+        data = pickle.load(f)
+    return [msgpack.loads(msg[1]) for msg in data['messages']]
+
+
+def get_classes(messages: list) -> dict:
+    # Collect the inputs of the partitioning, relation and class ratio
+    # stages in the same way as the plot scripts.
+    scopes = {class_name: set() for key, class_name in CLASS_KEYS}
+    deps = {class_name: set() for key, class_name in CLASS_KEYS}
+    dep_scope_map = defaultdict(set)
+    scope_info = dict()
+    dep_info = defaultdict(lambda: {'eq': 0, 'mm': 0, 'bgp': 0, 'tr': 0})
+    for msg_data in messages:
+        scope = msg_data['scope']
+        scope_info[scope] = dict()
+        for key, class_name in CLASS_KEYS:
+            scope_info[scope][class_name] = len(msg_data[key])
+            if msg_data[key]:
+                scopes[class_name].add(scope)
+            for entry in msg_data[key]:
+                asn = entry[0]
+                deps[class_name].add(asn)
+                dep_scope_map[asn].add(scope)
+                dep_info[asn][class_name] += 1
+    return {'scopes': scopes,
+            'deps': deps,
+            'dep_scope_map': dep_scope_map,
+            'scope_info': scope_info,
+            'dep_info': dep_info}
+
+
+def get_permutations(classes: dict) -> dict:
+    permutator = SetPermutator()
+    for class_name, values in classes.items():
+        permutator.add_class(class_name, values)
+    return permutator.get_permutations()
+
+
+def time_stage(function, repeat: int) -> list:
+    # Returns the wall time of each run in seconds. Output of the stage is
+    # discarded so that it does not dominate the measurement.
+    times = list()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for run in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def get_stages(raw_file: str, work_dir: str, figures: bool) -> list:
+    # Returns (name, function) tuples of all benchmarked stages.
+    overlap = load_script(SCRIPT_DIR, 'plot-daily-overlap')
+    relation = load_script(SCRIPT_DIR, 'plot-dependency-scope-relation')
+    ratios = load_script(SCRIPT_DIR, 'plot-class-ratios')
+
+    messages = decode(raw_file)
+    classes = get_classes(messages)
+    sclasses = get_permutations(classes['scopes'])
+    dclasses = get_permutations(classes['deps'])
+    labels = list(sclasses)
+    dep_sets = [dclasses[class_name] for class_name in labels]
+    scope_sets = [sclasses[class_name] for class_name in labels]
+    # get_ratios reads the scope and dependency info from module globals.
+    ratios.scope_info = classes['scope_info']
+    ratios.dep_info = classes['dep_info']
+
+    def class_ratios():
+        for class_name, scopes in sclasses.items():
+            ratios.get_ratios(class_name, scopes, 'scope')
+        for class_name, deps in dclasses.items():
+            ratios.get_ratios(class_name, deps, 'dependency')
+
+    def relation_csv():
+        if not relation.process_topic(raw_file, work_dir, work_dir,
+                                      Profiler()):
+            raise RuntimeError('Failed to process ' + raw_file)
+
+    def relation_figure():
+        exporter = ImageExporter()
+        success = relation.process_topic(raw_file, work_dir, work_dir,
+                                         Profiler(), exporter)
+        if not exporter.close() or not success:
+            raise RuntimeError('Failed to plot ' + raw_file)
+
+    stages = [('decode', lambda: decode(raw_file)),
+              ('process_raw_file',
+               lambda: overlap.process_raw_file(raw_file, Profiler())),
+              ('get_permutations',
+               lambda: (get_permutations(classes['scopes']),
+                        get_permutations(classes['deps']))),
+              ('get_n_n_connections',
+               lambda: relation.get_n_n_connections(
+                   dep_sets, scope_sets, classes['dep_scope_map'])),
+              ('class_ratios', class_ratios),
+              ('relation_csv', relation_csv)]
+    if figures:
+        stages.append(('relation_figure', relation_figure))
+    return stages
+
+
+def main() -> None:
+    desc = """Time the stages of the classification scripts on synthetic
+    dumps of several sizes."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-s', '--sizes', default=DEFAULT_SIZES,
+                        help=f'Comma-separated number of scopes per dump '
+                             f'(default: {DEFAULT_SIZES})')
+    parser.add_argument('-d', '--deps-per-scope', type=float, default=10,
+                        help='Mean number of dependencies per scope')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of runs per stage')
+    parser.add_argument('-f', '--figures', action='store_true',
+                        help='Include figure export')
+    parser.add_argument('-o', '--output', help='Write results to CSV file')
+    parser.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(',')]
+    except ValueError as e:
+        print(f'Error: Invalid sizes: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    generator = load_script(SCRIPT_DIR, 'generate-dumps')
+    class_mix = generator.parse_class_mix(generator.DEFAULT_CLASS_MIX)
+    start = datetime(2021, 3, 1, tzinfo=timezone.utc)
+    results = list()
+    print(f'{"scopes":>8} {"stage":<20} {"min (s)":>10} {"median (s)":>10}')
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            # Keep the ratio of scopes to dependency ASes roughly constant.
+            raw_file = generator.generate_dumps(
+                work_dir, start, 1, size, args.deps_per_scope,
+                max(size // 2, 100), class_mix, 5, args.seed, False)[0]
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                stages = get_stages(raw_file, work_dir, args.figures)
+            for stage, function in stages:
+                times = time_stage(function, args.repeat)
+                results.append((size, stage, min(times),
+                                statistics.median(times)))
+                print(f'{size:>8} {stage:<20} {min(times):>10.4f} '
+                      f'{statistics.median(times):>10.4f}')
+            os.remove(raw_file)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(DATA_OUTPUT_DELIMITER.join(['scopes', 'stage', 'min',
+                                                'median']) + '\n')
+            for result in results:
+                f.write(DATA_OUTPUT_DELIMITER.join(map(str, result)) + '\n')
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
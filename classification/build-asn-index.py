@@ -0,0 +1,75 @@
+import argparse
+import os
+import sys
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from asn_index import AsnIndex
+from common.message_source import open_source
+from common.profiling import Profiler, add_profile_arguments
+
+
+def index_dump(index: AsnIndex,
+               path: str,
+               profiler: Profiler,
+               force: bool = False) -> bool:
+    # Adds the dump to the pending batch of index. Dumps whose day is
+    # already indexed are skipped unless force is set.
+    with profiler.stage('load'):
+        source = open_source(path)
+    if source is None:
+        return False
+    if not force and index.is_indexed(source.header['start_ts']):
+        profiler.count('skipped dumps')
+        return True
+    with profiler.stage('index') as stage:
+        index.add_messages(source.header['name'], source.header['start_ts'],
+                           source)
+        stage.items = source.count
+    profiler.count('messages', source.count)
+    profiler.count('indexed dumps')
+    return True
+
+
+def main() -> None:
+    desc = """Add classification dumps to the inverted ASN index, which maps
+    each dependency to the days on which it was in each class and to the
+    scopes that depended on it. Dumps that are already indexed are
+    skipped, so the index can be updated with new dumps only."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('index', help='SQLite ASN index')
+    parser.add_argument('topic', nargs='+',
+                        help='*.pickle.bz2 dump(s) or *.msgpack stream(s) of '
+                             'topic, or - to read a stream from stdin')
+    parser.add_argument('-b', '--batch', type=int, default=7,
+                        help='Number of dumps merged into the index at once '
+                             '(default: 7)')
+    parser.add_argument('--force', action='store_true',
+                        help='Index dumps again even if their day is already '
+                             'indexed. Days are only added, never removed')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profiler = Profiler.from_args(args)
+
+    success = True
+    with AsnIndex(args.index) as index:
+        for topic in args.topic:
+            if not index_dump(index, topic, profiler, args.force):
+                print(f'Error: Failed to process {topic}', file=sys.stderr)
+                success = False
+            if len(index.pending_dumps) >= args.batch:
+                with profiler.stage('merge') as stage:
+                    stage.items = index.flush()
+        with profiler.stage('merge') as stage:
+            stage.items = index.flush()
+
+    profiler.print_counters()
+    profiler.write()
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -0,0 +1,156 @@
+import base64
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from class_state import CLASSES
+
+DEFAULT_PRECISION = 14
+TMP_EXTENSION = '.tmp'
+
+
+class HyperLogLog:
+    """Cardinality sketch with 2**precision one-byte registers. The union
+    of two sketches with the same precision is the register-wise maximum,
+    so sketches of single days can be merged into any range of days. The
+    relative standard error of the estimate is 1.04 / sqrt(2**precision),
+    independent of the number of added values."""
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        if not 4 <= precision <= 18:
+            raise ValueError(f'Precision must be in [4, 18]: {precision}')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value) -> None:
+        # Values are hashed by their string representation, so the same
+        # value has to be added with the same type to all sketches.
+        x = int.from_bytes(hashlib.blake2b(str(value).encode(),
+                                           digest_size=8).digest(), 'big')
+        idx = x >> (64 - self.precision)
+        w = x & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - w.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other) -> None:
+        if other.precision != self.precision:
+            raise ValueError(f'Can not merge sketches with precision '
+                             f'{self.precision} and {other.precision}')
+        self.registers = bytearray(np.maximum(
+            np.frombuffer(self.registers, dtype=np.uint8),
+            np.frombuffer(other.registers, dtype=np.uint8)).tobytes())
+
+    def count(self) -> float:
+        m = len(self.registers)
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(
+            np.int64)))
+        zeros = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            # Linear counting is more accurate for small cardinalities.
+            estimate = m * math.log(m / zeros)
+        return float(estimate)
+
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def to_str(self) -> str:
+        return base64.b64encode(self.registers).decode()
+
+    @classmethod
+    def from_str(cls, data: str, precision: int):
+        sketch = cls(precision)
+        registers = bytearray(base64.b64decode(data))
+        if len(registers) != len(sketch.registers):
+            raise ValueError(f'Sketch has {len(registers)} registers, '
+                             f'expected {len(sketch.registers)}')
+        sketch.registers = registers
+        return sketch
+
+
+class ClassSketches:
+    """Approximate counterpart of ClassState. Keeps one HyperLogLog sketch
+    of the scopes and one of the dependencies per class, plus one of all
+    scopes and all dependencies. The memory and cache size per day or
+    period is constant, and states of any set of days can be merged
+    without decoding the dumps again."""
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        self.precision = precision
+        # Sketches of the union of all classes are stored as 'all'.
+        self.scopes = {class_name: HyperLogLog(precision)
+                       for class_name in self.get_class_names()}
+        self.dependencies = {class_name: HyperLogLog(precision)
+                             for class_name in self.get_class_names()}
+        self.dumps = 0
+
+    @staticmethod
+    def get_class_names() -> list:
+        return [class_name for key, class_name in CLASSES] + ['all']
+
+    @classmethod
+    def from_messages(cls, messages, precision: int = DEFAULT_PRECISION):
+        sketches = cls(precision)
+        sketches.dumps = 1
+        for msg in messages:
+            sketches.add_message(msg)
+        return sketches
+
+    def add_message(self, msg: dict) -> None:
+        scope = msg['scope']
+        for key, class_name in CLASSES:
+            if msg[key]:
+                self.scopes[class_name].add(scope)
+                self.scopes['all'].add(scope)
+            for entry in msg[key]:
+                self.dependencies[class_name].add(entry[0])
+                self.dependencies['all'].add(entry[0])
+
+    def merge(self, other) -> None:
+        for class_name in self.get_class_names():
+            self.scopes[class_name].merge(other.scopes[class_name])
+            self.dependencies[class_name].merge(
+                other.dependencies[class_name])
+        self.dumps += other.dumps
+
+    def get_counts(self, kind: str) -> dict:
+        # Returns the estimated number of distinct scopes or dependencies
+        # per class and of all classes ('all').
+        return {class_name: sketch.count()
+                for class_name, sketch in getattr(self, kind).items()}
+
+    def relative_error(self) -> float:
+        return self.scopes['all'].relative_error()
+
+    def write(self, output_file: str) -> None:
+        state = {'dumps': self.dumps,
+                 'precision': self.precision,
+                 'scopes': {class_name: sketch.to_str()
+                            for class_name, sketch in self.scopes.items()},
+                 'dependencies': {class_name: sketch.to_str()
+                                  for class_name, sketch
+                                  in self.dependencies.items()}}
+        tmp_file = output_file + TMP_EXTENSION
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_file, output_file)
+
+    @classmethod
+    def read(cls, input_file: str):
+        with open(input_file, 'r') as f:
+            data = json.load(f)
+        precision = data['precision']
+        sketches = cls(precision)
+        sketches.dumps = data['dumps']
+        for class_name in cls.get_class_names():
+            sketches.scopes[class_name] = \
+                HyperLogLog.from_str(data['scopes'][class_name], precision)
+            sketches.dependencies[class_name] = \
+                HyperLogLog.from_str(data['dependencies'][class_name],
+                                     precision)
+        return sketches
@@ -0,0 +1,101 @@
+import json
+import os
+
+from set_permutator import SetPermutator
+
+# Keys of the classes in the classification messages and their short names.
+CLASSES = [('equal', 'eq'), ('mismatched', 'mm'), ('bgp_only', 'bgp'),
+           ('tr_only', 'tr')]
+TMP_EXTENSION = '.tmp'
+
+
+class ClassState:
+    """Class memberships of scopes and dependencies, and the number of
+    scopes per class of each dependency, of one or more dumps. The state
+    of several dumps is the union of their memberships and the sum of
+    their counts, so states can be cached per dump and merged into
+    longer periods without decoding the dumps again."""
+
+    def __init__(self):
+        self.scopes = {class_name: set() for key, class_name in CLASSES}
+        self.dependencies = {class_name: set()
+                             for key, class_name in CLASSES}
+        # Maps each dependency to its number of scopes per class, in the
+        # order of CLASSES.
+        self.dep_counts = dict()
+        self.dumps = 0
+
+    @classmethod
+    def from_messages(cls, messages):
+        state = cls()
+        state.dumps = 1
+        for msg in messages:
+            state.add_message(msg)
+        return state
+
+    def add_message(self, msg: dict) -> None:
+        scope = msg['scope']
+        for class_idx, (key, class_name) in enumerate(CLASSES):
+            if msg[key]:
+                self.scopes[class_name].add(scope)
+            for entry in msg[key]:
+                asn = entry[0]
+                self.dependencies[class_name].add(asn)
+                counts = self.dep_counts.get(asn)
+                if counts is None:
+                    counts = self.dep_counts[asn] = [0] * len(CLASSES)
+                counts[class_idx] += 1
+
+    def merge(self, other) -> None:
+        for key, class_name in CLASSES:
+            self.scopes[class_name].update(other.scopes[class_name])
+            self.dependencies[class_name].update(
+                other.dependencies[class_name])
+        for asn, other_counts in other.dep_counts.items():
+            counts = self.dep_counts.get(asn)
+            if counts is None:
+                self.dep_counts[asn] = list(other_counts)
+                continue
+            for class_idx, count in enumerate(other_counts):
+                counts[class_idx] += count
+        self.dumps += other.dumps
+
+    def get_permutations(self, kind: str) -> dict:
+        # Returns the exclusive class combinations of the scopes or
+        # dependencies like plot-scopes.py and plot-dependencies.py.
+        permutator = SetPermutator()
+        for key, class_name in CLASSES:
+            permutator.add_class(class_name, getattr(self, kind)[class_name])
+        return permutator.get_permutations()
+
+    def write(self, output_file: str) -> None:
+        # Write to a temporary file first so that an interrupted run does
+        # not leave a truncated state behind.
+        state = {'dumps': self.dumps,
+                 'scopes': {class_name: sorted(values)
+                            for class_name, values in self.scopes.items()},
+                 'dependencies': {class_name: sorted(values)
+                                  for class_name, values
+                                  in self.dependencies.items()},
+                 # JSON only allows string keys.
+                 'dep_counts': [[asn] + counts
+                                for asn, counts
+                                in sorted(self.dep_counts.items())]}
+        tmp_file = output_file + TMP_EXTENSION
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_file, output_file)
+
+    @classmethod
+    def read(cls, input_file: str):
+        with open(input_file, 'r') as f:
+            data = json.load(f)
+        state = cls()
+        state.dumps = data['dumps']
+        for key, class_name in CLASSES:
+            state.scopes[class_name] = set(data['scopes'][class_name])
+            state.dependencies[class_name] = \
+                set(data['dependencies'][class_name])
+        state.dep_counts = {entry[0]: entry[1:]
+                            for entry in data['dep_counts']}
+        return state
@@ -0,0 +1,83 @@
+import sqlite3
+from collections import defaultdict
+
+# Kinds of class sizes. Relation classes are named
+# '<dependency class> -> <scope class>'.
+KINDS = ['scopes', 'dependencies', 'relation']
+RELATION_SEPARATOR = ' -> '
+
+
+class ClassSizeStore:
+    """Class sizes of all processed dumps in one SQLite table, keyed by
+    (topic, kind, class, timestamp), so that the history of a class can be
+    read with one indexed range query instead of parsing one CSV file per
+    dump. Timestamps are the start_ts of the dumps in milliseconds.
+    Adding the sizes of a dump again replaces the previous values."""
+
+    def __init__(self, db_file: str):
+        self.connection = sqlite3.connect(db_file)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS class_sizes ('
+            'topic TEXT NOT NULL, '
+            'kind TEXT NOT NULL, '
+            'class TEXT NOT NULL, '
+            'timestamp INTEGER NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'PRIMARY KEY (topic, kind, class, timestamp)) WITHOUT ROWID')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS class_sizes_timestamp '
+            'ON class_sizes (topic, timestamp)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, topic: str, timestamp: int, kind: str, sizes: dict) -> None:
+        # sizes maps class names to sizes.
+        if kind not in KINDS:
+            raise ValueError(f'Unknown kind: {kind}')
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO class_sizes '
+                '(topic, kind, class, timestamp, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(topic, kind, class_name, timestamp, size)
+                 for class_name, size in sizes.items()])
+
+    def query(self,
+              topic: str,
+              kind: str,
+              start_ts: int = None,
+              end_ts: int = None,
+              classes: list = None) -> dict:
+        # Returns a (timestamps, sizes) tuple of lists per class with all
+        # values in [start_ts, end_ts], sorted by timestamp.
+        query = 'SELECT class, timestamp, size FROM class_sizes ' \
+                'WHERE topic = ? AND kind = ?'
+        params = [topic, kind]
+        if start_ts is not None:
+            query += ' AND timestamp >= ?'
+            params.append(start_ts)
+        if end_ts is not None:
+            query += ' AND timestamp <= ?'
+            params.append(end_ts)
+        if classes:
+            query += f' AND class IN ({", ".join("?" * len(classes))})'
+            params += classes
+        query += ' ORDER BY class, timestamp'
+        series = defaultdict(lambda: (list(), list()))
+        for class_name, timestamp, size in self.connection.execute(query,
+                                                                   params):
+            timestamps, sizes = series[class_name]
+            timestamps.append(timestamp)
+            sizes.append(size)
+        return dict(series)
+
+    def get_topics(self) -> list:
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT topic FROM class_sizes ORDER BY topic')]
+
+    def close(self) -> None:
+        self.connection.close()
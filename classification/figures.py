@@ -0,0 +1,154 @@
+import sys
+import time
+from datetime import datetime, timezone
+from queue import Queue
+from threading import Lock, Thread
+
+from common.figures import FigureManifest, get_key
+from common.profiling import Stage
+
+TITLE_DATE_FMT = '%Y-%m-%dT%H:%M:%S'
+
+
+def get_title(header: dict) -> str:
+    # Title of the figures of a dump: its name and time range.
+    title = header['name'] + ' ' + \
+        datetime.fromtimestamp(header['start_ts'] / 1000, tz=timezone.utc) \
+        .strftime(TITLE_DATE_FMT)
+    if header['end_ts'] != header['start_ts']:
+        title += ' - ' + \
+            datetime.fromtimestamp(header['end_ts'] / 1000, tz=timezone.utc) \
+            .strftime(TITLE_DATE_FMT)
+    return title
+
+
+class ImageExporter:
+    """Writes plotly figures to image files from a queue in a background
+    thread. All figures of a process are exported by the same kaleido
+    session, which is only started once for the first figure, and figure
+    data for the next dump can be computed while images are written.
+    If a profiler is given, the export is recorded as the export stage
+    once the exporter is closed. The manifest is only accessed by the
+    calling thread and updated by write_manifest and close."""
+
+    def __init__(self,
+                 manifest: FigureManifest = None,
+                 profiler=None,
+                 max_pending: int = 8):
+        self.manifest = manifest
+        self.profiler = profiler
+        self.queue = Queue(max_pending)
+        self.exported = 0
+        self.skipped = 0
+        self.errors = list()
+        # Only updated by the export thread until it is joined.
+        self.export_stage = Stage()
+        # Output files and keys of exported figures that are not in the
+        # manifest yet.
+        self.exported_keys = list()
+        self.lock = Lock()
+        self.thread = Thread(target=self.__export, daemon=True)
+        self.thread.start()
+
+    def is_current(self, output_file: str, key: str) -> bool:
+        if self.manifest is None or not self.manifest.is_current(output_file,
+                                                                 key):
+            return False
+        self.skipped += 1
+        return True
+
+    def submit(self, fig, output_file: str, key: str = None, **kwargs) -> None:
+        # Blocks if max_pending figures are already waiting for export.
+        self.queue.put((fig, output_file, key, kwargs))
+
+    def __export(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            fig, output_file, key, kwargs = job
+            start_wall_time = time.perf_counter()
+            # The process time would include the work of the main thread.
+            start_cpu_time = time.thread_time()
+            try:
+                fig.write_image(output_file, **kwargs)
+            except Exception as e:
+                self.errors.append((output_file, e))
+                continue
+            finally:
+                self.export_stage.calls += 1
+                self.export_stage.wall_time += (time.perf_counter()
+                                                - start_wall_time)
+                self.export_stage.cpu_time += (time.thread_time()
+                                               - start_cpu_time)
+            self.exported += 1
+            self.export_stage.items += 1
+            if self.manifest is not None and key is not None:
+                with self.lock:
+                    self.exported_keys.append((output_file, key))
+
+    def write_manifest(self) -> None:
+        # Add the figures exported so far to the manifest and write it
+        # once for all of them.
+        if self.manifest is None:
+            return
+        with self.lock:
+            exported_keys = self.exported_keys
+            self.exported_keys = list()
+        for output_file, key in exported_keys:
+            self.manifest.update(output_file, key)
+        self.manifest.write()
+
+    def close(self) -> bool:
+        # Wait until all pending figures are written. Returns False if any
+        # figure could not be exported.
+        self.queue.put(None)
+        self.thread.join()
+        if self.profiler is not None:
+            self.profiler.add_stage('export', self.export_stage)
+        self.write_manifest()
+        for output_file, e in self.errors:
+            print(f'Error: Failed to export {output_file}: {e}',
+                  file=sys.stderr)
+        print(f'Exported {self.exported} figures, skipped {self.skipped} '
+              f'unchanged figures')
+        return not self.errors
+
+
+def plot_sankey(labels: list,
+                x: list,
+                y: list,
+                sources: list,
+                targets: list,
+                values: list,
+                title: str,
+                output: str,
+                exporter: ImageExporter,
+                value_suffix: str,
+                pad: int = 10,
+                size: tuple = None) -> None:
+    # Submit a Sankey diagram to exporter. value_suffix is appended to the
+    # link values and pad is the space between nodes. size is the (width,
+    # height) of the image, or None for the default size.
+    # Plotting libraries are only imported once a figure is rendered.
+    import plotly.graph_objects as go
+
+    # Only render the figure if its data changed since the last run.
+    fig_key = get_key(labels, x, y, sources, targets, values, title,
+                      value_suffix, pad, size)
+    if exporter.is_current(output, fig_key):
+        return
+    fig = go.Figure(data=[go.Sankey(valuesuffix=value_suffix,
+                                    arrangement='snap',
+                                    node={'label': labels,
+                                          'x': x,
+                                          'y': y,
+                                          'pad': pad},
+                                    link={'source': sources,
+                                          'target': targets,
+                                          'value': values})])
+    fig.update_layout(title_text=title)
+    kwargs = dict()
+    if size is not None:
+        kwargs['width'], kwargs['height'] = size
+    exporter.submit(fig, output, fig_key, **kwargs)
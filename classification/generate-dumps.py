@@ -0,0 +1,200 @@
+import argparse
+import bz2
+import os
+import pickle
+import sys
+from datetime import datetime, timedelta, timezone
+
+import msgpack
+import numpy as np
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.message_source import STREAM_EXTENSION, write_stream
+
+DATE_FMT = '%Y-%m-%d'
+RAW_FILE_TS_FMT = '%Y-%m-%dT00:00'
+RAW_FILE_FMT = '{topic}.{timestamp}.pickle.bz2'
+STREAM_FILE_FMT = '{topic}.{timestamp}' + STREAM_EXTENSION
+CLASSIFICATION_TOPIC = 'ihr_hegemony_classification'
+BGP_ONLY_TOPIC = 'ihr_hegemony_classification_bgp_only_dependencies'
+CLASSES = ['equal', 'mismatched', 'bgp_only', 'tr_only']
+DEFAULT_CLASS_MIX = 'equal=0.6,mismatched=0.2,bgp_only=0.15,tr_only=0.05'
+
+
+def parse_class_mix(arg: str) -> np.ndarray:
+    # Parse a list of class=weight pairs into probabilities in the order
+    # of CLASSES. Missing classes get weight 0.
+    weights = dict.fromkeys(CLASSES, 0.0)
+    for entry in arg.split(','):
+        class_name, weight = entry.split('=')
+        if class_name not in weights:
+            raise argparse.ArgumentTypeError(f'Unknown class: {class_name}')
+        weights[class_name] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError('Class weights sum to zero')
+    return np.array([weights[class_name] / total for class_name in CLASSES])
+
+
+def generate_messages(rng: np.random.Generator,
+                      scopes: int,
+                      deps_per_scope: float,
+                      asns: int,
+                      class_mix: np.ndarray,
+                      unique_ips_mean: float) -> (list, list):
+    # Returns the decoded classification and bgp-only messages of one
+    # dump. Dependencies are drawn from a Zipf-like popularity
+    # distribution, so that a few ASes are dependencies of many scopes
+    # like in the real data. Each bgp_only dependency of the
+    # classification gets a bgp-only message with a geometrically
+    # distributed number of unique IPs.
+    asn_pool = rng.choice(np.arange(1, 400000), asns, replace=False)
+    popularity = 1 / np.arange(1, asns + 1)
+    popularity /= popularity.sum()
+    scope_pool = rng.choice(np.arange(1, 400000), scopes, replace=False)
+    classification = list()
+    bgp_only = list()
+    for scope in scope_pool:
+        scope = int(scope)
+        msg = {'scope': str(scope),
+               'equal': list(),
+               'mismatched': list(),
+               'bgp_only': list(),
+               'tr_only': list()}
+        dep_count = min(asns, 1 + rng.poisson(max(deps_per_scope - 1, 0)))
+        deps = rng.choice(asn_pool, dep_count, replace=False, p=popularity)
+        dep_classes = rng.choice(len(CLASSES), dep_count, p=class_mix)
+        for rank, (asn, class_idx) in enumerate(zip(deps, dep_classes)):
+            asn = int(asn)
+            bgp_score = float(rng.random())
+            tr_score = float(rng.random())
+            class_name = CLASSES[class_idx]
+            if class_name == 'equal':
+                msg[class_name].append([asn, bgp_score, rank, tr_score, rank,
+                                        rank])
+            elif class_name == 'mismatched':
+                msg[class_name].append([asn, bgp_score, rank, rank + 1,
+                                        tr_score, rank + 1, rank])
+            elif class_name == 'bgp_only':
+                msg[class_name].append([asn, bgp_score, rank])
+                bgp_only.append({'scope': str(scope),
+                                 'asn': asn,
+                                 'score': bgp_score,
+                                 'unique_ips': int(rng.geometric(
+                                     1 / max(unique_ips_mean, 1)))})
+            else:
+                msg[class_name].append([asn, tr_score, rank])
+        classification.append(msg)
+    return classification, bgp_only
+
+
+def write_dump(output_file: str, topic: str, ts: int, messages: list) -> None:
+    data = {'name': topic,
+            'start_ts': ts,
+            'end_ts': ts,
+            'messages': [(ts, msgpack.packb(msg)) for msg in messages]}
+    with bz2.open(output_file, 'wb') as f:
+        pickle.dump(data, f)
+
+
+def write_stream_file(output_file: str,
+                      topic: str,
+                      ts: int,
+                      messages: list) -> None:
+    # Writes the messages as an uncompressed message stream, like a
+    # consumer of the message bus would instead of the dump.
+    with open(output_file, 'wb') as f:
+        write_stream(f, {'name': topic, 'start_ts': ts, 'end_ts': ts},
+                     ((ts, msgpack.packb(msg)) for msg in messages))
+
+
+def generate_dumps(output_dir: str,
+                   start: datetime,
+                   days: int,
+                   scopes: int,
+                   deps_per_scope: float,
+                   asns: int,
+                   class_mix: np.ndarray,
+                   unique_ips_mean: float,
+                   seed: int,
+                   bgp_only: bool = True,
+                   stream: bool = False) -> list:
+    # Writes one classification dump (and bgp-only dump) per day and
+    # returns the written files. If stream is True, message streams are
+    # written instead of dumps.
+    if not output_dir.endswith('/'):
+        output_dir += '/'
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    written = list()
+    for day in range(days):
+        timestamp = start + timedelta(days=day)
+        ts = int(timestamp.timestamp() * 1000)
+        classification, bgp_only_msgs = \
+            generate_messages(rng, scopes, deps_per_scope, asns, class_mix,
+                              unique_ips_mean)
+        topics = [(CLASSIFICATION_TOPIC, classification)]
+        if bgp_only:
+            topics.append((BGP_ONLY_TOPIC, bgp_only_msgs))
+        file_fmt = RAW_FILE_FMT
+        write = write_dump
+        if stream:
+            file_fmt = STREAM_FILE_FMT
+            write = write_stream_file
+        for topic, messages in topics:
+            output_file = output_dir + file_fmt.format(
+                topic=topic, timestamp=timestamp.strftime(RAW_FILE_TS_FMT))
+            write(output_file, topic, ts, messages)
+            written.append(output_file)
+    return written
+
+
+def main() -> None:
+    desc = """Write synthetic classification and bgp-only dumps in the
+    format of the raw topic dumps, e.g., for benchmarks."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('output_dir')
+    parser.add_argument('-s', '--scopes', type=int, default=1000,
+                        help='Number of scopes per dump')
+    parser.add_argument('-d', '--deps-per-scope', type=float, default=10,
+                        help='Mean number of dependencies per scope')
+    parser.add_argument('-a', '--asns', type=int, default=5000,
+                        help='Number of distinct dependency ASes')
+    parser.add_argument('-m', '--class-mix', type=parse_class_mix,
+                        default=DEFAULT_CLASS_MIX,
+                        help=f'Relative frequency of the dependency classes '
+                             f'(default: {DEFAULT_CLASS_MIX})')
+    parser.add_argument('-u', '--unique-ips-mean', type=float, default=5,
+                        help='Mean number of unique IPs of bgp-only '
+                             'dependencies')
+    parser.add_argument('-n', '--days', type=int, default=1,
+                        help='Number of daily dumps')
+    parser.add_argument('--start', default='2021-03-01',
+                        help='Date of the first dump (YYYY-MM-DD)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-bgp-only', action='store_true',
+                        help='Only write classification dumps')
+    parser.add_argument('--stream', action='store_true',
+                        help=f'Write uncompressed {STREAM_EXTENSION} message '
+                             f'streams instead of dumps')
+
+    args = parser.parse_args()
+
+    if args.scopes <= 0 or args.asns <= 0 or args.days <= 0:
+        print('Error: Number of scopes, ASes and days must be positive',
+              file=sys.stderr)
+        sys.exit(1)
+    start = datetime.strptime(args.start, DATE_FMT) \
+        .replace(tzinfo=timezone.utc)
+    for output_file in generate_dumps(args.output_dir, start, args.days,
+                                      args.scopes, args.deps_per_scope,
+                                      args.asns, args.class_mix,
+                                      args.unique_ips_mean, args.seed,
+                                      not args.no_bgp_only, args.stream):
+        print(f'Wrote {output_file}')
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -1,15 +1,16 @@
 #!/bin/bash
 set -euo pipefail
 
-if [ ! $# -eq 1 ]
+if [ $# -lt 1 ]
 then
-    echo "usage: $0 <topic-dump>"
+    echo "usage: $0 <topic-dump>..."
     exit 1
 fi
 
-readonly DUMP=$1
+# All dumps are processed by one process per script, so that the figure
+# export session is only started once.
 
-python3 plot-scopes.py -f figs/weekly/ -d data/weekly/ "$DUMP"
-python3 plot-dependencies.py -f figs/weekly/ -d data/weekly/ "$DUMP"
-python3 plot-dependency-scope-relation.py -f figs/weekly/ -d data/weekly/ "$DUMP"
+python3 plot-scopes.py -f figs/weekly/ -d data/weekly/ "$@"
+python3 plot-dependencies.py -f figs/weekly/ -d data/weekly/ "$@"
+python3 plot-dependency-scope-relation.py -f figs/weekly/ -d data/weekly/ "$@"
 
@@ -1,19 +1,19 @@
 import argparse
-import bz2
 import os
-import pickle
 import sys
 from collections import defaultdict
 from itertools import permutations
 
-import matplotlib.pyplot as plt
-import msgpack
 import numpy as np
 
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.figures import FigureManifest, import_pyplot, render_figures
+from common.message_source import open_source
+from common.profiling import Profiler, add_profile_arguments
 from set_permutator import SetPermutator
 
 DATE_FMT = '%Y-%m-%dT%H:%M:%S'
-INPUT_EXTENSION = '.pickle.bz2'
 DATA_OUTPUT_EXTENSION = '.csv'
 DATA_OUTPUT_DELIMITER = ','
 FIG_OUTPUT_EXTENSION = '.svg'
@@ -32,12 +32,11 @@ scope_info = dict()
 dep_info = defaultdict(lambda: {'eq': 0, 'mm': 0, 'bgp': 0, 'tr': 0})
 
 
-def plot_ratio(class_name: str, data: set, output: str, mode: str) -> None:
+def get_ratios(class_name: str, data: set, mode: str) -> dict:
     x_vals = dict()
-    print(class_name)
     classes = class_name.split()
     if len(classes) == 1:
-        return
+        return x_vals
     for class_name in classes:
         if mode == 'scope':
             x_vals[class_name] = [scope_info[scope][class_name]
@@ -48,14 +47,19 @@ def plot_ratio(class_name: str, data: set, output: str, mode: str) -> None:
                                   / sum(dep_info[dep].values())
                                   for dep in data]
     for class_name in x_vals:
-        print(f'{class_name}: {len(x_vals[class_name])}')
+        x_vals[class_name].sort()
+    return x_vals
+
+
+def plot_ratio(x_vals: dict, output: str) -> None:
     p_vals = None
     for x_val in x_vals.values():
-        x_val.sort()
         if p_vals is None:
             p_vals = (np.arange(len(x_val)) + 1) / len(x_val)
 
+    plt = import_pyplot()
     fa = plt.subplots()
+    fig: plt.Figure = fa[0]
     ax: plt.Axes = fa[1]
     for class_name, x_val in x_vals.items():
         ax.plot(x_val, p_vals, '-', label=class_name)
@@ -69,7 +73,8 @@ def plot_ratio(class_name: str, data: set, output: str, mode: str) -> None:
     ax.set_xlabel('ratio')
     ax.grid()
     # plt.show()
-    plt.savefig(output, bbox_inches='tight')
+    fig.savefig(output, bbox_inches='tight')
+    plt.close(fig)
 
 
 def check_bias(combined_class_name: str,
@@ -101,15 +106,25 @@ def check_bias(combined_class_name: str,
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('topic', help='*.pickle.bz2 dump of topic')
+    parser.add_argument('topic',
+                        help='*.pickle.bz2 dump or *.msgpack stream of topic, '
+                             'or - to read a stream from stdin')
     parser.add_argument('-f', '--fig-output', help='Figure output directory',
                         default='./')
     parser.add_argument('-d', '--data-output', help='Data output directory',
                         default='./')
     parser.add_argument('-b', '--bias-threshold', type=float)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of processes used to render figures '
+                             '(default: number of CPUs)')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='Do not plot class ratios')
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
 
+    profiler = Profiler.from_args(args)
+
     fig_output_dir: str = args.fig_output
     if not fig_output_dir.endswith('/'):
         fig_output_dir += '/'
@@ -120,63 +135,65 @@ if __name__ == '__main__':
 
     bias_threshold = args.bias_threshold
 
-    if not args.topic.endswith(INPUT_EXTENSION):
-        print(f'Error: Expected {INPUT_EXTENSION} input file, but got '
-              f'{args.topic}', file=sys.stderr)
+    with profiler.stage('load'):
+        source = open_source(args.topic)
+    if source is None:
         sys.exit(1)
 
-    with bz2.open(args.topic, 'r') as f:
-        data = pickle.load(f)
-    for msg in data['messages']:
-        msg_data = msgpack.loads(msg[1])
-        scope = msg_data['scope']
-        if scope not in sall:
-            sall.add(scope)
-        if len(msg_data['equal']):
-            se.add(scope)
-        if len(msg_data['mismatched']):
-            sm.add(scope)
-        if len(msg_data['bgp_only']):
-            sb.add(scope)
-        if len(msg_data['tr_only']):
-            st.add(scope)
-        scope_info[scope] = {'eq': len(msg_data['equal']),
-                             'mm': len(msg_data['mismatched']),
-                             'bgp': len(msg_data['bgp_only']),
-                             'tr': len(msg_data['tr_only'])}
-        for asn, bgp_score, bgp_rank, tr_score, tr_rank, comp_rank \
-                in msg_data['equal']:
-            if asn not in dall:
-                dall.add(asn)
-            if asn not in de:
-                de.add(asn)
-            dep_info[asn]['eq'] += 1
-        for asn, bgp_score, bgp_rank, bgp_comp_rank, tr_score, tr_rank, \
-            tr_comp_rank in msg_data['mismatched']:
-            if asn not in dall:
-                dall.add(asn)
-            if asn not in dm:
-                dm.add(asn)
-            dep_info[asn]['mm'] += 1
-        for asn, score, rank in msg_data['bgp_only']:
-            if asn not in dall:
-                dall.add(asn)
-            if asn not in db:
-                db.add(asn)
-            dep_info[asn]['bgp'] += 1
-        for asn, score, rank in msg_data['tr_only']:
-            if asn not in dall:
-                dall.add(asn)
-            if asn not in dt:
-                dt.add(asn)
-            dep_info[asn]['tr'] += 1
+    # Messages are classified while they are read from the source.
+    with profiler.stage('classify') as stage:
+        for msg_data in source:
+            scope = msg_data['scope']
+            if scope not in sall:
+                sall.add(scope)
+            if len(msg_data['equal']):
+                se.add(scope)
+            if len(msg_data['mismatched']):
+                sm.add(scope)
+            if len(msg_data['bgp_only']):
+                sb.add(scope)
+            if len(msg_data['tr_only']):
+                st.add(scope)
+            scope_info[scope] = {'eq': len(msg_data['equal']),
+                                 'mm': len(msg_data['mismatched']),
+                                 'bgp': len(msg_data['bgp_only']),
+                                 'tr': len(msg_data['tr_only'])}
+            for asn, bgp_score, bgp_rank, tr_score, tr_rank, comp_rank \
+                    in msg_data['equal']:
+                if asn not in dall:
+                    dall.add(asn)
+                if asn not in de:
+                    de.add(asn)
+                dep_info[asn]['eq'] += 1
+            for asn, bgp_score, bgp_rank, bgp_comp_rank, tr_score, tr_rank, \
+                tr_comp_rank in msg_data['mismatched']:
+                if asn not in dall:
+                    dall.add(asn)
+                if asn not in dm:
+                    dm.add(asn)
+                dep_info[asn]['mm'] += 1
+            for asn, score, rank in msg_data['bgp_only']:
+                if asn not in dall:
+                    dall.add(asn)
+                if asn not in db:
+                    db.add(asn)
+                dep_info[asn]['bgp'] += 1
+            for asn, score, rank in msg_data['tr_only']:
+                if asn not in dall:
+                    dall.add(asn)
+                if asn not in dt:
+                    dt.add(asn)
+                dep_info[asn]['tr'] += 1
+        stage.items = source.count
+    profiler.count('messages', source.count)
 
     spermutator = SetPermutator()
     spermutator.add_class('eq', se)
     spermutator.add_class('mm', sm)
     spermutator.add_class('bgp', sb)
     spermutator.add_class('tr', st)
-    sclass_permutations = spermutator.get_permutations()
+    with profiler.stage('partition'):
+        sclass_permutations = spermutator.get_permutations()
     # Sanity checks
     for a, b in permutations(sclass_permutations.values(), 2):
         if not a.isdisjoint(b):
@@ -195,7 +212,8 @@ if __name__ == '__main__':
     dpermutator.add_class('mm', dm)
     dpermutator.add_class('bgp', db)
     dpermutator.add_class('tr', dt)
-    dclass_permutations = dpermutator.get_permutations()
+    with profiler.stage('partition'):
+        dclass_permutations = dpermutator.get_permutations()
     # Sanity checks
     for a, b in permutations(dclass_permutations.values(), 2):
         if not a.isdisjoint(b):
@@ -209,31 +227,48 @@ if __name__ == '__main__':
               f'{dall - all_check}')
         sys.exit(1)
 
-    output_file_prefix = os.path.basename(args.topic)[:-len(INPUT_EXTENSION)]
-
-    os.makedirs(fig_output_dir, exist_ok=True)
+    output_file_prefix = source.prefix
 
-    sclasses = spermutator.get_permutations()
-    print('\nscopes')
-    for class_name, scopes in sclasses.items():
-        fig_output_file = fig_output_dir + 'class_ratios_scopes.' + \
-                          class_name.replace(' ', '_') + '.' + \
-                          output_file_prefix + FIG_OUTPUT_EXTENSION
-        plot_ratio(class_name, scopes, fig_output_file, 'scope')
+    # The ratios are only used for the figures.
+    plot_jobs = list()
+    if not args.no_figures:
+        os.makedirs(fig_output_dir, exist_ok=True)
+        sclasses = spermutator.get_permutations()
+        for class_name, scopes in sclasses.items():
+            fig_output_file = fig_output_dir + 'class_ratios_scopes.' + \
+                              class_name.replace(' ', '_') + '.' + \
+                              output_file_prefix + FIG_OUTPUT_EXTENSION
+            with profiler.stage('ratios') as stage:
+                x_vals = get_ratios(class_name, scopes, 'scope')
+                stage.items = len(scopes)
+            if x_vals:
+                plot_jobs.append((x_vals, fig_output_file))
 
     dclasses = dpermutator.get_permutations()
-    print('\ndependencies')
     biased = dict()
     for class_name, dependencies in dclasses.items():
-        fig_output_file = fig_output_dir + 'class_ratios_dependencies.' + \
-                          class_name.replace(' ', '_') + '.' + \
-                          output_file_prefix + FIG_OUTPUT_EXTENSION
-        plot_ratio(class_name, dependencies, fig_output_file, 'dependency')
+        if not args.no_figures:
+            fig_output_file = fig_output_dir + \
+                              'class_ratios_dependencies.' + \
+                              class_name.replace(' ', '_') + '.' + \
+                              output_file_prefix + FIG_OUTPUT_EXTENSION
+            with profiler.stage('ratios') as stage:
+                x_vals = get_ratios(class_name, dependencies, 'dependency')
+                stage.items = len(dependencies)
+            if x_vals:
+                plot_jobs.append((x_vals, fig_output_file))
         if bias_threshold:
-            bias = check_bias(class_name, dependencies, 'dependency',
-                              bias_threshold)
+            with profiler.stage('bias') as stage:
+                bias = check_bias(class_name, dependencies, 'dependency',
+                                  bias_threshold)
+                stage.items = len(dependencies)
             if bias:
                 biased[class_name] = bias
+    if not args.no_figures:
+        with profiler.stage('render') as stage:
+            render_figures(plot_ratio, plot_jobs, args.jobs,
+                           FigureManifest(fig_output_dir))
+            stage.items = len(plot_jobs)
     if bias_threshold:
         bias_file = data_output_dir + 'biased_dependencies_' + \
                     str(bias_threshold) + DATA_OUTPUT_EXTENSION
@@ -243,4 +278,6 @@ if __name__ == '__main__':
                 print(subclass, entries)
             print()
 
+    profiler.print_counters()
+    profiler.write()
     sys.exit(0)
@@ -0,0 +1,201 @@
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from class_store import KINDS, RELATION_SEPARATOR, ClassSizeStore
+from common.figures import import_pyplot
+from common.profiling import Profiler, add_profile_arguments
+
+DATE_FMT = '%Y-%m-%d'
+RAW_FILE_TS_FMT = '%Y-%m-%dT%H:%M'
+DATA_OUTPUT_EXTENSION = '.csv'
+DATA_OUTPUT_DELIMITER = ','
+FIG_OUTPUT_EXTENSION = '.pdf'
+OUTPUT_FILE = 'class-trend.{kind}.{topic}.{start_ts}--{end_ts}'
+# Prefixes of the per-dump CSV files written by the report scripts.
+CSV_PREFIXES = {'scopes.': 'scopes',
+                'dependencies.': 'dependencies',
+                'dependency-scope-relation-matrix.': 'relation'}
+
+
+def parse_timestamp_argument(arg: str) -> int:
+    return int(datetime.strptime(arg, DATE_FMT)
+               .replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def format_timestamp(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc) \
+        .strftime(RAW_FILE_TS_FMT)
+
+
+def read_class_csv(input_file: str, kind: str) -> dict:
+    # Returns the class sizes of a CSV file written by plot-scopes.py,
+    # plot-dependencies.py or plot-dependency-scope-relation.py.
+    sizes = dict()
+    with open(input_file, 'r') as f:
+        header = f.readline().rstrip('\n').split(DATA_OUTPUT_DELIMITER)
+        for line in f:
+            values = line.rstrip('\n').split(DATA_OUTPUT_DELIMITER)
+            if kind == 'relation':
+                for scope_class, size in zip(header[1:], values[1:]):
+                    sizes[values[0] + RELATION_SEPARATOR + scope_class] = \
+                        int(size)
+            elif values[0] != 'all':
+                sizes[values[0]] = int(values[1])
+    return sizes
+
+
+def import_csv_dir(store: ClassSizeStore, input_dir: str) -> int:
+    # Adds the class sizes of all per-dump CSV files in input_dir to the
+    # store. File names are <prefix>.<topic>.<timestamp>.csv. Returns the
+    # number of imported files.
+    imported = 0
+    for file_name in sorted(os.listdir(input_dir)):
+        if not file_name.endswith(DATA_OUTPUT_EXTENSION):
+            continue
+        for prefix, kind in CSV_PREFIXES.items():
+            if file_name.startswith(prefix):
+                break
+        else:
+            continue
+        name = file_name[len(prefix):-len(DATA_OUTPUT_EXTENSION)]
+        topic, sep, ts = name.rpartition('.')
+        try:
+            timestamp = datetime.strptime(ts, RAW_FILE_TS_FMT) \
+                .replace(tzinfo=timezone.utc)
+        except ValueError:
+            print(f'Warning: Skipping {file_name}: Unexpected timestamp',
+                  file=sys.stderr)
+            continue
+        store.add(topic, int(timestamp.timestamp() * 1000), kind,
+                  read_class_csv(os.path.join(input_dir, file_name), kind))
+        imported += 1
+    return imported
+
+
+def write_trends(series: dict, output_file: str) -> list:
+    # Writes one row per class and one column per timestamp. Returns the
+    # sorted timestamps.
+    timestamps = sorted({timestamp
+                         for class_timestamps, sizes in series.values()
+                         for timestamp in class_timestamps})
+    with open(output_file, 'w') as f:
+        f.write(DATA_OUTPUT_DELIMITER.join(
+            ['class'] + list(map(format_timestamp, timestamps))) + '\n')
+        for class_name, (class_timestamps, sizes) in series.items():
+            values = dict(zip(class_timestamps, sizes))
+            f.write(DATA_OUTPUT_DELIMITER.join(
+                [class_name] + [str(values.get(timestamp, ''))
+                                for timestamp in timestamps]) + '\n')
+    return timestamps
+
+
+def plot_trends(series: dict, kind: str, title: str, output: str) -> None:
+    plt = import_pyplot()
+    fa = plt.subplots(figsize=(10, 5))
+    fig: plt.Figure = fa[0]
+    ax: plt.Axes = fa[1]
+    for class_name, (timestamps, sizes) in series.items():
+        dates = [datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+                 for timestamp in timestamps]
+        ax.plot(dates, sizes, label=class_name)
+    ax.set_ylim(ymin=0)
+    ax.set_ylabel(kind)
+    ax.set_title(title)
+    ax.legend(loc='upper left', bbox_to_anchor=(1, 1), fontsize='small')
+    fig.autofmt_xdate()
+    fig.savefig(output, bbox_inches='tight')
+    plt.close(fig)
+
+
+def main() -> None:
+    desc = """Query the class sizes of a topic over a time range from the
+    time-series store written by plot-scopes.py, plot-dependencies.py and
+    plot-dependency-scope-relation.py (--store) and plot their trend."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('store', help='SQLite time-series store')
+    parser.add_argument('topic')
+    parser.add_argument('-k', '--kind', choices=KINDS, default='scopes',
+                        help='Kind of class sizes (default: scopes)')
+    parser.add_argument('--start', help='First day (YYYY-MM-DD)')
+    parser.add_argument('--end', help='Last day (YYYY-MM-DD)')
+    parser.add_argument('-c', '--classes',
+                        type=lambda arg: arg.split(','),
+                        help='Comma-separated list of classes (default: all)')
+    parser.add_argument('-i', '--import-dir', action='append', default=[],
+                        help='Add the per-dump CSV files in this directory '
+                             'to the store first. Can be given more than '
+                             'once')
+    parser.add_argument('-f', '--fig-output', help='Figure output directory',
+                        default='./')
+    parser.add_argument('-d', '--data-output', help='Data output directory',
+                        default='./')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='Only write data files')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profiler = Profiler.from_args(args)
+
+    fig_output_dir: str = args.fig_output
+    if not fig_output_dir.endswith('/'):
+        fig_output_dir += '/'
+
+    data_output_dir = args.data_output
+    if not data_output_dir.endswith('/'):
+        data_output_dir += '/'
+
+    start_ts = None
+    if args.start:
+        start_ts = parse_timestamp_argument(args.start)
+    end_ts = None
+    if args.end:
+        # Include all dumps of the last day.
+        end_ts = parse_timestamp_argument(args.end) + 24 * 60 * 60 * 1000 - 1
+
+    with ClassSizeStore(args.store) as store:
+        for input_dir in args.import_dir:
+            with profiler.stage('import') as stage:
+                stage.items = import_csv_dir(store, input_dir)
+            profiler.count('imported files', stage.items)
+        with profiler.stage('query') as stage:
+            series = store.query(args.topic, args.kind, start_ts, end_ts,
+                                 args.classes)
+            stage.items = sum(len(timestamps)
+                              for timestamps, sizes in series.values())
+    if not series:
+        print(f'Error: No {args.kind} class sizes of {args.topic} in range',
+              file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(data_output_dir, exist_ok=True)
+    output_name = None
+    with profiler.stage('output'):
+        tmp_output = data_output_dir + OUTPUT_FILE.format(
+            kind=args.kind, topic=args.topic, start_ts='', end_ts='') + '.tmp'
+        timestamps = write_trends(series, tmp_output)
+        output_name = OUTPUT_FILE.format(
+            kind=args.kind,
+            topic=args.topic,
+            start_ts=format_timestamp(timestamps[0]),
+            end_ts=format_timestamp(timestamps[-1]))
+        os.replace(tmp_output,
+                   data_output_dir + output_name + DATA_OUTPUT_EXTENSION)
+
+    if not args.no_figures:
+        os.makedirs(fig_output_dir, exist_ok=True)
+        with profiler.stage('render') as stage:
+            plot_trends(series, args.kind, args.topic,
+                        fig_output_dir + output_name + FIG_OUTPUT_EXTENSION)
+            stage.items = 1
+
+    profiler.print_counters()
+    profiler.write()
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
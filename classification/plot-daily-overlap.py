@@ -1,25 +1,25 @@
 import argparse
-import bz2
+import json
 import os
-import pickle
 import sys
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from datetime import datetime, timedelta
 
-from matplotlib import rcParams
-import matplotlib.colors
-import matplotlib.pyplot as plt
-import msgpack
 import numpy as np
 
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.figures import FigureManifest, import_pyplot, render_figures
+from common.message_source import MessageSource, get_raw_file, open_source
+from common.profiling import Profiler, add_profile_arguments
 from set_permutator import SetPermutator
 
 DATE_FMT = '%Y-%m-%d'
-RAW_FILE_TS_FMT = '%Y-%m-%dT00:00'
-RAW_FILE_FMT = '{topic}.{timestamp}.pickle.bz2'
 OUTPUT_DELIMITER = ','
 OUTPUT_EXTENSION = '.csv'
 OUTPUT_FILE = '{prefix}.{topic}.{start_ts}--{end_ts}' + OUTPUT_EXTENSION
+CHECKPOINT_FILE = '.overlap-checkpoint.{topic}.{start_ts}.json'
+TMP_EXTENSION = '.tmp'
 
 ScopeDepPair = namedtuple('ScopeDepPair', 'scopes dependencies')
 OverlapPair = namedtuple('OverlapPair', 'absolute percentage')
@@ -32,18 +32,18 @@ def parse_timestamp_argument(arg: str) -> datetime:
     return datetime.strptime(arg, DATE_FMT)
 
 
-def get_raw_file(raw_folder: str, topic: str, timestamp: datetime) -> str:
-    file_name = \
-        RAW_FILE_FMT.format(topic=topic,
-                            timestamp=timestamp.strftime(RAW_FILE_TS_FMT))
-    ret = raw_folder + file_name
-    if not os.path.exists(ret):
-        print(f'Error: File not found: {ret}', file=sys.stderr)
-        return str()
-    return ret
+def process_raw_file(raw_file: str,
+                     profiler: Profiler) -> (SetPermutator, SetPermutator):
+    # Returns None if the file could not be opened.
+    with profiler.stage('load'):
+        source = open_source(raw_file)
+    if source is None:
+        return None
+    return process_source(source, profiler)
 
 
-def process_raw_file(raw_file: str) -> (SetPermutator, SetPermutator):
+def process_source(source: MessageSource,
+                   profiler: Profiler) -> (SetPermutator, SetPermutator):
     se = set()
     sm = set()
     sb = set()
@@ -52,33 +52,34 @@ def process_raw_file(raw_file: str) -> (SetPermutator, SetPermutator):
     dm = set()
     db = set()
     dt = set()
-    with bz2.open(raw_file, 'rb') as f:
-        data = pickle.load(f)
-    for msg in data['messages']:
-        msg_data = msgpack.loads(msg[1])
-        scope = int(msg_data['scope'])
-        if len(msg_data['equal']):
-            se.add(scope)
-        if len(msg_data['mismatched']):
-            sm.add(scope)
-        if len(msg_data['bgp_only']):
-            sb.add(scope)
-        if len(msg_data['tr_only']):
-            st.add(scope)
-        for asn, bgp_score, bgp_rank, tr_score, tr_rank, comp_rank \
-                in msg_data['equal']:
-            if asn not in de:
-                de.add(asn)
-        for asn, bgp_score, bgp_rank, bgp_comp_rank, tr_score, tr_rank, \
-            tr_comp_rank in msg_data['mismatched']:
-            if asn not in dm:
-                dm.add(asn)
-        for asn, score, rank in msg_data['bgp_only']:
-            if asn not in db:
-                db.add(asn)
-        for asn, score, rank in msg_data['tr_only']:
-            if asn not in dt:
-                dt.add(asn)
+    # Messages are classified while they are read from the source.
+    with profiler.stage('classify') as stage:
+        for msg_data in source:
+            scope = int(msg_data['scope'])
+            if len(msg_data['equal']):
+                se.add(scope)
+            if len(msg_data['mismatched']):
+                sm.add(scope)
+            if len(msg_data['bgp_only']):
+                sb.add(scope)
+            if len(msg_data['tr_only']):
+                st.add(scope)
+            for asn, bgp_score, bgp_rank, tr_score, tr_rank, comp_rank \
+                    in msg_data['equal']:
+                if asn not in de:
+                    de.add(asn)
+            for asn, bgp_score, bgp_rank, bgp_comp_rank, tr_score, tr_rank, \
+                tr_comp_rank in msg_data['mismatched']:
+                if asn not in dm:
+                    dm.add(asn)
+            for asn, score, rank in msg_data['bgp_only']:
+                if asn not in db:
+                    db.add(asn)
+            for asn, score, rank in msg_data['tr_only']:
+                if asn not in dt:
+                    dt.add(asn)
+        stage.items = source.count
+    profiler.count('messages', source.count)
     spermutator = SetPermutator()
     spermutator.add_class('eq', se)
     spermutator.add_class('mm', sm)
@@ -92,34 +93,134 @@ def process_raw_file(raw_file: str) -> (SetPermutator, SetPermutator):
     return ScopeDepPair(spermutator, dpermutator)
 
 
-def calculate_overlap(data: dict) -> (list, dict):
-    dates = None
-    overlap_per_class = dict()
-    for class_name in data:
-        prev_set = None
-        overlap_abs = list()
-        overlap_percentage = list()
-        if dates is None:
-            dates = list(data[class_name].keys())
-            dates.sort()
-        for date in dates:
-            if prev_set is None:
-                prev_set = data[class_name][date]
-                continue
-            overlap = prev_set.intersection(data[class_name][date])
-            overlap_abs.append(len(overlap))
-            if len(prev_set) == 0:
-                overlap_percentage.append(0)
-            else:
-                overlap_percentage.append(100 / len(prev_set) * len(overlap))
-            prev_set = data[class_name][date]
-        overlap_per_class[class_name] = OverlapPair(overlap_abs,
-                                                    overlap_percentage)
-    return dates, overlap_per_class
+class OverlapSeries:
+    """Overlap of the class sets (e.g., of scopes or dependencies) of
+    consecutive days. Days are added in order and only the sets of the
+    last day are kept, so the series can be extended one day at a time."""
+
+    def __init__(self):
+        self.dates = list()
+        self.absolute = dict()
+        self.percentage = dict()
+        self.prev_sets = None
+
+    def add(self, date_key: str, class_sets: dict) -> None:
+        if self.dates and date_key <= self.dates[-1]:
+            raise ValueError(f'Date {date_key} is not after {self.dates[-1]}')
+        if self.prev_sets is None:
+            for class_name in class_sets:
+                self.absolute[class_name] = list()
+                self.percentage[class_name] = list()
+        else:
+            for class_name, prev_set in self.prev_sets.items():
+                overlap = prev_set.intersection(
+                    class_sets.get(class_name, set()))
+                self.absolute[class_name].append(len(overlap))
+                if len(prev_set) == 0:
+                    self.percentage[class_name].append(0)
+                else:
+                    self.percentage[class_name].append(
+                        100 / len(prev_set) * len(overlap))
+        self.dates.append(date_key)
+        self.prev_sets = class_sets
+
+    def get_overlap(self) -> dict:
+        return {class_name: OverlapPair(self.absolute[class_name],
+                                        self.percentage[class_name])
+                for class_name in self.absolute}
+
+    def to_dict(self) -> dict:
+        prev_sets = None
+        if self.prev_sets is not None:
+            prev_sets = {class_name: sorted(values)
+                         for class_name, values in self.prev_sets.items()}
+        return {'dates': self.dates,
+                'absolute': self.absolute,
+                'percentage': self.percentage,
+                'prev_sets': prev_sets}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        series = cls()
+        series.dates = data['dates']
+        series.absolute = data['absolute']
+        series.percentage = data['percentage']
+        if data['prev_sets'] is not None:
+            series.prev_sets = {class_name: set(values)
+                                for class_name, values
+                                in data['prev_sets'].items()}
+        return series
+
+
+def get_overlap_files(series: OverlapSeries,
+                      prefix: str,
+                      topic: str,
+                      data_folder: str) -> dict:
+    # Returns the output file of the absolute and percentage overlap.
+    output_files = dict()
+    for kind in ['absolute', 'percentage']:
+        output_files[kind] = data_folder + \
+            OUTPUT_FILE.format(prefix=f'{prefix}_overlap_{kind}',
+                               topic=topic,
+                               start_ts=series.dates[0],
+                               end_ts=series.dates[-1])
+    return output_files
+
+
+def write_overlap(series: OverlapSeries,
+                  prefix: str,
+                  topic: str,
+                  data_folder: str) -> None:
+    # Write the absolute and percentage overlap of the series to one file
+    # each.
+    output_files = get_overlap_files(series, prefix, topic, data_folder)
+    for kind, data_output in output_files.items():
+        values = getattr(series, kind)
+        with open(data_output, 'w') as f:
+            f.write(OUTPUT_DELIMITER.join(['class'] + series.dates) + '\n')
+            for class_name in values:
+                f.write(OUTPUT_DELIMITER.join(
+                    map(str, [class_name] + values[class_name])) + '\n')
+
+
+def write_checkpoint(checkpoint_file: str,
+                     topic: str,
+                     scope_series: OverlapSeries,
+                     dep_series: OverlapSeries) -> None:
+    # Write to a temporary file first so that an interrupted run does
+    # not leave a truncated checkpoint behind.
+    tmp_file = checkpoint_file + TMP_EXTENSION
+    with open(tmp_file, 'w') as f:
+        json.dump({'topic': topic,
+                   'scope_series': scope_series.to_dict(),
+                   'dep_series': dep_series.to_dict()}, f)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def read_checkpoint(checkpoint_file: str, topic: str) \
+        -> (OverlapSeries, OverlapSeries):
+    # Returns the scope and dependency series of the checkpoint, or None
+    # if there is no valid checkpoint.
+    if not os.path.exists(checkpoint_file):
+        print(f'Warning: No checkpoint found: {checkpoint_file}',
+              file=sys.stderr)
+        return None
+    with open(checkpoint_file, 'r') as f:
+        checkpoint = json.load(f)
+    scope_series = OverlapSeries.from_dict(checkpoint['scope_series'])
+    dep_series = OverlapSeries.from_dict(checkpoint['dep_series'])
+    if checkpoint['topic'] != topic or not scope_series.dates \
+            or scope_series.dates != dep_series.dates:
+        print(f'Warning: Ignoring invalid checkpoint {checkpoint_file}',
+              file=sys.stderr)
+        return None
+    return scope_series, dep_series
 
 
 def plot_percentage(dates: list, data: dict, output: str) -> None:
+    plt = import_pyplot()
     fa = plt.subplots()
+    fig: plt.Figure = fa[0]
     ax: plt.Axes = fa[1]
     for class_name in data:
         vals = data[class_name].percentage
@@ -130,7 +231,8 @@ def plot_percentage(dates: list, data: dict, output: str) -> None:
     ax.set_xticklabels(dates, rotation=45, ha='right')
     ax.legend(loc='lower center', bbox_to_anchor=(0.5, 1), ncol=4)
     # plt.show()
-    plt.savefig(output, bbox_inches='tight')
+    fig.savefig(output, bbox_inches='tight')
+    plt.close(fig)
 
 
 def main() -> None:
@@ -141,8 +243,22 @@ def main() -> None:
     parser.add_argument('end_ts')
     parser.add_argument('-d', '--data', default='./')
     parser.add_argument('-f', '--figure', default='./')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='Only write data files')
+    parser.add_argument('-c', '--checkpoint-interval', type=int, default=10,
+                        help='Write a checkpoint of the processed days to the '
+                             'data directory every this many days, and when '
+                             'the run stops early. 0 disables checkpoints '
+                             '(default: 10)')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='Continue after the last day of the checkpoint '
+                             'of topic and start_ts instead of starting at '
+                             'start_ts')
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
+    profiler = Profiler.from_args(args)
+
     start_ts = parse_timestamp_argument(args.start_ts)
     end_ts = parse_timestamp_argument(args.end_ts)
     raw_folder = args.raw_folder
@@ -155,76 +271,92 @@ def main() -> None:
     if not figure_folder.endswith('/'):
         figure_folder += '/'
 
-    scope_data = defaultdict(dict)
-    dep_data = defaultdict(dict)
+    manifest = FigureManifest(figure_folder)
+    scope_series = OverlapSeries()
+    dep_series = OverlapSeries()
+    checkpoint_file = data_folder + CHECKPOINT_FILE.format(
+        topic=args.topic, start_ts=start_ts.strftime(DATE_FMT))
 
     curr_ts = start_ts
-    while curr_ts <= end_ts:
-        date_key = curr_ts.strftime(DATE_FMT)
-        raw_file = get_raw_file(raw_folder, args.topic, curr_ts)
-        data = process_raw_file(raw_file)
-        for class_name, scopes in data.scopes.get_permutations().items():
-            scope_data[class_name][date_key] = scopes
-        for class_name, dependencies \
-                in data.dependencies.get_permutations().items():
-            dep_data[class_name][date_key] = dependencies
-        if scope_data.keys() != dep_data.keys():
-            print(f'Warning: Classes do not match. Scopes: {scope_data.keys()} '
-                  f'Deps: {dep_data.keys()}')
-        curr_ts += timedelta(days=1)
-    dates, overlap_per_class = calculate_overlap(scope_data)
-
-    data_output = data_folder + \
-                  OUTPUT_FILE.format(prefix='scope_overlap_absolute',
-                                     topic=args.topic,
-                                     start_ts=start_ts.strftime(DATE_FMT),
-                                     end_ts=end_ts.strftime(DATE_FMT))
-    with open(data_output, 'w') as f:
-        f.write(OUTPUT_DELIMITER.join(['class'] + dates) + '\n')
-        for class_name, overlaps in overlap_per_class.items():
-            f.write(OUTPUT_DELIMITER.join(
-                map(str, [class_name] + overlaps.absolute)) + '\n')
-
-    data_output = data_folder + \
-                  OUTPUT_FILE.format(prefix='scope_overlap_percentage',
-                                     topic=args.topic,
-                                     start_ts=start_ts.strftime(DATE_FMT),
-                                     end_ts=end_ts.strftime(DATE_FMT))
-    with open(data_output, 'w') as f:
-        f.write(OUTPUT_DELIMITER.join(['class'] + dates) + '\n')
-        for class_name, overlaps in overlap_per_class.items():
-            f.write(OUTPUT_DELIMITER.join(
-                map(str, [class_name] + overlaps.percentage)) + '\n')
-
-    plot_percentage(dates[1:], overlap_per_class,
-                    figure_folder + 'scope-overlap.pdf')
-
-    dates, overlap_per_class = calculate_overlap(dep_data)
-
-    data_output = data_folder + \
-                  OUTPUT_FILE.format(prefix='dep_overlap_absolute',
-                                     topic=args.topic,
-                                     start_ts=start_ts.strftime(DATE_FMT),
-                                     end_ts=end_ts.strftime(DATE_FMT))
-    with open(data_output, 'w') as f:
-        f.write(OUTPUT_DELIMITER.join(['class'] + dates) + '\n')
-        for class_name, overlaps in overlap_per_class.items():
-            f.write(OUTPUT_DELIMITER.join(
-                map(str, [class_name] + overlaps.absolute)) + '\n')
-
-    data_output = data_folder + \
-                  OUTPUT_FILE.format(prefix='dep_overlap_percentage',
-                                     topic=args.topic,
-                                     start_ts=start_ts.strftime(DATE_FMT),
-                                     end_ts=end_ts.strftime(DATE_FMT))
-    with open(data_output, 'w') as f:
-        f.write(OUTPUT_DELIMITER.join(['class'] + dates) + '\n')
-        for class_name, overlaps in overlap_per_class.items():
-            f.write(OUTPUT_DELIMITER.join(
-                map(str, [class_name] + overlaps.percentage)) + '\n')
-
-    plot_percentage(dates[1:], overlap_per_class,
-                    figure_folder + 'dep-overlap.pdf')
+    if args.resume:
+        with profiler.stage('resume'):
+            checkpoint = read_checkpoint(checkpoint_file, args.topic)
+        if checkpoint is not None:
+            last_ts = parse_timestamp_argument(checkpoint[0].dates[-1])
+            if last_ts > end_ts:
+                print(f'Warning: Ignoring checkpoint, since it ends after '
+                      f'{args.end_ts}', file=sys.stderr)
+            else:
+                scope_series, dep_series = checkpoint
+                curr_ts = last_ts + timedelta(days=1)
+                print(f'Resuming at {curr_ts.strftime(DATE_FMT)}')
+                profiler.count('resumed days', len(scope_series.dates))
+
+    os.makedirs(data_folder, exist_ok=True)
+    checkpoint_dates = len(scope_series.dates)
+    success = True
+    try:
+        while curr_ts <= end_ts:
+            date_key = curr_ts.strftime(DATE_FMT)
+            raw_file = get_raw_file(raw_folder, args.topic, curr_ts)
+            data = None
+            if raw_file:
+                data = process_raw_file(raw_file, profiler)
+            else:
+                print(f'Error: No dump of {args.topic} for {date_key} in '
+                      f'{raw_folder}', file=sys.stderr)
+            if data is None:
+                print(f'Error: Stopped at {date_key}. Rerun with --resume to '
+                      f'continue at this day.', file=sys.stderr)
+                success = False
+                break
+            profiler.count('dumps')
+            with profiler.stage('partition'):
+                scope_classes = data.scopes.get_permutations()
+                dep_classes = data.dependencies.get_permutations()
+            if scope_classes.keys() != dep_classes.keys():
+                print(f'Warning: Classes do not match. Scopes: '
+                      f'{scope_classes.keys()} Deps: {dep_classes.keys()}')
+            with profiler.stage('overlap') as stage:
+                scope_series.add(date_key, scope_classes)
+                dep_series.add(date_key, dep_classes)
+                stage.items = 1
+            curr_ts += timedelta(days=1)
+            if args.checkpoint_interval > 0 \
+                    and len(scope_series.dates) - checkpoint_dates \
+                    >= args.checkpoint_interval:
+                with profiler.stage('checkpoint'):
+                    write_checkpoint(checkpoint_file, args.topic,
+                                     scope_series, dep_series)
+                checkpoint_dates = len(scope_series.dates)
+    finally:
+        # Both series only contain completed days, so they are also
+        # checkpointed if the run stops early or is interrupted.
+        if args.checkpoint_interval > 0 \
+                and len(scope_series.dates) > checkpoint_dates:
+            with profiler.stage('checkpoint'):
+                write_checkpoint(checkpoint_file, args.topic, scope_series,
+                                 dep_series)
+    if not success:
+        profiler.print_counters()
+        profiler.write()
+        sys.exit(1)
+
+    for series, prefix, figure in [(scope_series, 'scope',
+                                    'scope-overlap.pdf'),
+                                   (dep_series, 'dep', 'dep-overlap.pdf')]:
+        with profiler.stage('output'):
+            write_overlap(series, prefix, args.topic, data_folder)
+        if not args.no_figures:
+            with profiler.stage('render') as stage:
+                render_figures(plot_percentage,
+                               [(series.dates[1:], series.get_overlap(),
+                                 figure_folder + figure)],
+                               1, manifest)
+                stage.items = 1
+
+    profiler.print_counters()
+    profiler.write()
 
 
 if __name__ == '__main__':
@@ -1,36 +1,24 @@
 import argparse
-import bz2
 import os
-import pickle
 import sys
 from collections import defaultdict
-from datetime import datetime, timezone
 from itertools import permutations, zip_longest
 
-import msgpack
 import numpy as np
-import plotly.graph_objects as go
 
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from class_store import RELATION_SEPARATOR, ClassSizeStore
+from common.figures import FigureManifest
+from common.message_source import MessageSource, open_source
+from common.profiling import Profiler, add_profile_arguments
+from figures import ImageExporter, get_title, plot_sankey
 from set_permutator import SetPermutator
 
-DATE_FMT = '%Y-%m-%dT%H:%M:%S'
-INPUT_EXTENSION = '.pickle.bz2'
 DATA_OUTPUT_EXTENSION = '.csv'
 DATA_OUTPUT_DELIMITER = ','
 FIG_OUTPUT_EXTENSION = '.svg'
 
-dep_scope_map = defaultdict(set)
-sall = set()
-se = set()
-sm = set()
-sb = set()
-st = set()
-dall = set()
-de = set()
-dm = set()
-db = set()
-dt = set()
-
 
 def grouper(iterable, n, fillvalue=None):
     """Collect data into fixed-length chunks or blocks"""
@@ -43,7 +31,7 @@ def get_1_1_connection(src: set, dst: set) -> int:
     return len(src.intersection(dst))
 
 
-def get_1_n_connections(src: set, dst: list) -> list:
+def get_1_n_connections(src: set, dst: list, dep_scope_map: dict) -> list:
     # Map each dependency to a list of scopes that depend on it. Create
     # a source scope set by repeating this for all dependencies.
     src_scopes = {scope for asn in src for scope in dep_scope_map[asn]}
@@ -53,37 +41,41 @@ def get_1_n_connections(src: set, dst: list) -> list:
     return ret
 
 
-def get_n_n_connections(src: list, dst: list) -> list:
+def get_n_n_connections(src: list, dst: list, dep_scope_map: dict) -> list:
     ret = list()
     for src_set in src:
-        ret += get_1_n_connections(src_set, dst)
+        ret += get_1_n_connections(src_set, dst, dep_scope_map)
     return ret
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('topic', help='*.pickle.bz2 dump of topic')
-    parser.add_argument('-f', '--fig-output', help='Figure output directory',
-                        default='./')
-    parser.add_argument('-d', '--data-output', help='Data output directory',
-                        default='./')
+def process_topic(topic: str,
+                  fig_output_dir: str,
+                  data_output_dir: str,
+                  profiler: Profiler,
+                  exporter: ImageExporter = None,
+                  store: ClassSizeStore = None) -> bool:
+    # Opens the dump or stream topic and processes it with
+    # process_source. Returns False if it could not be opened or
+    # processed.
+    with profiler.stage('load'):
+        source = open_source(topic)
+    if source is None:
+        return False
+    return process_source(source, fig_output_dir, data_output_dir, profiler,
+                          exporter, store)
 
-    args = parser.parse_args()
 
-    fig_output_dir: str = args.fig_output
-    if not fig_output_dir.endswith('/'):
-        fig_output_dir += '/'
-
-    data_output_dir: str = args.data_output
-    if not data_output_dir.endswith('/'):
-        data_output_dir += '/'
-
-    if not args.topic.endswith(INPUT_EXTENSION):
-        print(f'Error: Expected {INPUT_EXTENSION} input file, but got '
-              f'{args.topic}', file=sys.stderr)
-        sys.exit(1)
-
-    output_file_prefix = os.path.basename(args.topic)[:-len(INPUT_EXTENSION)]
+def process_source(source: MessageSource,
+                   fig_output_dir: str,
+                   data_output_dir: str,
+                   profiler: Profiler,
+                   exporter: ImageExporter = None,
+                   store: ClassSizeStore = None) -> bool:
+    # Write the dependency-scope relation of one dump. No figure is drawn if
+    # exporter is None. The number of scopes of each dependency class that
+    # depend on each scope class is also added to store if given. Returns
+    # False if the dump could not be processed.
+    output_file_prefix = source.prefix
     data_output_file = data_output_dir + 'dependency-scope-relation.' + \
                        output_file_prefix + DATA_OUTPUT_EXTENSION
     matrix_output_file = data_output_dir + \
@@ -92,85 +84,99 @@ if __name__ == '__main__':
     fig_output_file = fig_output_dir + 'dependency-scope-relation.' + \
                       output_file_prefix + FIG_OUTPUT_EXTENSION
 
-    with bz2.open(args.topic, 'r') as f:
-        data = pickle.load(f)
-    for msg in data['messages']:
-        msg_data = msgpack.loads(msg[1])
-        scope = msg_data['scope']
-        if scope not in sall:
-            sall.add(scope)
-        if len(msg_data['equal']):
-            se.add(scope)
-        if len(msg_data['mismatched']):
-            sm.add(scope)
-        if len(msg_data['bgp_only']):
-            sb.add(scope)
-        if len(msg_data['tr_only']):
-            st.add(scope)
-        for asn, bgp_score, bgp_rank, tr_score, tr_rank, comp_rank \
-                in msg_data['equal']:
-            dep_scope_map[asn].add(scope)
-            if asn not in dall:
-                dall.add(asn)
-            if asn not in de:
-                de.add(asn)
-        for asn, bgp_score, bgp_rank, bgp_comp_rank, tr_score, tr_rank, \
-            tr_comp_rank in msg_data['mismatched']:
-            dep_scope_map[asn].add(scope)
-            if asn not in dall:
-                dall.add(asn)
-            if asn not in dm:
-                dm.add(asn)
-        for asn, score, rank in msg_data['bgp_only']:
-            dep_scope_map[asn].add(scope)
-            if asn not in dall:
-                dall.add(asn)
-            if asn not in db:
-                db.add(asn)
-        for asn, score, rank in msg_data['tr_only']:
-            dep_scope_map[asn].add(scope)
-            if asn not in dall:
-                dall.add(asn)
-            if asn not in dt:
-                dt.add(asn)
+    dep_scope_map = defaultdict(set)
+    sall = set()
+    se = set()
+    sm = set()
+    sb = set()
+    st = set()
+    dall = set()
+    de = set()
+    dm = set()
+    db = set()
+    dt = set()
+    # Messages are classified while they are read from the source.
+    with profiler.stage('classify') as stage:
+        for msg_data in source:
+            scope = msg_data['scope']
+            if scope not in sall:
+                sall.add(scope)
+            if len(msg_data['equal']):
+                se.add(scope)
+            if len(msg_data['mismatched']):
+                sm.add(scope)
+            if len(msg_data['bgp_only']):
+                sb.add(scope)
+            if len(msg_data['tr_only']):
+                st.add(scope)
+            for asn, bgp_score, bgp_rank, tr_score, tr_rank, comp_rank \
+                    in msg_data['equal']:
+                dep_scope_map[asn].add(scope)
+                if asn not in dall:
+                    dall.add(asn)
+                if asn not in de:
+                    de.add(asn)
+            for asn, bgp_score, bgp_rank, bgp_comp_rank, tr_score, tr_rank, \
+                tr_comp_rank in msg_data['mismatched']:
+                dep_scope_map[asn].add(scope)
+                if asn not in dall:
+                    dall.add(asn)
+                if asn not in dm:
+                    dm.add(asn)
+            for asn, score, rank in msg_data['bgp_only']:
+                dep_scope_map[asn].add(scope)
+                if asn not in dall:
+                    dall.add(asn)
+                if asn not in db:
+                    db.add(asn)
+            for asn, score, rank in msg_data['tr_only']:
+                dep_scope_map[asn].add(scope)
+                if asn not in dall:
+                    dall.add(asn)
+                if asn not in dt:
+                    dt.add(asn)
+        stage.items = source.count
+    profiler.count('messages', source.count)
 
     spermutator = SetPermutator()
     spermutator.add_class('eq', se)
     spermutator.add_class('mm', sm)
     spermutator.add_class('bgp', sb)
     spermutator.add_class('tr', st)
-    sclass_permutations = spermutator.get_permutations()
+    with profiler.stage('partition'):
+        sclass_permutations = spermutator.get_permutations()
     # Sanity checks
     for a, b in permutations(sclass_permutations.values(), 2):
         if not a.isdisjoint(b):
             print('Error: Scope sets are not disjoint')
-            sys.exit(1)
+            return False
     all_check = set()
     for n, s in sclass_permutations.items():
         all_check.update(s)
     if sall != all_check:
         print(f'Error: Union of separate sets is missing scopes: '
               f'{sall - all_check}')
-        sys.exit(1)
+        return False
 
     dpermutator = SetPermutator()
     dpermutator.add_class('eq', de)
     dpermutator.add_class('mm', dm)
     dpermutator.add_class('bgp', db)
     dpermutator.add_class('tr', dt)
-    dclass_permutations = dpermutator.get_permutations()
+    with profiler.stage('partition'):
+        dclass_permutations = dpermutator.get_permutations()
     # Sanity checks
     for a, b in permutations(dclass_permutations.values(), 2):
         if not a.isdisjoint(b):
             print('Error: Dependency sets are not disjoint')
-            sys.exit(1)
+            return False
     all_check = set()
     for n, s in dclass_permutations.items():
         all_check.update(s)
     if dall != all_check:
         print(f'Error: Union of separate sets is missing scopes: '
               f'{dall - all_check}')
-        sys.exit(1)
+        return False
 
     labels = ['all', 'eq', 'mm', 'bgp', 'tr', 'eq mm', 'eq bgp', 'eq tr',
               'mm bgp', 'mm tr', 'bgp tr', 'eq mm bgp', 'eq mm tr',
@@ -182,7 +188,9 @@ if __name__ == '__main__':
     y_vals = [0.0] + list(np.linspace(0, 1, len(deps))) + \
              list(np.linspace(0, 1, len(scopes)))
     dep_values = list(map(len, deps))
-    dep_scope_values = get_n_n_connections(deps, scopes)
+    with profiler.stage('relation'):
+        dep_scope_values = get_n_n_connections(deps, scopes,
+                                               dep_scope_map)
     total_values = dep_values + dep_scope_values
 
     # Connections from 'all' node to each dependency node
@@ -194,39 +202,15 @@ if __name__ == '__main__':
             dst += len(deps)
             source_ids.append(src)
             destination_ids.append(dst)
-    print(f'       nodes: {len(labels)}')
-    print(f'   dep nodes: {len(deps)}')
-    print(f' scope nodes: {len(scopes)}')
-    print(f'     sources: {len(source_ids)}')
-    print(f'destinations: {len(destination_ids)}')
-    print(f'    a -> _d*: {len(dep_values)}')
-    print(f'  _d* -> _s*: {len(dep_scope_values)}')
-    print(f'       total: {len(total_values)}')
-    print(f'dependencies: {len(dall)}')
-    print(f'      scopes: {len(sall)}')
-
-    mm_fig = go.Figure(data=[go.Sankey(valuesuffix=' scopes',
-                                       arrangement='snap',
-                                       node={'label': labels,
-                                             'x': x_vals,
-                                             'y': y_vals,
-                                             'pad': 5},
-                                       link={'source': source_ids,
-                                             'target': destination_ids,
-                                             'value': total_values})])
-    title = data['name'] + ' ' + \
-            datetime \
-                .fromtimestamp(data['start_ts'] / 1000, tz=timezone.utc) \
-                .strftime(DATE_FMT)
-    if data['end_ts'] != data['start_ts']:
-        title += ' - ' + \
-                 datetime \
-                     .fromtimestamp(data['end_ts'] / 1000, tz=timezone.utc) \
-                     .strftime(DATE_FMT)
-    mm_fig.update_layout(title_text=title)
+    profiler.count('dependencies', len(dall))
+    profiler.count('scopes', len(sall))
 
-    os.makedirs(fig_output_dir, exist_ok=True)
-    mm_fig.write_image(fig_output_file, width=1000, height=800)
+    if exporter is not None:
+        title = get_title(source.header)
+        with profiler.stage('figure'):
+            plot_sankey(labels, x_vals, y_vals, source_ids, destination_ids,
+                        total_values, title, fig_output_file, exporter,
+                        value_suffix=' scopes', pad=5, size=(1000, 800))
 
     os.makedirs(data_output_dir, exist_ok=True)
     dclass_sizes = {class_name: len(dep_set)
@@ -236,7 +220,7 @@ if __name__ == '__main__':
                     for class_name, scope_set in sclass_permutations.items()}
     total_scopes = sum(sclass_sizes.values())
 
-    with open(data_output_file, 'w') as f:
+    with profiler.stage('output'), open(data_output_file, 'w') as f:
         f.write(DATA_OUTPUT_DELIMITER.join(['class',
                                             'dependencies',
                                             'dependencies(percentage)',
@@ -260,8 +244,71 @@ if __name__ == '__main__':
                                             str(total_scopes),
                                             '100.0']) + '\n')
 
-    with open(matrix_output_file, 'w') as f:
+    with profiler.stage('output'), open(matrix_output_file, 'w') as f:
         f.write(',' + ','.join(labels[1:len(deps) + 1]) + '\n')
         for idx, group in enumerate(grouper(dep_scope_values, len(scopes))):
             f.write(labels[idx + 1] + ',' + ','.join(map(str, group)) + '\n')
-    sys.exit(0)
+    if store is not None:
+        dep_labels = labels[1:len(deps) + 1]
+        relation_sizes = dict()
+        for idx, group in enumerate(grouper(dep_scope_values, len(scopes))):
+            for scope_label, size in zip(dep_labels, group):
+                relation_sizes[dep_labels[idx] + RELATION_SEPARATOR
+                               + scope_label] = size
+        with profiler.stage('store'):
+            store.add(source.header['name'], source.header['start_ts'],
+                      'relation', relation_sizes)
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('topic', nargs='+',
+                        help='*.pickle.bz2 dump(s) or *.msgpack stream(s) of '
+                             'topic, or - to read a stream from stdin')
+    parser.add_argument('-f', '--fig-output', help='Figure output directory',
+                        default='./')
+    parser.add_argument('-d', '--data-output', help='Data output directory',
+                        default='./')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='Only write data files')
+    parser.add_argument('-s', '--store',
+                        help='Also add the class sizes to this SQLite '
+                             'time-series store')
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    fig_output_dir: str = args.fig_output
+    if not fig_output_dir.endswith('/'):
+        fig_output_dir += '/'
+
+    data_output_dir: str = args.data_output
+    if not data_output_dir.endswith('/'):
+        data_output_dir += '/'
+
+    profiler = Profiler.from_args(args)
+    exporter = None
+    if not args.no_figures:
+        os.makedirs(fig_output_dir, exist_ok=True)
+        # One export session is shared by the figures of all dumps.
+        exporter = ImageExporter(FigureManifest(fig_output_dir), profiler)
+    store = None
+    if args.store:
+        store = ClassSizeStore(args.store)
+    success = True
+    try:
+        for topic in args.topic:
+            if not process_topic(topic, fig_output_dir, data_output_dir,
+                                 profiler, exporter, store):
+                print(f'Error: Failed to process {topic}', file=sys.stderr)
+                success = False
+    finally:
+        if exporter is not None and not exporter.close():
+            success = False
+        if store is not None:
+            store.close()
+        profiler.print_counters()
+        profiler.write()
+    if not success:
+        sys.exit(1)
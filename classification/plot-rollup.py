@@ -0,0 +1,298 @@
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from class_sketch import DEFAULT_PRECISION, ClassSketches
+from class_state import CLASSES, ClassState
+from common.message_source import get_raw_file, open_source
+from common.profiling import Profiler, add_profile_arguments
+from common.scripts import load_script
+
+DATE_FMT = '%Y-%m-%d'
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_FILE_TS_FMT = '%Y-%m-%dT00:00'
+STATE_FILE_FMT = '{topic}.{timestamp}.json'
+SKETCH_FILE_FMT = '{topic}.{timestamp}.hll{precision}.json'
+DATA_OUTPUT_EXTENSION = '.csv'
+DATA_OUTPUT_DELIMITER = ','
+PERIODS = ['weekly', 'monthly', 'yearly']
+KINDS = ['scopes', 'dependencies']
+
+
+def parse_timestamp_argument(arg: str) -> datetime:
+    return datetime.strptime(arg, DATE_FMT)
+
+
+def get_state_file(cache_folder: str,
+                   topic: str,
+                   timestamp: datetime,
+                   precision: int = None) -> str:
+    # Sketches are cached per precision, since sketches of different
+    # precisions can not be merged.
+    if precision is not None:
+        return cache_folder + SKETCH_FILE_FMT.format(
+            topic=topic,
+            timestamp=timestamp.strftime(RAW_FILE_TS_FMT),
+            precision=precision)
+    return cache_folder + \
+        STATE_FILE_FMT.format(topic=topic,
+                              timestamp=timestamp.strftime(RAW_FILE_TS_FMT))
+
+
+def get_periods(start_ts: datetime, end_ts: datetime, period: str) -> list:
+    # Returns (period start, days) tuples of all weeks, months or years
+    # that overlap the range. Weeks start at start_ts, months and years on
+    # their first day. Only days within the range are included.
+    periods = list()
+    curr_ts = start_ts
+    while curr_ts <= end_ts:
+        if period == 'weekly':
+            period_start = curr_ts
+            next_ts = curr_ts + timedelta(days=7)
+        elif period == 'monthly':
+            period_start = curr_ts.replace(day=1)
+            next_ts = (period_start + timedelta(days=32)).replace(day=1)
+        else:
+            period_start = curr_ts.replace(month=1, day=1)
+            next_ts = period_start.replace(year=period_start.year + 1)
+        days = list()
+        while curr_ts < next_ts and curr_ts <= end_ts:
+            days.append(curr_ts)
+            curr_ts += timedelta(days=1)
+        periods.append((period_start, days))
+    return periods
+
+
+def is_cached(raw_file: str, state_file: str) -> bool:
+    return os.path.exists(state_file) \
+        and os.path.getmtime(state_file) >= os.path.getmtime(raw_file)
+
+
+def build_state(raw_file: str, state_file: str, precision: int = None) -> int:
+    # Runs in a worker process. The state is only passed back through the
+    # cache file. If precision is set, sketches are built instead of the
+    # exact state. Returns the number of messages.
+    source = open_source(raw_file)
+    if precision is not None:
+        ClassSketches.from_messages(source, precision).write(state_file)
+    else:
+        ClassState.from_messages(source).write(state_file)
+    return source.count
+
+
+def read_state(state_file: str, precision: int = None):
+    if precision is not None:
+        return ClassSketches.read(state_file)
+    return ClassState.read(state_file)
+
+
+def build_states(days: list,
+                 raw_folder: str,
+                 topic: str,
+                 cache_folder: str,
+                 processes: int,
+                 profiler: Profiler,
+                 precision: int = None) -> set:
+    # Decodes the dumps of all days whose state is not cached yet, in
+    # parallel. Returns the days for which a state is available.
+    available = set()
+    jobs = list()
+    for day in days:
+        raw_file = get_raw_file(raw_folder, topic, day)
+        state_file = get_state_file(cache_folder, topic, day, precision)
+        if not raw_file:
+            # The state can still be cached even if the dump was removed.
+            if os.path.exists(state_file):
+                available.add(day)
+            else:
+                print(f'Warning: No dump or cached state for '
+                      f'{day.strftime(DATE_FMT)}', file=sys.stderr)
+            continue
+        available.add(day)
+        if not is_cached(raw_file, state_file):
+            jobs.append((raw_file, state_file, precision))
+    profiler.count('cached days', len(available) - len(jobs))
+    profiler.count('decoded dumps', len(jobs))
+    if not jobs:
+        return available
+    with profiler.stage('decode') as stage:
+        if processes > 1 and len(jobs) > 1:
+            with Pool(min(processes, len(jobs))) as pool:
+                messages = pool.starmap(build_state, jobs)
+        else:
+            messages = [build_state(*job) for job in jobs]
+        stage.items = sum(messages)
+    profiler.count('messages', sum(messages))
+    return available
+
+
+def write_dep_counts(state: ClassState, output_file: str) -> None:
+    with open(output_file, 'w') as f:
+        f.write(DATA_OUTPUT_DELIMITER.join(
+            ['asn'] + [class_name for key, class_name in CLASSES]) + '\n')
+        for asn in sorted(state.dep_counts):
+            f.write(DATA_OUTPUT_DELIMITER.join(
+                map(str, [asn] + state.dep_counts[asn])) + '\n')
+
+
+def write_distinct_counts(counts: dict,
+                          relative_error: float,
+                          output_file: str) -> None:
+    # counts maps each kind to the number of distinct scopes or
+    # dependencies per class. std_error is zero for exact counts.
+    with open(output_file, 'w') as f:
+        f.write(DATA_OUTPUT_DELIMITER.join(
+            ['kind', 'class', 'count', 'std_error']) + '\n')
+        for kind in KINDS:
+            for class_name, count in counts[kind].items():
+                f.write(DATA_OUTPUT_DELIMITER.join(
+                    [kind, class_name, f'{count:.0f}',
+                     f'{count * relative_error:.1f}']) + '\n')
+
+
+def get_exact_counts(state: ClassState, kind: str) -> dict:
+    classes = getattr(state, kind)
+    counts = {class_name: len(values)
+              for class_name, values in classes.items()}
+    counts['all'] = len(set().union(*classes.values()))
+    return counts
+
+
+def main() -> None:
+    desc = """Roll up the scope and dependency classes of daily dumps into
+    weekly or monthly reports with the layout of plot-scopes.py and
+    plot-dependencies.py. The class state of each day is cached, so a
+    report only merges cached states instead of decoding the dumps
+    again. With --approximate, only the number of distinct scopes and
+    dependencies per class is estimated from mergeable sketches, which
+    need constant memory for any range."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('raw_folder')
+    parser.add_argument('topic')
+    parser.add_argument('start_ts')
+    parser.add_argument('end_ts')
+    parser.add_argument('-p', '--period', choices=PERIODS, action='append',
+                        help='Period of the reports. Can be given more than '
+                             'once (default: weekly)')
+    parser.add_argument('-d', '--data-output', help='Data output directory',
+                        default='./')
+    parser.add_argument('-c', '--cache',
+                        help='Daily state cache directory (default: '
+                             'class-state/ in the data output directory)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of processes used to decode dumps '
+                             '(default: number of CPUs)')
+    parser.add_argument('-a', '--approximate', action='store_true',
+                        help='Only estimate the number of distinct scopes '
+                             'and dependencies per class with HyperLogLog '
+                             'sketches instead of keeping exact sets')
+    parser.add_argument('--precision', type=int, default=DEFAULT_PRECISION,
+                        help=f'Sketch precision. Sketches use 2^precision '
+                             f'bytes and have a relative standard error of '
+                             f'1.04/sqrt(2^precision) (default: '
+                             f'{DEFAULT_PRECISION})')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profiler = Profiler.from_args(args)
+
+    start_ts = parse_timestamp_argument(args.start_ts)
+    end_ts = parse_timestamp_argument(args.end_ts)
+    raw_folder = args.raw_folder
+    if not raw_folder.endswith('/'):
+        raw_folder += '/'
+    data_output_dir = args.data_output
+    if not data_output_dir.endswith('/'):
+        data_output_dir += '/'
+    cache_folder = args.cache or data_output_dir + 'class-state/'
+    if not cache_folder.endswith('/'):
+        cache_folder += '/'
+    periods = args.period or ['weekly']
+    precision = None
+    if args.approximate:
+        if not 4 <= args.precision <= 18:
+            print('Error: Precision must be in [4, 18]', file=sys.stderr)
+            sys.exit(1)
+        precision = args.precision
+
+    scopes = load_script(SCRIPT_DIR, 'plot-scopes')
+    dependencies = load_script(SCRIPT_DIR, 'plot-dependencies')
+
+    os.makedirs(cache_folder, exist_ok=True)
+    os.makedirs(data_output_dir, exist_ok=True)
+    days = [start_ts + timedelta(days=day)
+            for day in range((end_ts - start_ts).days + 1)]
+    available = build_states(days, raw_folder, args.topic, cache_folder,
+                             args.jobs, profiler, precision)
+
+    for period in periods:
+        for period_start, period_days in get_periods(start_ts, end_ts,
+                                                     period):
+            if precision is not None:
+                state = ClassSketches(precision)
+            else:
+                state = ClassState()
+            with profiler.stage('merge') as stage:
+                for day in period_days:
+                    if day not in available:
+                        continue
+                    state.merge(read_state(
+                        get_state_file(cache_folder, args.topic, day,
+                                       precision), precision))
+                stage.items = state.dumps
+            if state.dumps == 0:
+                continue
+            if state.dumps < len(period_days):
+                print(f'Warning: {period} report of '
+                      f'{period_start.strftime(DATE_FMT)} only covers '
+                      f'{state.dumps} of {len(period_days)} days',
+                      file=sys.stderr)
+                profiler.count('incomplete reports')
+            # Same file names as the reports of the weekly topic.
+            output_file_prefix = f'{args.topic}_{period}.' + \
+                                 period_start.strftime(RAW_FILE_TS_FMT)
+            # Estimates are written to separate files per precision, so
+            # that they do not overwrite the exact counts.
+            distinct_counts_name = 'distinct-counts'
+            if precision is not None:
+                distinct_counts_name += f'-hll{precision}'
+            distinct_counts_file = data_output_dir + distinct_counts_name \
+                + '.' + output_file_prefix + DATA_OUTPUT_EXTENSION
+            if precision is not None:
+                with profiler.stage('estimate'):
+                    write_distinct_counts(
+                        {kind: state.get_counts(kind) for kind in KINDS},
+                        state.relative_error(), distinct_counts_file)
+                profiler.count(f'{period} reports')
+                continue
+            with profiler.stage('partition'):
+                scope_classes = state.get_permutations('scopes')
+                dep_classes = state.get_permutations('dependencies')
+            with profiler.stage('output'):
+                scopes.write_scope_classes(
+                    scope_classes,
+                    data_output_dir + 'scopes.' + output_file_prefix
+                    + DATA_OUTPUT_EXTENSION)
+                dependencies.write_dependency_classes(
+                    dep_classes,
+                    data_output_dir + 'dependencies.' + output_file_prefix
+                    + DATA_OUTPUT_EXTENSION)
+                write_dep_counts(state,
+                                 data_output_dir + 'dependency-class-counts.'
+                                 + output_file_prefix + DATA_OUTPUT_EXTENSION)
+                write_distinct_counts(
+                    {kind: get_exact_counts(state, kind) for kind in KINDS},
+                    0, distinct_counts_file)
+            profiler.count(f'{period} reports')
+
+    profiler.print_counters()
+    profiler.write()
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -1,90 +1,112 @@
 import argparse
-import bz2
 import os
-import pickle
 import sys
-from datetime import datetime, timezone
 from itertools import permutations
 
-import msgpack
-import plotly.graph_objects as go
-
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from class_store import ClassSizeStore
+from common.figures import FigureManifest
+from common.message_source import MessageSource, open_source
+from common.profiling import Profiler, add_profile_arguments
+from figures import ImageExporter, get_title, plot_sankey
 from set_permutator import SetPermutator
 
-DATE_FMT = '%Y-%m-%dT%H:%M:%S'
-INPUT_EXTENSION = '.pickle.bz2'
 DATA_OUTPUT_EXTENSION = '.csv'
 DATA_OUTPUT_DELIMITER = ','
 FIG_OUTPUT_EXTENSION = '.svg'
 
-sall = set()
-se = set()
-sm = set()
-sb = set()
-st = set()
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('topic', help='*.pickle.bz2 dump of topic')
-    parser.add_argument('-f', '--fig-output', help='Figure output directory',
-                        default='./')
-    parser.add_argument('-d', '--data-output', help='Data output directory',
-                        default='./')
-
-    args = parser.parse_args()
 
-    fig_output_dir: str = args.fig_output
-    if not fig_output_dir.endswith('/'):
-        fig_output_dir += '/'
+def write_scope_classes(class_permutations: dict, output_file: str) -> None:
+    class_sizes = {class_name: len(scope_set)
+                   for class_name, scope_set in class_permutations.items()}
+    total_scopes = sum(class_sizes.values())
 
-    data_output_dir: str = args.data_output
-    if not data_output_dir.endswith('/'):
-        data_output_dir += '/'
+    with open(output_file, 'w') as f:
+        f.write(DATA_OUTPUT_DELIMITER.join(['class', 'scopes', 'percentage'])
+                + '\n')
+        for class_name, scope_count in class_sizes.items():
+            scope_percentage = 100 / total_scopes * scope_count
+            f.write(DATA_OUTPUT_DELIMITER.join(map(str, [class_name,
+                                                         scope_count,
+                                                         scope_percentage]))
+                    + '\n')
+        f.write(DATA_OUTPUT_DELIMITER.join(['all', str(total_scopes),
+                                            '100.0']) + '\n')
 
-    if not args.topic.endswith(INPUT_EXTENSION):
-        print(f'Error: Expected {INPUT_EXTENSION} input file, but got '
-              f'{args.topic}', file=sys.stderr)
-        sys.exit(1)
 
-    output_file_prefix = os.path.basename(args.topic)[:-len(INPUT_EXTENSION)]
+def process_topic(topic: str,
+                  fig_output_dir: str,
+                  data_output_dir: str,
+                  profiler: Profiler,
+                  exporter: ImageExporter = None,
+                  store: ClassSizeStore = None) -> bool:
+    # Opens the dump or stream topic and processes it with
+    # process_source. Returns False if it could not be opened or
+    # processed.
+    with profiler.stage('load'):
+        source = open_source(topic)
+    if source is None:
+        return False
+    return process_source(source, fig_output_dir, data_output_dir, profiler,
+                          exporter, store)
+
+
+def process_source(source: MessageSource,
+                   fig_output_dir: str,
+                   data_output_dir: str,
+                   profiler: Profiler,
+                   exporter: ImageExporter = None,
+                   store: ClassSizeStore = None) -> bool:
+    # Write the scope classes of one dump. No figure is drawn if
+    # exporter is None. The class sizes are also added to store if given.
+    # Returns False if the dump could not be processed.
+    output_file_prefix = source.prefix
     data_output_file = data_output_dir + 'scopes.' + output_file_prefix + \
                        DATA_OUTPUT_EXTENSION
     fig_output_file = fig_output_dir + 'scopes.' + output_file_prefix + \
                       FIG_OUTPUT_EXTENSION
 
-    with bz2.open(args.topic, 'r') as f:
-        data = pickle.load(f)
-    for msg in data['messages']:
-        msg_data = msgpack.loads(msg[1])
-        scope = msg_data['scope']
-        if scope not in sall:
-            sall.add(scope)
-        if len(msg_data['equal']):
-            se.add(scope)
-        if len(msg_data['mismatched']):
-            sm.add(scope)
-        if len(msg_data['bgp_only']):
-            sb.add(scope)
-        if len(msg_data['tr_only']):
-            st.add(scope)
+    sall = set()
+    se = set()
+    sm = set()
+    sb = set()
+    st = set()
+    # Messages are classified while they are read from the source.
+    with profiler.stage('classify') as stage:
+        for msg_data in source:
+            scope = msg_data['scope']
+            if scope not in sall:
+                sall.add(scope)
+            if len(msg_data['equal']):
+                se.add(scope)
+            if len(msg_data['mismatched']):
+                sm.add(scope)
+            if len(msg_data['bgp_only']):
+                sb.add(scope)
+            if len(msg_data['tr_only']):
+                st.add(scope)
+        stage.items = source.count
+    profiler.count('messages', source.count)
     permutator = SetPermutator()
     permutator.add_class('eq', se)
     permutator.add_class('mm', sm)
     permutator.add_class('bgp', sb)
     permutator.add_class('tr', st)
-    class_permutations = permutator.get_permutations()
+    with profiler.stage('partition'):
+        class_permutations = permutator.get_permutations()
     # Sanity checks
     for a, b in permutations(class_permutations.values(), 2):
         if not a.isdisjoint(b):
             print('Error: Scope sets are not disjoint')
-            sys.exit(1)
+            return False
     all_check = set()
     for n, s in class_permutations.items():
         all_check.update(s)
     if sall != all_check:
         print(f'Error: Union of separate sets is missing scopes: '
               f'{sall - all_check}')
-        sys.exit(1)
+        return False
 
     mixed_mm = set()
     mixed_no_mm = set()
@@ -124,48 +146,79 @@ if __name__ == '__main__':
     mm_fig_targets = list(range(1, len(mm_fig_sources) + 1))
     mm_fig_values = [len(mm_fig_classes[class_name])
                      for class_name, x, y in mm_fig_nodes[1:]]
-    for val in mm_fig_values:
-        if val == 0:
-            print('Error: Can not draw connection with value 0.')
-            sys.exit(1)
-    labels, x, y = zip(*mm_fig_nodes)
-    mm_fig = go.Figure(data=[go.Sankey(valuesuffix=' scopes',
-                                       arrangement='snap',
-                                       node={'label': labels,
-                                             'x': x,
-                                             'y': y,
-                                             'pad': 10},
-                                       link={'source': mm_fig_sources,
-                                             'target': mm_fig_targets,
-                                             'value': mm_fig_values})])
-    title = data['name'] + ' ' + \
-            datetime \
-                .fromtimestamp(data['start_ts'] / 1000, tz=timezone.utc) \
-                .strftime(DATE_FMT)
-    if data['end_ts'] != data['start_ts']:
-        title += ' - ' + \
-                 datetime \
-                     .fromtimestamp(data['end_ts'] / 1000, tz=timezone.utc) \
-                     .strftime(DATE_FMT)
-    mm_fig.update_layout(title_text=title)
-
-    os.makedirs(fig_output_dir, exist_ok=True)
-    mm_fig.write_image(fig_output_file, width=1000, height=800)
+    if exporter is not None:
+        for val in mm_fig_values:
+            if val == 0:
+                print('Error: Can not draw connection with value 0.')
+                return False
+        labels, x, y = zip(*mm_fig_nodes)
+        title = get_title(source.header)
+        with profiler.stage('figure'):
+            plot_sankey(labels, x, y, mm_fig_sources, mm_fig_targets,
+                        mm_fig_values, title, fig_output_file, exporter,
+                        value_suffix=' scopes', size=(1000, 800))
 
     os.makedirs(data_output_dir, exist_ok=True)
-    class_sizes = {class_name: len(scope_set)
-                   for class_name, scope_set in class_permutations.items()}
-    total_scopes = sum(class_sizes.values())
+    with profiler.stage('output'):
+        write_scope_classes(class_permutations, data_output_file)
+    if store is not None:
+        with profiler.stage('store'):
+            store.add(source.header['name'], source.header['start_ts'],
+                      'scopes',
+                      {class_name: len(scope_set)
+                       for class_name, scope_set
+                       in class_permutations.items()})
+    return True
 
-    with open(data_output_file, 'w') as f:
-        f.write(DATA_OUTPUT_DELIMITER.join(['class', 'scopes', 'percentage'])
-                + '\n')
-        for class_name, scope_count in class_sizes.items():
-            scope_percentage = 100 / total_scopes * scope_count
-            f.write(DATA_OUTPUT_DELIMITER.join(map(str, [class_name,
-                                                         scope_count,
-                                                         scope_percentage]))
-                    + '\n')
-        f.write(DATA_OUTPUT_DELIMITER.join(['all', str(total_scopes),
-                                            '100.0']) + '\n')
-    sys.exit(0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('topic', nargs='+',
+                        help='*.pickle.bz2 dump(s) or *.msgpack stream(s) of '
+                             'topic, or - to read a stream from stdin')
+    parser.add_argument('-f', '--fig-output', help='Figure output directory',
+                        default='./')
+    parser.add_argument('-d', '--data-output', help='Data output directory',
+                        default='./')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='Only write data files')
+    parser.add_argument('-s', '--store',
+                        help='Also add the class sizes to this SQLite '
+                             'time-series store')
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    fig_output_dir: str = args.fig_output
+    if not fig_output_dir.endswith('/'):
+        fig_output_dir += '/'
+
+    data_output_dir: str = args.data_output
+    if not data_output_dir.endswith('/'):
+        data_output_dir += '/'
+
+    profiler = Profiler.from_args(args)
+    exporter = None
+    if not args.no_figures:
+        os.makedirs(fig_output_dir, exist_ok=True)
+        # One export session is shared by the figures of all dumps.
+        exporter = ImageExporter(FigureManifest(fig_output_dir), profiler)
+    store = None
+    if args.store:
+        store = ClassSizeStore(args.store)
+    success = True
+    try:
+        for topic in args.topic:
+            if not process_topic(topic, fig_output_dir, data_output_dir,
+                                 profiler, exporter, store):
+                print(f'Error: Failed to process {topic}', file=sys.stderr)
+                success = False
+    finally:
+        if exporter is not None and not exporter.close():
+            success = False
+        if store is not None:
+            store.close()
+        profiler.print_counters()
+        profiler.write()
+    if not success:
+        sys.exit(1)
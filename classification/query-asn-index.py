@@ -0,0 +1,87 @@
+import argparse
+import sys
+from datetime import datetime, timezone
+
+from asn_index import DAY_MS, AsnIndex
+from class_state import CLASSES
+
+DATE_FMT = '%Y-%m-%d'
+OUTPUT_DELIMITER = ','
+
+
+def parse_day_argument(arg: str) -> int:
+    return int(datetime.strptime(arg, DATE_FMT)
+               .replace(tzinfo=timezone.utc).timestamp() * 1000) // DAY_MS
+
+
+def format_day(day: int) -> str:
+    return datetime.fromtimestamp(day * DAY_MS // 1000, tz=timezone.utc) \
+        .strftime(DATE_FMT)
+
+
+def get_ranges(days: list) -> list:
+    # Returns (first, last) tuples of the runs of consecutive days.
+    ranges = list()
+    for day in days:
+        if ranges and ranges[-1][1] == day - 1:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(day_range) for day_range in ranges]
+
+
+def main() -> None:
+    desc = """Print the days on which an AS was a dependency in each class,
+    as ranges of consecutive days, and optionally the scopes that depended
+    on it, from the index built by build-asn-index.py."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('index', help='SQLite ASN index')
+    parser.add_argument('asn', type=int)
+    parser.add_argument('--start', help='First day (YYYY-MM-DD)')
+    parser.add_argument('--end', help='Last day (YYYY-MM-DD)')
+    parser.add_argument('-c', '--class', dest='class_name',
+                        choices=[class_name for key, class_name in CLASSES],
+                        help='Only print this class')
+    parser.add_argument('-s', '--scopes', action='store_true',
+                        help='Print the days per scope that depended on the '
+                             'AS instead of per class')
+    args = parser.parse_args()
+
+    start_day = None
+    if args.start:
+        start_day = parse_day_argument(args.start)
+    end_day = None
+    if args.end:
+        end_day = parse_day_argument(args.end)
+
+    with AsnIndex(args.index) as index:
+        if args.scopes:
+            rows = index.get_scopes(args.asn, args.class_name, start_day,
+                                    end_day)
+            header = ['class', 'scope']
+        else:
+            rows = {(class_name,): days
+                    for class_name, days
+                    in index.get_classes(args.asn, start_day,
+                                         end_day).items()
+                    if args.class_name in (None, class_name)}
+            header = ['class']
+    if not rows:
+        print(f'Error: AS{args.asn} is not in the index in this range',
+              file=sys.stderr)
+        sys.exit(1)
+
+    class_order = {class_name: idx
+                   for idx, (key, class_name) in enumerate(CLASSES)}
+    print(OUTPUT_DELIMITER.join(header + ['days', 'first', 'last']))
+    for key in sorted(rows, key=lambda key: (class_order[key[0]],) + key[1:]):
+        days = rows[key]
+        for first, last in get_ranges(days):
+            print(OUTPUT_DELIMITER.join(
+                list(key) + [str(last - first + 1), format_day(first),
+                             format_day(last)]))
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -21,21 +21,16 @@ class SetPermutator:
         class_combinations = self.powerset(self.classes.items())
         for combination in class_combinations:
             if len(combination) == 0:
-                print(f'Skipped combination {combination}')
                 continue
             names, values = zip(*combination)
             # Build a set for all classes not in this combination to
             # calculate the difference later since we want exclusive
             # membership.
-            not_in_class_names = list()
             not_in_class_values = set()
             for name in self.classes:
                 if name not in names:
-                    not_in_class_names.append(name)
                     not_in_class_values.update(self.classes[name])
             class_name = ' '.join(names)
-            not_in_class_name = ' '.join(not_in_class_names)
-            print(f'class: {class_name} nclass: {not_in_class_name}')
             class_values = set.intersection(*values) - not_in_class_values
             self.permutations[class_name] = class_values
         self.permutations_computed = True
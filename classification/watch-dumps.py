@@ -0,0 +1,346 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from asn_index import AsnIndex
+from class_store import ClassSizeStore
+from common.figures import FigureManifest, render_figures
+from common.message_source import (DUMP_EXTENSION, STREAM_EXTENSION,
+                                   MemorySource, MessageSource, open_source)
+from common.profiling import Profiler, add_profile_arguments
+from common.scripts import load_script
+from figures import ImageExporter
+
+DATE_FMT = '%Y-%m-%d'
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_FILE_TS_FMT = '%Y-%m-%dT%H:%M'
+CLASSIFICATION_TOPIC = 'ihr_hegemony_classification'
+BGP_ONLY_TOPIC = 'ihr_hegemony_classification_bgp_only_dependencies'
+REPORT_SCRIPTS = ['plot-scopes', 'plot-dependencies',
+                  'plot-dependency-scope-relation']
+BGP_ONLY_SCRIPT = os.path.join(SCRIPT_DIR, '..', 'bgp-only-dependencies',
+                               'plot-cdf.py')
+STATE_FILE = '.watch-state.json'
+TMP_EXTENSION = '.tmp'
+
+
+def get_dump_timestamp(file_name: str, topic: str) -> datetime:
+    # Returns the timestamp of a dump or stream of topic, or None if the
+    # file belongs to another topic.
+    if not file_name.startswith(topic + '.'):
+        return None
+    for extension in [DUMP_EXTENSION, STREAM_EXTENSION]:
+        if file_name.endswith(extension):
+            try:
+                return datetime.strptime(
+                    file_name[len(topic) + 1:-len(extension)],
+                    RAW_FILE_TS_FMT)
+            except ValueError:
+                return None
+    return None
+
+
+def get_file_state(path: str) -> dict:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def find_completed_dumps(raw_folder: str, topic: str, settle: float) -> list:
+    # Returns (timestamp, path) tuples of the dumps of topic, sorted by
+    # timestamp. Dumps are written in place, so only files that were not
+    # modified for settle seconds are considered complete.
+    dumps = list()
+    now = time.time()
+    for file_name in os.listdir(raw_folder):
+        ts = get_dump_timestamp(file_name, topic)
+        if ts is None:
+            continue
+        path = os.path.abspath(os.path.join(raw_folder, file_name))
+        if now - os.path.getmtime(path) < settle:
+            continue
+        dumps.append((ts, path))
+    dumps.sort()
+    return dumps
+
+
+class WatchState:
+    """Processed and failed dumps and the daily overlap series of the
+    watched classification dumps. The state is written atomically after
+    every dump and whenever the overlap series is extended, so that a
+    restarted watcher neither reprocesses dumps nor the overlap history.
+    Dumps are identified by their path and file state, so a failed dump is
+    only retried once it was modified."""
+
+    def __init__(self, state_file: str, overlap):
+        self.state_file = state_file
+        self.processed = dict()
+        self.failed = dict()
+        self.scope_series = overlap.OverlapSeries()
+        self.dep_series = overlap.OverlapSeries()
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as f:
+                state = json.load(f)
+            self.processed = state['processed']
+            self.failed = state.get('failed', dict())
+            self.scope_series = \
+                overlap.OverlapSeries.from_dict(state['scope_series'])
+            self.dep_series = \
+                overlap.OverlapSeries.from_dict(state['dep_series'])
+
+    def is_processed(self, path: str) -> bool:
+        # A dump that changed since it was processed is processed again.
+        return self.processed.get(path) == get_file_state(path)
+
+    def has_failed(self, path: str) -> bool:
+        return self.failed.get(path) == get_file_state(path)
+
+    def mark_processed(self, path: str) -> None:
+        self.processed[path] = get_file_state(path)
+        self.failed.pop(path, None)
+
+    def mark_failed(self, path: str) -> None:
+        self.failed[path] = get_file_state(path)
+
+    def write(self) -> None:
+        tmp_file = self.state_file + TMP_EXTENSION
+        with open(tmp_file, 'w') as f:
+            json.dump({'processed': self.processed,
+                       'failed': self.failed,
+                       'scope_series': self.scope_series.to_dict(),
+                       'dep_series': self.dep_series.to_dict()}, f)
+        os.replace(tmp_file, self.state_file)
+
+
+class Watcher:
+    """Processes new classification dumps through the scope, dependency
+    and dependency-scope relation reports, appends them to the daily
+    overlap series, and plots the CDF of new bgp-only dumps."""
+
+    def __init__(self,
+                 args: argparse.Namespace,
+                 data_folder: str,
+                 figure_folder: str,
+                 profiler: Profiler):
+        self.args = args
+        self.data_folder = data_folder
+        self.figure_folder = figure_folder
+        self.profiler = profiler
+        self.reports = [load_script(SCRIPT_DIR, name)
+                        for name in REPORT_SCRIPTS]
+        self.overlap = load_script(SCRIPT_DIR, 'plot-daily-overlap')
+        self.state = WatchState(data_folder + STATE_FILE, self.overlap)
+        self.exporter = None
+        if not args.no_figures:
+            self.exporter = ImageExporter(FigureManifest(figure_folder),
+                                          profiler)
+        self.store = None
+        if args.store:
+            self.store = ClassSizeStore(args.store)
+        self.asn_index = None
+        if args.asn_index:
+            self.asn_index = AsnIndex(args.asn_index)
+
+    def process_classification(self, ts: datetime, path: str) -> bool:
+        # The dump is decoded once and its messages are read by all
+        # reports, the ASN index and the overlap series.
+        with self.profiler.stage('load'):
+            source = open_source(path)
+        if source is None:
+            return False
+        with self.profiler.stage('decode') as stage:
+            source = MemorySource(source)
+            stage.items = len(source.messages)
+        success = True
+        for report in self.reports:
+            if not report.process_source(source, self.figure_folder,
+                                         self.data_folder, self.profiler,
+                                         self.exporter, self.store):
+                print(f'Error: Failed to process {path}', file=sys.stderr)
+                success = False
+        if self.asn_index is not None:
+            self.index_asns(source)
+        date_key = ts.strftime(DATE_FMT)
+        if self.state.scope_series.dates \
+                and date_key <= self.state.scope_series.dates[-1]:
+            # The overlap is only defined between consecutive days.
+            print(f'Warning: Not adding {path} to the overlap series, since '
+                  f'it is not after {self.state.scope_series.dates[-1]}',
+                  file=sys.stderr)
+            return success
+        data = self.overlap.process_source(source, self.profiler)
+        with self.profiler.stage('partition'):
+            scope_classes = data.scopes.get_permutations()
+            dep_classes = data.dependencies.get_permutations()
+        for series, prefix, figure, classes in [
+                (self.state.scope_series, 'scope', 'scope-overlap.pdf',
+                 scope_classes),
+                (self.state.dep_series, 'dep', 'dep-overlap.pdf',
+                 dep_classes)]:
+            old_files = list()
+            if series.dates:
+                old_files = self.overlap.get_overlap_files(
+                    series, prefix, self.args.topic,
+                    self.data_folder).values()
+            with self.profiler.stage('overlap') as stage:
+                series.add(date_key, classes)
+                stage.items = 1
+            with self.profiler.stage('output'):
+                self.overlap.write_overlap(series, prefix, self.args.topic,
+                                           self.data_folder)
+            # The file names contain the range of the series, so the
+            # files of the previous range are replaced.
+            for old_file in old_files:
+                if os.path.exists(old_file):
+                    os.remove(old_file)
+            # The overlap figure changes with every day, so it is rendered
+            # without the manifest, which is also written by the exporter
+            # thread.
+            if not self.args.no_figures and len(series.dates) > 1:
+                with self.profiler.stage('render') as stage:
+                    render_figures(self.overlap.plot_percentage,
+                                   [(series.dates[1:], series.get_overlap(),
+                                     self.figure_folder + figure)],
+                                   1)
+                    stage.items = 1
+        # The extended series is kept even if a report failed and the dump
+        # is not marked as processed.
+        self.state.write()
+        return success
+
+    def index_asns(self, source: MessageSource) -> None:
+        with self.profiler.stage('index') as stage:
+            self.asn_index.add_messages(source.header['name'],
+                                        source.header['start_ts'], source)
+            self.asn_index.flush()
+            stage.items = source.count
+
+    def process_bgp_only(self, path: str) -> bool:
+        # plot-cdf.py imports the modules of its own directory, which are
+        # not importable from here, so it is run as a separate process.
+        command = [sys.executable, BGP_ONLY_SCRIPT,
+                   '-f', self.figure_folder,
+                   '-d', self.data_folder]
+        if self.args.no_figures:
+            command.append('-n')
+        command.append(path)
+        with self.profiler.stage('bgp-only'):
+            result = subprocess.run(command)
+        if result.returncode != 0:
+            print(f'Error: Failed to process {path}', file=sys.stderr)
+            return False
+        return True
+
+    def poll(self) -> int:
+        # Processes all completed dumps that were not processed yet and
+        # returns their number. Dumps that failed are only retried once
+        # they are modified.
+        processed = 0
+        sources = [(self.args.raw_folder, self.args.topic,
+                    self.process_classification)]
+        if self.args.bgp_only_folder:
+            sources.append((self.args.bgp_only_folder, BGP_ONLY_TOPIC,
+                            lambda ts, path: self.process_bgp_only(path)))
+        for raw_folder, topic, process in sources:
+            for ts, path in find_completed_dumps(raw_folder, topic,
+                                                 self.args.settle):
+                if self.state.is_processed(path) \
+                        or self.state.has_failed(path):
+                    continue
+                print(f'Processing {path}')
+                if not process(ts, path):
+                    self.profiler.count('failed dumps')
+                    self.state.mark_failed(path)
+                    self.state.write()
+                    continue
+                self.state.mark_processed(path)
+                self.state.write()
+                self.profiler.count('dumps')
+                processed += 1
+        if self.exporter is not None:
+            # Keep the progress of already exported figures.
+            self.exporter.write_manifest()
+        return processed
+
+    def close(self) -> bool:
+        if self.store is not None:
+            self.store.close()
+        if self.asn_index is not None:
+            self.asn_index.close()
+        if self.exporter is not None:
+            return self.exporter.close()
+        return True
+
+
+def main() -> None:
+    desc = """Watch the raw directories for new dumps and process each dump
+    once as it arrives. The daily overlap series is extended by every new
+    classification dump instead of being recomputed."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('raw_folder',
+                        help='Directory of the classification dumps')
+    parser.add_argument('-b', '--bgp-only-folder',
+                        help='Directory of the bgp-only dependency dumps')
+    parser.add_argument('-t', '--topic', default=CLASSIFICATION_TOPIC,
+                        help=f'Classification topic (default: '
+                             f'{CLASSIFICATION_TOPIC})')
+    parser.add_argument('-f', '--fig-output', help='Figure output directory',
+                        default='./')
+    parser.add_argument('-d', '--data-output', help='Data output directory',
+                        default='./')
+    parser.add_argument('-i', '--interval', type=float, default=60,
+                        help='Seconds between polls (default: 60)')
+    parser.add_argument('-s', '--settle', type=float, default=120,
+                        help='Seconds a dump has to be unmodified before it '
+                             'is considered complete (default: 120)')
+    parser.add_argument('--store',
+                        help='Also add the class sizes of each dump to this '
+                             'SQLite time-series store')
+    parser.add_argument('--asn-index',
+                        help='Also add each dump to this inverted ASN index '
+                             '(see build-asn-index.py)')
+    parser.add_argument('-1', '--once', action='store_true',
+                        help='Process the present dumps and exit')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='Only write data files')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    profiler = Profiler.from_args(args)
+
+    fig_output_dir: str = args.fig_output
+    if not fig_output_dir.endswith('/'):
+        fig_output_dir += '/'
+
+    data_output_dir = args.data_output
+    if not data_output_dir.endswith('/'):
+        data_output_dir += '/'
+
+    os.makedirs(fig_output_dir, exist_ok=True)
+    os.makedirs(data_output_dir, exist_ok=True)
+    watcher = Watcher(args, data_output_dir, fig_output_dir, profiler)
+    success = True
+    try:
+        while True:
+            watcher.poll()
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        success = watcher.close()
+        profiler.print_counters()
+        profiler.write()
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+
+MANIFEST_FILE = '.figure-manifest.json'
+
+
+def update_hash(hash_obj, value) -> None:
+    # Feed a canonical representation of value into hash_obj. Unlike
+    # pickle, this does not depend on the iteration order of sets and
+    # dicts and includes the full content of numpy arrays.
+    if isinstance(value, np.ndarray):
+        hash_obj.update(f'ndarray:{value.dtype}:{value.shape}:'.encode())
+        hash_obj.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        hash_obj.update(f'dict:{len(value)}:'.encode())
+        for key in sorted(value, key=repr):
+            update_hash(hash_obj, key)
+            update_hash(hash_obj, value[key])
+    elif isinstance(value, (set, frozenset)):
+        hash_obj.update(f'set:{len(value)}:'.encode())
+        for entry in sorted(value, key=repr):
+            update_hash(hash_obj, entry)
+    elif isinstance(value, (list, tuple)):
+        hash_obj.update(f'list:{len(value)}:'.encode())
+        for entry in value:
+            update_hash(hash_obj, entry)
+    else:
+        hash_obj.update(f'{type(value).__name__}:{value!r};'.encode())
+
+
+def get_key(*values) -> str:
+    hash_obj = hashlib.sha256()
+    update_hash(hash_obj, values)
+    return hash_obj.hexdigest()
+
+
+def import_pyplot():
+    # Plotting libraries are only imported once a figure is rendered, so
+    # that runs which only write data files start quickly.
+    import matplotlib
+    # Figures are only written to files, so use a non-interactive backend.
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+class FigureManifest:
+    """Keeps track of the input key of each figure in an output
+    directory, so that figures are only rendered if their input data or
+    plotting parameters changed."""
+
+    def __init__(self, output_dir: str):
+        self.file = os.path.join(output_dir, MANIFEST_FILE)
+        self.entries = dict()
+        self.modified = False
+        if os.path.exists(self.file):
+            with open(self.file, 'r') as f:
+                self.entries = json.load(f)
+
+    def is_current(self, output_file: str, key: str) -> bool:
+        return self.entries.get(os.path.basename(output_file)) == key \
+            and os.path.exists(output_file)
+
+    def update(self, output_file: str, key: str) -> None:
+        self.entries[os.path.basename(output_file)] = key
+        self.modified = True
+
+    def write(self) -> None:
+        if not self.modified:
+            return
+        # Write to a temporary file first so that an interrupted run does
+        # not leave a truncated manifest behind.
+        tmp_file = self.file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.entries, f, indent=0, sort_keys=True)
+        os.replace(tmp_file, self.file)
+        self.modified = False
+
+
+def render_figures(plot_function,
+                   jobs,
+                   processes: int,
+                   manifest: FigureManifest = None) -> None:
+    # Call plot_function for each tuple of arguments in jobs. The last
+    # argument of each job is the output file. The plot data needs to be
+    # computed beforehand so that only picklable objects are passed to
+    # the worker processes. jobs can be a generator, in which case at
+    # most 2 * processes jobs are pending at the same time.
+    # If a manifest is given, jobs whose output file exists and was
+    # rendered from the same arguments are skipped.
+    rendered = 0
+    skipped = 0
+    pool = None
+    if processes > 1:
+        pool = Pool(processes)
+    pending = deque()
+
+    def finish(output_file: str, key: str, result=None) -> None:
+        if result is not None:
+            result.get()
+        if manifest is not None:
+            manifest.update(output_file, key)
+
+    try:
+        for job in jobs:
+            output_file = job[-1]
+            key = None
+            if manifest is not None:
+                key = get_key(plot_function.__name__, job)
+                if manifest.is_current(output_file, key):
+                    skipped += 1
+                    continue
+            rendered += 1
+            if pool is None:
+                plot_function(*job)
+                finish(output_file, key)
+                continue
+            pending.append((output_file, key,
+                            pool.apply_async(plot_function, job)))
+            if len(pending) >= 2 * processes:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if manifest is not None:
+            # Keep the progress of already rendered figures.
+            manifest.write()
+    if manifest is not None:
+        print(f'Rendered {rendered} figures, skipped {skipped} unchanged '
+              f'figures')
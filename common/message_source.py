@@ -0,0 +1,146 @@
+import bz2
+import os
+import pickle
+import sys
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+import msgpack
+
+DUMP_EXTENSION = '.pickle.bz2'
+STREAM_EXTENSION = '.msgpack'
+STDIN = '-'
+# Timestamp format of the dump file names written by dump-topic.py.
+PREFIX_TS_FMT = '%Y-%m-%dT%H:%M'
+# Name of the daily dumps in a raw folder.
+RAW_FILE_TS_FMT = '%Y-%m-%dT00:00'
+RAW_FILE_FMT = '{topic}.{timestamp}' + DUMP_EXTENSION
+
+
+class MessageSource(ABC):
+    """Messages of one topic dump. Iterating a source yields the decoded
+    messages one at a time, so that they can be processed while they are
+    read. The header with the name, start_ts and end_ts of the dump is
+    available before the first message is read.
+
+    Subclasses implement get_raw_messages, which yields (ts, msg) tuples
+    with msgpack-encoded messages."""
+
+    def __init__(self, header: dict, prefix: str = None):
+        self.header = header
+        # Prefix of output file names. Defaults to the name of the dump
+        # file that dump-topic.py would have written.
+        if prefix is None:
+            start = datetime.fromtimestamp(header['start_ts'] / 1000,
+                                           tz=timezone.utc)
+            prefix = header['name'] + '.' + start.strftime(PREFIX_TS_FMT)
+        self.prefix = prefix
+        # Number of messages read so far.
+        self.count = 0
+
+    @abstractmethod
+    def get_raw_messages(self):
+        pass
+
+    def __iter__(self):
+        for ts, msg in self.get_raw_messages():
+            self.count += 1
+            yield msgpack.unpackb(msg)
+
+
+class DumpSource(MessageSource):
+    """Reads a *.pickle.bz2 dump written by dump-topic.py. The pickle
+    container has to be loaded at once, but the raw messages are released
+    while they are read."""
+
+    def __init__(self, input_file: str):
+        with bz2.open(input_file, 'rb') as f:
+            data = pickle.load(f)
+        self.raw_messages = data.pop('messages')
+        super().__init__(data,
+                         os.path.basename(input_file)[:-len(DUMP_EXTENSION)])
+
+    def get_raw_messages(self):
+        self.raw_messages.reverse()
+        while self.raw_messages:
+            yield self.raw_messages.pop()
+
+
+class StreamSource(MessageSource):
+    """Reads a stream of msgpack objects from a binary file object: first
+    the header map, then one [ts, msg] array per message. Messages are
+    read incrementally, so the stream can be consumed while a consumer of
+    the message bus writes it, e.g., through a pipe."""
+
+    def __init__(self, f, prefix: str = None):
+        self.unpacker = msgpack.Unpacker(f, raw=False)
+        super().__init__(self.unpacker.unpack(), prefix)
+
+    def get_raw_messages(self):
+        for ts, msg in self.unpacker:
+            yield ts, msg
+
+
+class MemorySource(MessageSource):
+    """Keeps the decoded messages of another source in memory, so that
+    several consumers can read a dump that was only decoded once. Unlike
+    the other sources, it can be iterated more than once and count is the
+    number of messages read by the current iteration."""
+
+    def __init__(self, source: MessageSource):
+        self.messages = [(ts, msgpack.unpackb(msg))
+                         for ts, msg in source.get_raw_messages()]
+        super().__init__(source.header, source.prefix)
+
+    def get_raw_messages(self):
+        for ts, msg in self.messages:
+            yield ts, msgpack.packb(msg)
+
+    def __iter__(self):
+        self.count = 0
+        for ts, msg in self.messages:
+            self.count += 1
+            yield msg
+
+
+def get_raw_file(raw_folder: str, topic: str, timestamp: datetime) -> str:
+    # Returns the dump of topic for the day of timestamp in raw_folder, or
+    # the message stream written instead of the dump. Returns an empty
+    # string if there is neither.
+    file_name = \
+        RAW_FILE_FMT.format(topic=topic,
+                            timestamp=timestamp.strftime(RAW_FILE_TS_FMT))
+    ret = raw_folder + file_name
+    if not os.path.exists(ret):
+        stream_file = ret[:-len(DUMP_EXTENSION)] + STREAM_EXTENSION
+        if os.path.exists(stream_file):
+            return stream_file
+        return str()
+    return ret
+
+
+def open_source(path: str) -> MessageSource:
+    # Opens a dump or stream file, or the stream on stdin if path is '-'.
+    # Returns None if the type of the file is unknown.
+    if path == STDIN:
+        return StreamSource(sys.stdin.buffer)
+    if path.endswith(DUMP_EXTENSION):
+        return DumpSource(path)
+    if path.endswith(STREAM_EXTENSION):
+        # The file is closed once the source is garbage collected.
+        return StreamSource(open(path, 'rb'),
+                            os.path.basename(path)[:-len(STREAM_EXTENSION)])
+    print(f'Error: Expected {DUMP_EXTENSION} or {STREAM_EXTENSION} input '
+          f'file, but got {path}', file=sys.stderr)
+    return None
+
+
+def write_stream(f, header: dict, raw_messages) -> None:
+    # Writes a stream that can be read by StreamSource to the binary file
+    # object f.
+    packer = msgpack.Packer()
+    f.write(packer.pack({'name': header['name'],
+                         'start_ts': header['start_ts'],
+                         'end_ts': header['end_ts']}))
+    for ts, msg in raw_messages:
+        f.write(packer.pack([ts, msg]))
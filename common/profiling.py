@@ -0,0 +1,134 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock
+
+
+def add_profile_arguments(parser) -> None:
+    parser.add_argument('--profile', metavar='REPORT',
+                        help='write wall time, CPU time and throughput per '
+                             'stage and peak memory to this JSON file')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='write cProfile statistics to this file')
+
+
+def get_peak_rss() -> float:
+    # Peak resident set size of this process in MiB (ru_maxrss is in KiB
+    # on Linux).
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Stage:
+
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+
+    def to_dict(self) -> dict:
+        items_per_second = 0
+        if self.wall_time > 0:
+            items_per_second = self.items / self.wall_time
+        return {'calls': self.calls,
+                'items': self.items,
+                'wall_time': self.wall_time,
+                'cpu_time': self.cpu_time,
+                'items_per_second': items_per_second}
+
+
+class Profiler:
+    """Records the wall time, CPU time and number of processed items
+    (messages, rows, figures) of the stages of a script and writes them
+    with the peak memory of the process as a JSON report. Stages with the
+    same name are accumulated. If no report file is given, stages are not
+    recorded.
+
+    Counters replace per-item progress output and are always kept, so
+    that they can be printed as a summary at the end."""
+
+    def __init__(self, report_file: str = None, cprofile_file: str = None):
+        self.report_file = report_file
+        self.cprofile_file = cprofile_file
+        self.stages = dict()
+        self.counters = Counter()
+        # Stages timed in other threads are merged with add_stage.
+        self.lock = Lock()
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+        self.cprofile = None
+        if cprofile_file:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.profile, args.cprofile)
+
+    @property
+    def enabled(self) -> bool:
+        return self.report_file is not None
+
+    @contextmanager
+    def stage(self, name: str):
+        # Yields a Stage whose items attribute can be set to the number of
+        # items processed in this stage.
+        stage = Stage()
+        if not self.enabled:
+            yield stage
+            return
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.calls = 1
+            stage.wall_time = time.perf_counter() - start_wall_time
+            stage.cpu_time = time.process_time() - start_cpu_time
+            self.add_stage(name, stage)
+
+    def add_stage(self, name: str, stage: Stage) -> None:
+        # Accumulates a stage that was timed elsewhere, e.g., in a
+        # background thread.
+        if not self.enabled:
+            return
+        with self.lock:
+            total = self.stages.setdefault(name, Stage())
+            total.calls += stage.calls
+            total.items += stage.items
+            total.wall_time += stage.wall_time
+            total.cpu_time += stage.cpu_time
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def print_counters(self, file=sys.stdout) -> None:
+        for name, value in self.counters.items():
+            print(f'{name}: {value}', file=file)
+
+    def write(self) -> None:
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_file)
+        if not self.enabled:
+            return
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        report = {'script': os.path.basename(sys.argv[0]),
+                  'args': sys.argv[1:],
+                  'wall_time': time.perf_counter() - self.start_wall_time,
+                  'cpu_time': time.process_time() - self.start_cpu_time,
+                  # CPU time of worker processes, e.g., figure rendering.
+                  'children_cpu_time': children.ru_utime + children.ru_stime,
+                  'peak_rss': get_peak_rss(),
+                  'stages': {name: stage.to_dict()
+                             for name, stage in self.stages.items()},
+                  'counters': dict(self.counters)}
+        tmp_file = self.report_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(report, f, indent=1)
+        os.replace(tmp_file, self.report_file)
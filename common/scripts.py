@@ -0,0 +1,14 @@
+import importlib.util
+import os
+
+
+def load_script(directory: str, name: str):
+    # The scripts have hyphenated names and can not be imported directly.
+    # Their main code is guarded, so loading them only defines their
+    # functions.
+    path = os.path.join(directory, name + '.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'),
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from multiprocessing import Pool
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import get_peak_rss
+from common.scripts import load_script
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_THRESHOLD = 0.2
+# Stages faster than this are not flagged as regressions, since their
+# run time is dominated by noise.
+MIN_TIME = 0.05
+
+
+def run_pipeline(data_dir: str,
+                 iterations: int,
+                 percentile: int,
+                 values: set,
+                 figures: bool) -> dict:
+    # Run the stages of plot-summary.py (and the box statistics of
+    # plot-per-scope.py) on one directory. This is run in a fresh process
+    # per directory, so the peak RSS after a stage is the peak of all
+    # stages up to and including it.
+    summary = load_script(SCRIPT_DIR, 'plot-summary')
+    per_scope = load_script(SCRIPT_DIR, 'plot-per-scope')
+    results = dict()
+    state = dict()
+
+    def load():
+        state['ref_data'], state['data'] = summary.load_data(data_dir, values)
+
+    def fill():
+        summary.fill_missing_values(state['data'], iterations)
+
+    def strip():
+        summary.strip_empty_sampling_values(state['data'])
+
+    def box_stats():
+        for scope in state['data']:
+            per_scope.get_box_stats(state['data'][scope])
+
+    def filter_deps():
+        for scope in state['data']:
+            if scope in state['ref_data']:
+                summary.filter_dependencies(state['data'][scope], percentile)
+
+    def diff():
+        global_diffs = defaultdict(lambda: defaultdict(list))
+        summaries = dict()
+        for scope in state['data']:
+            if scope not in state['ref_data']:
+                continue
+            scope_diffs = summary.get_diffs(state['ref_data'][scope],
+                                            state['data'][scope])
+            summaries[str(scope)] = summary.get_summary(scope_diffs)
+            for sampling_value in scope_diffs:
+                for asn in scope_diffs[sampling_value]:
+                    global_diffs[sampling_value][asn] += \
+                        scope_diffs[sampling_value][asn]
+        summaries['global'] = summary.get_summary(global_diffs)
+        state['summaries'] = summaries
+
+    def plot():
+        with tempfile.TemporaryDirectory() as output_dir:
+            for scope, scope_summary in state['summaries'].items():
+                summary.plot_summary(scope, scope_summary,
+                                     os.path.join(output_dir, scope
+                                                  + '-summary'
+                                                  + summary.FIG_EXTENSION))
+
+    stages = [('load', load), ('fill', fill), ('strip', strip),
+              ('box_stats', box_stats), ('filter', filter_deps),
+              ('diff', diff)]
+    if figures:
+        stages.append(('plot', plot))
+    for stage, function in stages:
+        start = time.perf_counter()
+        function()
+        results[stage] = {'wall_time': time.perf_counter() - start,
+                          'peak_rss': get_peak_rss()}
+    return results
+
+
+def load_baseline(baseline_file: str) -> dict:
+    if not os.path.exists(baseline_file):
+        return dict()
+    with open(baseline_file, 'r') as f:
+        return json.load(f)
+
+
+def write_results(results: dict, output_file: str) -> None:
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, output_file)
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float) -> list:
+    # Returns (data_dir, stage, metric, baseline, current) tuples for all
+    # stages whose wall time or peak RSS grew by more than threshold.
+    regressions = list()
+    baseline_dirs = baseline.get('dirs', dict())
+    for data_dir, stages in results['dirs'].items():
+        for stage, current in stages.items():
+            previous = baseline_dirs.get(data_dir, dict()).get(stage)
+            if previous is None:
+                continue
+            if current['wall_time'] > previous['wall_time'] * (1 + threshold) \
+                    and current['wall_time'] - previous['wall_time'] \
+                    > MIN_TIME:
+                regressions.append((data_dir, stage, 'wall_time',
+                                    previous['wall_time'],
+                                    current['wall_time']))
+            if current['peak_rss'] > previous['peak_rss'] * (1 + threshold):
+                regressions.append((data_dir, stage, 'peak_rss',
+                                    previous['peak_rss'],
+                                    current['peak_rss']))
+    return regressions
+
+
+def main() -> None:
+    desc = """Time the stages of the sampling pipeline on scope size
+    directories and compare the results to a stored baseline."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('data_dir', nargs='+',
+                        help='scope size directories, e.g., '
+                             'varying-scope-sizes/10')
+    parser.add_argument('-i', '--iterations', type=int, default=50,
+                        help='number of iterations per sampling value '
+                             '(default: 50)')
+    parser.add_argument('-v', '--values', type=lambda l: set(l.split(',')),
+                        help='comma-separated list of sampling values')
+    parser.add_argument('-p', '--percentile', type=int, default=90,
+                        help='percentile of the dependency filter '
+                             '(default: 90)')
+    parser.add_argument('-b', '--baseline', default='benchmark-baseline.json',
+                        help='baseline file (default: '
+                             'benchmark-baseline.json)')
+    parser.add_argument('-u', '--update-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('-o', '--output', help='write the results to this '
+                                               'JSON file')
+    parser.add_argument('-t', '--threshold', type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help=f'relative increase of wall time or peak RSS '
+                             f'that is flagged as a regression (default: '
+                             f'{DEFAULT_THRESHOLD})')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='skip the plot stage')
+    args = parser.parse_args()
+
+    results = {'python': platform.python_version(),
+               'iterations': args.iterations,
+               'percentile': args.percentile,
+               'dirs': dict()}
+    print(f'{"directory":<30} {"stage":<10} {"time (s)":>10} '
+          f'{"peak RSS (MiB)":>15}')
+    for data_dir in args.data_dir:
+        if not os.path.isdir(data_dir):
+            print(f'Error: Not a directory: {data_dir}', file=sys.stderr)
+            sys.exit(1)
+        key = os.path.normpath(data_dir)
+        if not data_dir.endswith('/'):
+            data_dir += '/'
+        # Use a new process per directory so that the peak RSS is not
+        # influenced by previous directories.
+        with Pool(1) as pool:
+            dir_results = pool.apply(run_pipeline,
+                                     (data_dir, args.iterations,
+                                      args.percentile, args.values,
+                                      not args.no_figures))
+        results['dirs'][key] = dir_results
+        for stage, result in dir_results.items():
+            print(f'{key:<30} {stage:<10} {result["wall_time"]:>10.3f} '
+                  f'{result["peak_rss"]:>15.1f}')
+
+    if args.output:
+        write_results(results, args.output)
+
+    baseline = load_baseline(args.baseline)
+    regressions = list()
+    if baseline:
+        regressions = find_regressions(results, baseline, args.threshold)
+        for data_dir, stage, metric, previous, current in regressions:
+            print(f'Regression: {data_dir} {stage} {metric}: '
+                  f'{previous:.3f} -> {current:.3f}', file=sys.stderr)
+        if not regressions:
+            print(f'No regressions compared to {args.baseline}')
+    elif not args.update_baseline:
+        print(f'No baseline found at {args.baseline}')
+
+    if args.update_baseline:
+        # Keep the baseline of directories that were not part of this run.
+        baseline_dirs = baseline.get('dirs', dict())
+        baseline_dirs.update(results['dirs'])
+        results['dirs'] = baseline_dirs
+        write_results(results, args.baseline)
+        print(f'Updated baseline {args.baseline}')
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -7,7 +7,6 @@ then
 fi
 DIR=${1%/}
 
-for DUMP in "${DIR}"/*/ihr_hegemony_*.pickle.bz2
-do
-    python3 extract-data.py "${DUMP}"
-done
+# Dumps whose outputs are current according to the manifest are skipped.
+python3 extract-data.py -m "${DIR}/.extract-manifest.json" \
+    "${DIR}"/*/ihr_hegemony_*.pickle.bz2
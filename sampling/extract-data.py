@@ -1,52 +1,223 @@
 import argparse
-import bz2
+import json
 import os
-import pickle
 import sys
+from array import array
 
-import msgpack
+import numpy as np
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.message_source import (DUMP_EXTENSION, STDIN,
+                                   STREAM_EXTENSION, MessageSource,
+                                   open_source)
+from common.profiling import Profiler, add_profile_arguments
 
-INPUT_EXTENSION = '.pickle.bz2'
 OUTPUT_EXTENSION = '.csv'
 OUTPUT_DELIMITER = ','
+COMPACT_OUTPUT_EXTENSION = '.npz'
+# Size of the write buffer of the CSV output in bytes.
+WRITE_BUFFER_SIZE = 1024 * 1024
+TMP_EXTENSION = '.tmp'
 
 
-def main() -> None:
-    parser = argparse.ArgumentParser()
-    parser.add_argument('input', help='*.pickle.bz2 topic dump')
-    parser.add_argument('-o', '--output_dir', help='specify output directory')
+def get_rows(messages):
+    # Yields (scope, asn, hege, nb_peers) rows, skipping the global scope
+    # and the dependency of a scope on itself.
+    for msg in messages:
+        if msg['scope'] == '-1' or msg['scope'] == msg['asn']:
+            continue
+        yield msg['scope'], msg['asn'], msg['hege'], msg['nb_peers']
 
-    args = parser.parse_args()
 
-    path, file = os.path.split(args.input)
-    if not file.endswith(INPUT_EXTENSION):
+class CompactWriter:
+    """Collects rows in typed column buffers and writes them as numpy
+    arrays to a compressed .npz file with the columns scope, asn, hege
+    and nb_peers."""
+
+    def __init__(self):
+        self.scope = array('q')
+        self.asn = array('q')
+        self.hege = array('d')
+        self.nb_peers = array('q')
+
+    def add(self, scope, asn, hege, nb_peers) -> None:
+        self.scope.append(int(scope))
+        self.asn.append(int(asn))
+        self.hege.append(float(hege))
+        self.nb_peers.append(int(nb_peers))
+
+    def write(self, f) -> None:
+        np.savez_compressed(f,
+                            scope=np.frombuffer(self.scope, dtype=np.int64),
+                            asn=np.frombuffer(self.asn, dtype=np.int64),
+                            hege=np.frombuffer(self.hege, dtype=np.float64),
+                            nb_peers=np.frombuffer(self.nb_peers,
+                                                   dtype=np.int64))
+
+
+def get_output_file(input_file: str, output_dir: str) -> str:
+    path, file = os.path.split(input_file)
+    if file.endswith(DUMP_EXTENSION):
+        file = file[:-len(DUMP_EXTENSION)] + OUTPUT_EXTENSION
+    elif file.endswith(STREAM_EXTENSION):
+        file = file[:-len(STREAM_EXTENSION)] + OUTPUT_EXTENSION
+    else:
         print(f'Warning: Unexpected extension for input file. Will append '
               f'{OUTPUT_EXTENSION} to full name.')
         file += OUTPUT_EXTENSION
-    else:
-        file = file[:-len(INPUT_EXTENSION)] + OUTPUT_EXTENSION
 
-    if args.output_dir:
-        output_dir = args.output_dir
+    if output_dir:
         if not output_dir.endswith('/'):
             output_dir += '/'
-        output_file = output_dir + file
-    else:
-        output_file = path + '/' + file
+        return output_dir + file
+    return path + '/' + file
 
-    print(f'Reading file {args.input}')
-    data = pickle.load(bz2.BZ2File(args.input, 'rb'))
-    messages = [msgpack.unpackb(msg[1]) for msg in data['messages']]
 
+def get_output_files(output_file: str, compact: bool) -> list:
+    output_files = [output_file]
+    if compact:
+        output_files.append(output_file[:-len(OUTPUT_EXTENSION)]
+                            + COMPACT_OUTPUT_EXTENSION)
+    return output_files
+
+
+def extract(source: MessageSource,
+            output_file: str,
+            compact: bool,
+            profiler: Profiler) -> None:
+    # Rows are written while the messages are read from the source. All
+    # outputs are written to temporary files first and only moved to
+    # their final name once complete, so that an interrupted run never
+    # leaves truncated files behind.
+    compact_writer = None
+    if compact:
+        compact_writer = CompactWriter()
     print(f'Writing output to {output_file}')
-    with open(output_file, 'w') as f:
+    rows = 0
+    tmp_file = output_file + TMP_EXTENSION
+    with profiler.stage('convert') as stage, \
+            open(tmp_file, 'w', buffering=WRITE_BUFFER_SIZE) as f:
         f.write(OUTPUT_DELIMITER.join(['scope', 'asn', 'hege', 'nb_peers'])
                 + '\n')
-        for msg in messages:
-            if msg['scope'] == '-1' or msg['scope'] == msg['asn']:
-                continue
-            fields = [msg['scope'], msg['asn'], msg['hege'], msg['nb_peers']]
-            f.write(OUTPUT_DELIMITER.join(map(str, fields)) + '\n')
+        for row in get_rows(source):
+            f.write(OUTPUT_DELIMITER.join(map(str, row)) + '\n')
+            if compact_writer is not None:
+                compact_writer.add(*row)
+            rows += 1
+        stage.items = rows
+    profiler.count('messages', source.count)
+    profiler.count('rows', rows)
+    print(f'Wrote {rows} rows')
+
+    if compact_writer is not None:
+        compact_output_file = get_output_files(output_file, compact)[1]
+        print(f'Writing compact output to {compact_output_file}')
+        compact_tmp_file = compact_output_file + TMP_EXTENSION
+        with profiler.stage('compact output') as stage, \
+                open(compact_tmp_file, 'wb') as f:
+            compact_writer.write(f)
+            stage.items = rows
+        os.replace(compact_tmp_file, compact_output_file)
+    os.replace(tmp_file, output_file)
+
+
+def get_input_state(input_file: str) -> dict:
+    stat = os.stat(input_file)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_manifest(manifest_file: str) -> dict:
+    # The manifest maps the absolute path of each extracted dump to its
+    # size and modification time at extraction and the written outputs.
+    if not os.path.exists(manifest_file):
+        return dict()
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(manifest: dict, manifest_file: str) -> None:
+    tmp_file = manifest_file + TMP_EXTENSION
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def is_current(manifest: dict, input_file: str, output_files: list) -> bool:
+    entry = manifest.get(os.path.abspath(input_file))
+    if entry is None or entry['input'] != get_input_state(input_file):
+        return False
+    for output_file in output_files:
+        if os.path.abspath(output_file) not in entry['outputs'] \
+                or not os.path.exists(output_file):
+            return False
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', nargs='+',
+                        help='*.pickle.bz2 topic dump(s) or *.msgpack '
+                             'stream(s), or - to read a stream from stdin')
+    parser.add_argument('-o', '--output_dir', help='specify output directory')
+    parser.add_argument('-c', '--compact', action='store_true',
+                        help=f'additionally write a compact columnar '
+                             f'{COMPACT_OUTPUT_EXTENSION} file')
+    parser.add_argument('-m', '--manifest',
+                        help='skip dumps that were already extracted '
+                             'according to this manifest file and record '
+                             'new extractions in it')
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    profiler = Profiler.from_args(args)
+
+    manifest = dict()
+    if args.manifest:
+        manifest = load_manifest(args.manifest)
+
+    extracted = 0
+    skipped = 0
+    for input_file in args.input:
+        if input_file == STDIN:
+            # The name of a stream on stdin is only known from its header.
+            # It is not recorded in the manifest, since it can not be read
+            # again.
+            with profiler.stage('load'):
+                source = open_source(input_file)
+            output_file = get_output_file(
+                './' + source.prefix + STREAM_EXTENSION, args.output_dir)
+            extract(source, output_file, args.compact, profiler)
+            extracted += 1
+            continue
+        output_file = get_output_file(input_file, args.output_dir)
+        output_files = get_output_files(output_file, args.compact)
+        if args.manifest and is_current(manifest, input_file, output_files):
+            skipped += 1
+            continue
+        # Read the state before extraction, so that a dump that changes
+        # while it is read is extracted again on the next run.
+        input_state = get_input_state(input_file)
+        print(f'Reading file {input_file}')
+        with profiler.stage('load'):
+            source = open_source(input_file)
+        if source is None:
+            sys.exit(1)
+        extract(source, output_file, args.compact, profiler)
+        extracted += 1
+        if args.manifest:
+            manifest[os.path.abspath(input_file)] = {
+                'input': input_state,
+                'outputs': [os.path.abspath(output_file)
+                            for output_file in output_files]
+            }
+            write_manifest(manifest, args.manifest)
+    if args.manifest:
+        print(f'Extracted {extracted} dumps, skipped {skipped} unchanged '
+              f'dumps')
+    profiler.print_counters()
+    profiler.write()
 
 
 if __name__ == '__main__':
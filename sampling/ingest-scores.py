@@ -0,0 +1,105 @@
+import argparse
+import os
+import sys
+
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.profiling import Profiler, add_profile_arguments
+from score_db import (DATA_EXTENSION, REFERENCE_DIR_NAME, REFERENCE_VALUE,
+                      ScoreDatabase, get_iteration)
+
+
+def ingest_scope_size(db: ScoreDatabase,
+                      path: str,
+                      scope_size: str,
+                      profiler: Profiler) -> None:
+    # Ingests the sampling value and reference directories of one scope
+    # size directory.
+    present = set()
+    for entry in os.scandir(path):
+        if not entry.is_dir():
+            continue
+        if entry.name == REFERENCE_DIR_NAME:
+            sampling_value = REFERENCE_VALUE
+        elif entry.name.isdigit():
+            sampling_value = int(entry.name)
+        else:
+            continue
+        sampling_path = path + entry.name + '/'
+        with db.connection:
+            ingest_dir(db, sampling_path, scope_size, sampling_value,
+                       present, profiler)
+    with profiler.stage('remove'), db.connection:
+        profiler.count('removed files',
+                       db.remove_missing_files(scope_size, present))
+
+
+def ingest_dir(db: ScoreDatabase,
+               sampling_path: str,
+               scope_size: str,
+               sampling_value: int,
+               present: set,
+               profiler: Profiler) -> None:
+    # Ingests the files of one sampling value directory and adds their
+    # paths to present.
+    for file in os.scandir(sampling_path):
+        if not file.is_file() or not file.name.endswith(DATA_EXTENSION):
+            continue
+        try:
+            iteration = get_iteration(file.name)
+        except ValueError as e:
+            print(f'Error: Failed to get iteration from file name '
+                  f'{file.name}: {e}', file=sys.stderr)
+            continue
+        file_path = os.path.abspath(sampling_path + file.name)
+        present.add(file_path)
+        with profiler.stage('ingest') as stage:
+            scores = db.ingest_file(file_path, scope_size,
+                                    sampling_value, iteration)
+            if scores >= 0:
+                stage.items = scores
+        if scores < 0:
+            profiler.count('unmodified files')
+            continue
+        profiler.count('ingested files')
+        profiler.count('scores', scores)
+
+
+def main() -> None:
+    desc = """Load the scores of the varying-scope-sizes tree (all scope
+    sizes, sampling values, iterations and the reference data) into a
+    SQLite database that plot-summary.py and plot-per-scope.py can read
+    with --database. Only new or modified files are read again."""
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('data_dir',
+                        help='directory with one subdirectory per scope '
+                             'size (e.g., varying-scope-sizes)')
+    parser.add_argument('database')
+    parser.add_argument('-s', '--scope-sizes',
+                        type=lambda l: set(l.split(',')),
+                        help='comma-separated list of scope sizes to ingest')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    data_dir = args.data_dir
+    if not data_dir.endswith('/'):
+        data_dir += '/'
+
+    profiler = Profiler.from_args(args)
+    with ScoreDatabase(args.database) as db:
+        for entry in sorted(os.scandir(data_dir), key=lambda e: e.name):
+            if not entry.is_dir():
+                continue
+            if args.scope_sizes and entry.name not in args.scope_sizes:
+                continue
+            print(f'Ingesting scope size {entry.name}')
+            ingest_scope_size(db, data_dir + entry.name + '/', entry.name,
+                              profiler)
+            profiler.count('scope sizes')
+    profiler.print_counters()
+    profiler.write()
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -3,11 +3,22 @@ import os
 import sys
 from collections import defaultdict
 
+import matplotlib
+# Figures are only written to files, so use a non-interactive backend.
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
 
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.figures import FigureManifest, render_figures
+from common.profiling import Profiler, add_profile_arguments
+from score_db import ScoreDatabase
+
 DATA_EXTENSION = '.csv'
 DATA_DELIMITER = ','
+FIG_EXTENSION = '.pdf'
 
 
 def get_data_from_file(file: str, sampling_value: int, total_data: dict) -> dict:
@@ -61,6 +72,11 @@ def load_data(path: str, values: set = None) -> dict:
         data = load_per_sampling_value_data(path + entry.name + '/',
                                             sampling_value,
                                             data)
+    add_missing_sampling_values(data, sampling_steps)
+    return data
+
+
+def add_missing_sampling_values(data: dict, sampling_steps: list) -> None:
     # Ensure that all sampling percentages are present for all AS
     # dependencies.
     for scope in data:
@@ -68,6 +84,24 @@ def load_data(path: str, values: set = None) -> dict:
             for sampling_value in sampling_steps:
                 if sampling_value not in data[scope][asn]:
                     data[scope][asn][sampling_value] = [0]
+
+
+def load_data_from_db(db_file: str,
+                      scope_size: str,
+                      values: set = None) -> dict:
+    # Same as load_data, but reads the scores of one scope size from a
+    # database written by ingest-scores.py.
+    data = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    with ScoreDatabase(db_file) as db:
+        sampling_steps = [sampling_value
+                          for sampling_value
+                          in db.get_sampling_values(scope_size)
+                          if sampling_value >= 10
+                          and (not values or str(sampling_value) in values)]
+        for scope, asn, sampling_value, iteration, score \
+                in db.get_scores(scope_size, sampling_steps):
+            data[scope][asn][sampling_value].append(score)
+    add_missing_sampling_values(data, sampling_steps)
     return data
 
 
@@ -125,16 +159,86 @@ def strip_empty_sampling_values(data: dict) -> None:
                 break
 
 
-def plot_scope(scope: int, scope_data: dict, output_dir: str) -> None:
+def parse_max_subplots(arg: str) -> int:
+    max_subplots = int(arg)
+    if max_subplots < 1:
+        raise argparse.ArgumentTypeError(f'Maximum number of subplots must '
+                                         f'be at least 1: {arg}')
+    return max_subplots
+
+
+def get_box_stats(scope_data: dict) -> (list, list, np.ndarray, dict):
+    # Compute the box plot statistics (same as plt.boxplot) for all
+    # dependencies and sampling values of the scope at once. Scores are
+    # stored in an array of shape (dependencies, sampling values, scores)
+    # padded with NaN in case the score lists differ in length.
     asns = sorted(scope_data.keys())
+    sampling_values = sorted({sampling_value
+                              for asn in asns
+                              for sampling_value in scope_data[asn]})
+    max_len = max(len(score_list)
+                  for asn in asns
+                  for score_list in scope_data[asn].values())
+    scores = np.full((len(asns), len(sampling_values), max_len), np.nan)
+    for asn_idx, asn in enumerate(asns):
+        for sampling_value_idx, sampling_value in enumerate(sampling_values):
+            score_list = scope_data[asn].get(sampling_value, list())
+            scores[asn_idx, sampling_value_idx, :len(score_list)] = score_list
+
+    # NaN values are sorted to the end.
+    sorted_scores = np.sort(scores, axis=2)
+    counts = np.count_nonzero(~np.isnan(scores), axis=2)
+    last_idx = np.maximum(counts - 1, 0)
+
+    def percentile(q: float) -> np.ndarray:
+        # Linear interpolation like np.percentile, but with a different
+        # number of valid values per box.
+        position = q / 100 * last_idx
+        lower = np.floor(position).astype(int)
+        upper = np.ceil(position).astype(int)
+        lower_values = np.take_along_axis(sorted_scores, lower[..., None],
+                                          axis=2)[..., 0]
+        upper_values = np.take_along_axis(sorted_scores, upper[..., None],
+                                          axis=2)[..., 0]
+        return lower_values + (upper_values - lower_values) \
+            * (position - lower)
+
+    q1 = percentile(25)
+    med = percentile(50)
+    q3 = percentile(75)
+    iqr = q3 - q1
+    lo_val = (q1 - 1.5 * iqr)[..., None]
+    hi_val = (q3 + 1.5 * iqr)[..., None]
+    with np.errstate(invalid='ignore'):
+        whislo = np.min(np.where(scores >= lo_val, scores, np.inf), axis=2)
+        whishi = np.max(np.where(scores <= hi_val, scores, -np.inf), axis=2)
+    # Like plt.boxplot, whiskers do not end inside the box. This happens
+    # if there is no value between the box and the 1.5 IQR limit.
+    whislo = np.where(np.isinf(whislo) | (whislo > q1), q1, whislo)
+    whishi = np.where(np.isinf(whishi) | (whishi < q3), q3, whishi)
+    with np.errstate(invalid='ignore'):
+        fliers = (scores < whislo[..., None]) | (scores > whishi[..., None])
+    stats = {'q1': q1,
+             'med': med,
+             'q3': q3,
+             'whislo': whislo,
+             'whishi': whishi,
+             'fliers': fliers}
+    return asns, sampling_values, scores, stats
 
+
+def plot_page(title: str,
+              asns: list,
+              labels: list,
+              scores: np.ndarray,
+              stats: dict) -> plt.Figure:
     markerstyle = {'markersize': 5,
                    'marker': '.'}
 
     num_dependencies = len(asns)
     cols = min(3, num_dependencies)
     rows = int(np.ceil(num_dependencies / cols))
-    fa = plt.subplots(rows, cols, sharex='col')
+    fa = plt.subplots(rows, cols, sharex='col', squeeze=False)
     fig: plt.Figure = fa[0]
     axes = fa[1].flat
     for ax in axes[num_dependencies:]:
@@ -143,18 +247,17 @@ def plot_scope(scope: int, scope_data: dict, output_dir: str) -> None:
     for asn_idx in range(num_dependencies):
         ax: plt.Axes = axes[asn_idx]
         ax.set_title(str(asns[asn_idx]))
-        scores = list()
-        labels = list()
-        for sampling_value in sorted(scope_data[asns[asn_idx]].keys()):
-            scores.append(scope_data[asns[asn_idx]][sampling_value])
-            labels.append(str(sampling_value))
-        if len(labels) > 20:
-            ax.boxplot(scores, flierprops=markerstyle,
-                       labels=[l if (i + 1) % 2 else '' for i, l in enumerate(labels)])
-        else:
-            ax.boxplot(scores, flierprops=markerstyle,
-                       labels=labels)
-        # ax.violinplot(scores)
+        box_stats = list()
+        for sampling_value_idx, label in enumerate(labels):
+            idx = (asn_idx, sampling_value_idx)
+            box_stats.append({'label': label,
+                              'q1': stats['q1'][idx],
+                              'med': stats['med'][idx],
+                              'q3': stats['q3'][idx],
+                              'whislo': stats['whislo'][idx],
+                              'whishi': stats['whishi'][idx],
+                              'fliers': scores[idx][stats['fliers'][idx]]})
+        ax.bxp(box_stats, flierprops=markerstyle)
         ax.set_ylim(ymin=0)
         # Add x label to last row
         if asn_idx >= num_dependencies - cols:
@@ -164,10 +267,52 @@ def plot_scope(scope: int, scope_data: dict, output_dir: str) -> None:
         if asn_idx % cols == 0:
             ax.set_ylabel('Hegemony score')
 
-    fig.suptitle(f'Scope {scope}')
+    fig.suptitle(title)
     fig.tight_layout()
-    plt.savefig(output_dir + str(scope) + '.pdf', bbox_inches='tight')
-    # plt.show()
+    return fig
+
+
+def plot_scope(scope: int,
+               asns: list,
+               sampling_values: list,
+               scores: np.ndarray,
+               stats: dict,
+               max_subplots: int,
+               output: str) -> None:
+    labels = [str(sampling_value) for sampling_value in sampling_values]
+    if len(labels) > 20:
+        labels = [l if (i + 1) % 2 else '' for i, l in enumerate(labels)]
+
+    # Split large scopes into multiple pages with at most max_subplots
+    # dependencies each. Each page is closed after it is written so that
+    # only one page is kept in memory.
+    pages = int(np.ceil(len(asns) / max_subplots))
+    with PdfPages(output) as pdf:
+        for page in range(pages):
+            title = f'Scope {scope}'
+            if pages > 1:
+                title += f' ({page + 1}/{pages})'
+            page_slice = slice(page * max_subplots,
+                               (page + 1) * max_subplots)
+            page_stats = {name: values[page_slice]
+                          for name, values in stats.items()}
+            fig = plot_page(title, asns[page_slice], labels,
+                            scores[page_slice], page_stats)
+            pdf.savefig(fig, bbox_inches='tight')
+            plt.close(fig)
+
+
+def get_plot_jobs(data: dict,
+                  output_dir: str,
+                  max_subplots: int,
+                  profiler: Profiler):
+    for scope in data:
+        profiler.count('scopes')
+        with profiler.stage('box stats') as stage:
+            stage.items = len(data[scope])
+            box_stats = get_box_stats(data[scope])
+        yield (scope, *box_stats, max_subplots,
+               output_dir + str(scope) + FIG_EXTENSION)
 
 
 def main() -> None:
@@ -178,8 +323,30 @@ def main() -> None:
                         help='comma-separated list of values to plot')
     parser.add_argument('-o', '--output', default='./',
                         help='Output directory (default: ./)')
+    parser.add_argument('-n', '--max-subplots', type=parse_max_subplots,
+                        default=30,
+                        help='maximum number of dependencies per page '
+                             '(default: 30)')
+    parser.add_argument('-D', '--database',
+                        help='read the scores from this database written by '
+                             'ingest-scores.py instead of the files in '
+                             'data_dir. The scope size is the name of '
+                             'data_dir')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of processes used to render figures '
+                             '(default: number of CPUs)')
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
+    profiler = Profiler.from_args(args)
+    try:
+        run(args, profiler)
+    finally:
+        profiler.print_counters()
+        profiler.write()
+
+
+def run(args: argparse.Namespace, profiler: Profiler) -> None:
     data_dir = args.data_dir
     if not data_dir.endswith('/'):
         data_dir += '/'
@@ -188,13 +355,27 @@ def main() -> None:
     if not output_dir.endswith('/'):
         output_dir += '/'
 
-    data = load_data(data_dir, args.values)
-    fill_missing_values(data, args.iterations)
-    strip_empty_sampling_values(data)
+    with profiler.stage('load'):
+        if args.database:
+            data = load_data_from_db(
+                args.database,
+                os.path.basename(os.path.normpath(data_dir)),
+                args.values)
+        else:
+            data = load_data(data_dir, args.values)
+    with profiler.stage('fill'):
+        fill_missing_values(data, args.iterations)
+    with profiler.stage('strip'):
+        strip_empty_sampling_values(data)
 
-    for scope in data:
-        print(scope)
-        plot_scope(scope, data[scope], output_dir)
+    # Box statistics are computed while figures are rendered, so the
+    # render stage includes the box stats stage.
+    with profiler.stage('render') as stage:
+        render_figures(plot_scope,
+                       get_plot_jobs(data, output_dir, args.max_subplots,
+                                     profiler),
+                       args.jobs, FigureManifest(output_dir))
+        stage.items = len(data)
 
 
 if __name__ == '__main__':
@@ -1,41 +1,32 @@
 import argparse
+import json
 import os
 import sys
 from collections import defaultdict
 
-import matplotlib.pyplot as plt
 import numpy as np
 
+# Shared modules are in the common package of the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.figures import FigureManifest, import_pyplot, render_figures
+from common.profiling import Profiler, add_profile_arguments
+from score_db import ScoreDatabase, get_iteration, read_scores
+
 DATA_EXTENSION = '.csv'
 DATA_DELIMITER = ','
+FIG_EXTENSION = '.pdf'
 REFERENCE_DIR_NAME = 'ref'
 
 
 def get_data_from_file(file: str,
                        total_data: dict,
                        sampling_value: int) -> dict:
-    with open(file, 'r') as f:
-        # Skip headers
-        f.readline()
-        for line in f:
-            line_split = line.split(DATA_DELIMITER)
-            if len(line_split) < 3:
-                print(f'Error: Malformed data line: {line.strip()}',
-                      file=sys.stderr)
-                continue
-            try:
-                scope = int(line_split[0])
-                asn = int(line_split[1])
-                score = float(line_split[2])
-            except ValueError as e:
-                print(f'Error: Malformed data line: {line.strip()}: {e}',
-                      file=sys.stderr)
-                continue
-            if sampling_value < 0:
-                # Used for reference data
-                total_data[scope][asn] = score
-            else:
-                total_data[scope][asn][sampling_value].append(score)
+    for scope, asn, score in read_scores(file):
+        if sampling_value < 0:
+            # Used for reference data
+            total_data[scope][asn] = score
+        else:
+            total_data[scope][asn][sampling_value].append(score)
     return total_data
 
 
@@ -72,6 +63,11 @@ def load_data(path: str, values: set = None) -> (dict, dict):
         sampling_value = int(entry.name)
         sampling_steps.append(sampling_value)
         data = load_per_sampling_value_data(sampling_path, data, sampling_value)
+    add_missing_sampling_values(data, sampling_steps)
+    return reference_data, data
+
+
+def add_missing_sampling_values(data: dict, sampling_steps: list) -> None:
     # Ensure that all sampling percentages are present for all AS
     # dependencies.
     for scope in data:
@@ -79,9 +75,358 @@ def load_data(path: str, values: set = None) -> (dict, dict):
             for sampling_value in sampling_steps:
                 if sampling_value not in data[scope][asn]:
                     data[scope][asn][sampling_value] = [0]
+
+
+def get_db_sampling_values(db: ScoreDatabase,
+                           scope_size: str,
+                           values: set = None) -> list:
+    return [sampling_value
+            for sampling_value in db.get_sampling_values(scope_size)
+            if not values or str(sampling_value) in values]
+
+
+def load_data_from_db(db_file: str,
+                      scope_size: str,
+                      values: set = None) -> (dict, dict):
+    # Same as load_data, but reads the scores of one scope size from a
+    # database written by ingest-scores.py.
+    data = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    reference_data = defaultdict(dict)
+    with ScoreDatabase(db_file) as db:
+        for scope, asn, score in db.get_reference(scope_size):
+            reference_data[scope][asn] = score
+        sampling_steps = get_db_sampling_values(db, scope_size, values)
+        for scope, asn, sampling_value, iteration, score \
+                in db.get_scores(scope_size, sampling_steps):
+            data[scope][asn][sampling_value].append(score)
+    add_missing_sampling_values(data, sampling_steps)
+    return reference_data, data
+
+
+def load_iteration_data(path: str,
+                        iterations: int,
+                        values: set = None) -> (dict, dict):
+    # Same as load_data, but keeps track of the iteration each score
+    # belongs to, which is required to analyze subsets of iterations.
+    # Structure is scope -> asn -> sampling_value -> iteration -> score
+    data = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+    reference_data = defaultdict(dict)
+    for entry in os.scandir(path):
+        if not entry.is_dir():
+            continue
+        sampling_path = path + entry.name + '/'
+        if entry.name == REFERENCE_DIR_NAME:
+            reference_data = load_per_sampling_value_data(sampling_path,
+                                                          reference_data)
+            continue
+        if not entry.name.isdigit():
+            continue
+        if values and entry.name not in values:
+            continue
+        sampling_value = int(entry.name)
+        for file in os.scandir(sampling_path):
+            if not file.is_file() or not file.name.endswith(DATA_EXTENSION):
+                continue
+            try:
+                iteration = get_iteration(file.name)
+            except ValueError as e:
+                print(f'Error: Failed to get iteration from file name '
+                      f'{file.name}: {e}', file=sys.stderr)
+                continue
+            if iteration >= iterations:
+                print(f'Error: Iteration of file {file.name} exceeds '
+                      f'#iterations ({iterations})', file=sys.stderr)
+                continue
+            for scope, asn, score in read_scores(sampling_path + file.name):
+                data[scope][asn][sampling_value][iteration] = score
+    return reference_data, data
+
+
+def load_iteration_data_from_db(db_file: str,
+                                scope_size: str,
+                                iterations: int,
+                                values: set = None) -> (dict, dict):
+    # Same as load_iteration_data, but reads the scores of one scope size
+    # from a database written by ingest-scores.py.
+    data = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
+    reference_data = defaultdict(dict)
+    with ScoreDatabase(db_file) as db:
+        for scope, asn, score in db.get_reference(scope_size):
+            reference_data[scope][asn] = score
+        sampling_steps = get_db_sampling_values(db, scope_size, values)
+        exceeding = 0
+        for scope, asn, sampling_value, iteration, score \
+                in db.get_scores(scope_size, sampling_steps):
+            if iteration >= iterations:
+                exceeding += 1
+                continue
+            data[scope][asn][sampling_value][iteration] = score
+    if exceeding:
+        print(f'Error: Ignored {exceeding} scores of iterations that exceed '
+              f'#iterations ({iterations})', file=sys.stderr)
     return reference_data, data
 
 
+def get_iteration_arrays(ref_data: dict,
+                         data: dict,
+                         iterations: int,
+                         include_reference: bool = False) \
+        -> (np.ndarray, np.ndarray, list, np.ndarray, np.ndarray):
+    # Convert the data of all scopes that have reference data into a
+    # dense array of shape (dependencies, sampling values, iterations),
+    # where each row is one (scope, asn) pair. Missing scores are zero,
+    # like in fill_missing_values. If include_reference is set, rows
+    # are also added for dependencies that are only present in the
+    # reference data.
+    sampling_values = sorted({sampling_value
+                              for scope in data
+                              for asn in data[scope]
+                              for sampling_value in data[scope][asn]})
+    sampling_value_idx = {sampling_value: idx
+                          for idx, sampling_value in enumerate(sampling_values)}
+    row_scopes = list()
+    row_asns = list()
+    for scope in data:
+        if scope not in ref_data:
+            print(f'Error: Missing reference data for scope {scope}',
+                  file=sys.stderr)
+            continue
+        asns = set(data[scope].keys())
+        if include_reference:
+            asns.update(ref_data[scope].keys())
+        for asn in sorted(asns):
+            row_scopes.append(scope)
+            row_asns.append(asn)
+    scores = np.zeros((len(row_asns), len(sampling_values), iterations))
+    ref_scores = np.zeros(len(row_asns))
+    for row, (scope, asn) in enumerate(zip(row_scopes, row_asns)):
+        ref_scores[row] = ref_data[scope].get(asn, 0)
+        for sampling_value, iteration_scores \
+                in data[scope].get(asn, dict()).items():
+            scores[row,
+                   sampling_value_idx[sampling_value],
+                   list(iteration_scores.keys())] = \
+                list(iteration_scores.values())
+    return (np.array(row_scopes), np.array(row_asns), sampling_values,
+            scores, ref_scores)
+
+
+def get_prefix_diffs(scores: np.ndarray,
+                     ref_scores: np.ndarray,
+                     percentile: int,
+                     k: int) -> np.ndarray:
+    # Apply filter_dependencies and get_diffs to the first k iterations
+    # of all rows at once. Returns an array of shape (rows, sampling
+    # values, k) where removed or ignored entries are NaN.
+    prefix = scores[:, :, :k]
+    idx = int(np.floor(percentile / 100 * (k - 1)))
+    keep = np.sort(prefix, axis=2)[:, :, idx] != 0
+    diffs = np.abs(ref_scores[:, None, None] - prefix)
+    # No ref_score exists and score is a filler value so do not count
+    # as a difference.
+    ignore = (ref_scores[:, None, None] == 0) & (prefix == 0)
+    diffs[ignore | ~keep[:, :, None]] = np.nan
+    return diffs
+
+
+def summarize_prefix_diffs(label: str,
+                           asns: np.ndarray,
+                           sampling_values: list,
+                           diffs: np.ndarray) -> list:
+    # Returns a list of (scope, sampling_value, iterations, dependencies,
+    # min, median, max) tuples for the given rows.
+    ret = list()
+    valid = ~np.isnan(diffs)
+    present = valid.any(axis=2)
+    has_values = present.any(axis=0)
+    if not has_values.any():
+        return ret
+    diffs = diffs[:, has_values, :]
+    mins = np.nanmin(diffs, axis=(0, 2))
+    medians = np.nanmedian(diffs, axis=(0, 2))
+    maxs = np.nanmax(diffs, axis=(0, 2))
+    for idx, sampling_value_idx in enumerate(np.flatnonzero(has_values)):
+        # Count each dependency only once, even if it is present in
+        # multiple scopes.
+        dependencies = len(np.unique(asns[present[:, sampling_value_idx]]))
+        ret.append((label,
+                    sampling_values[sampling_value_idx],
+                    diffs.shape[2],
+                    dependencies,
+                    mins[idx],
+                    medians[idx],
+                    maxs[idx]))
+    return ret
+
+
+def iteration_sensitivity(scopes: np.ndarray,
+                          asns: np.ndarray,
+                          sampling_values: list,
+                          scores: np.ndarray,
+                          ref_scores: np.ndarray,
+                          percentile: int) -> list:
+    # Compute the summary of plot_summary for the first k iterations, for
+    # k = 1..#iterations, for each scope and globally.
+    ret = list()
+    unique_scopes = np.unique(scopes)
+    for k in range(1, scores.shape[2] + 1):
+        diffs = get_prefix_diffs(scores, ref_scores, percentile, k)
+        for scope in unique_scopes:
+            rows = scopes == scope
+            ret += summarize_prefix_diffs(str(scope), asns[rows],
+                                          sampling_values, diffs[rows])
+        ret += summarize_prefix_diffs('global', asns, sampling_values, diffs)
+    return ret
+
+
+def write_iteration_sensitivity(summary: list, output_file: str) -> None:
+    with open(output_file, 'w') as f:
+        f.write(DATA_DELIMITER.join(['scope', 'sampling_value', 'iterations',
+                                     'dependencies', 'min', 'median', 'max'])
+                + '\n')
+        for row in summary:
+            f.write(DATA_DELIMITER.join(map(str, row)) + '\n')
+
+
+def plot_iteration_sensitivity(scope: str,
+                               summary: list,
+                               output: str) -> None:
+    curves = defaultdict(lambda: defaultdict(list))
+    for label, sampling_value, iterations, _, _, median, _ in summary:
+        if label != scope:
+            continue
+        curves[sampling_value]['x_vals'].append(iterations)
+        curves[sampling_value]['medians'].append(median)
+    if not curves:
+        return
+
+    plt = import_pyplot()
+    import matplotlib.colors
+    fa = plt.subplots()
+    fig: plt.Figure = fa[0]
+    ax: plt.Axes = fa[1]
+
+    sampling_values = sorted(curves.keys())
+    norm = matplotlib.colors.LogNorm(vmin=min(sampling_values),
+                                     vmax=max(sampling_values))
+    cmap = plt.get_cmap('viridis')
+    for sampling_value in sampling_values:
+        ax.plot(curves[sampling_value]['x_vals'],
+                curves[sampling_value]['medians'],
+                c=cmap(norm(sampling_value)))
+
+    ax.set_title(f'Scope {scope}')
+    ax.set_xlabel('Iterations')
+    ax.set_xlim(xmin=1)
+    ax.set_ylim(0, 1.05)
+    ax.set_yticks(np.arange(0, 1.1, 0.1))
+    ax.set_ylabel('Median hegemony score difference')
+    ax.grid(axis='y', ls='--')
+    fig.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=cmap), ax=ax,
+                 label='Sampling value')
+    fig.savefig(output, bbox_inches='tight')
+    plt.close(fig)
+
+
+def rank_average(values: np.ndarray) -> np.ndarray:
+    # Rank values along the first axis starting at 1. Tied values get
+    # the average of their ranks.
+    num_values = values.shape[0]
+    order = np.argsort(values, axis=0, kind='stable')
+    sorted_values = np.take_along_axis(values, order, axis=0)
+    positions = np.arange(num_values).reshape((-1,) + (1,) * (values.ndim - 1))
+    positions = np.broadcast_to(positions, values.shape)
+    group_start = np.ones(values.shape, dtype=bool)
+    group_start[1:] = sorted_values[1:] != sorted_values[:-1]
+    group_end = np.ones(values.shape, dtype=bool)
+    group_end[:-1] = group_start[1:]
+    # Propagate the first position of each group of tied values forward
+    # and the last position backward.
+    starts = np.maximum.accumulate(np.where(group_start, positions, 0),
+                                   axis=0)
+    ends = np.flip(np.minimum.accumulate(
+        np.flip(np.where(group_end, positions, num_values - 1), axis=0),
+        axis=0), axis=0)
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (starts + ends) / 2 + 1, axis=0)
+    return ranks
+
+
+def rank_correlation(ref_scores: np.ndarray,
+                     scores: np.ndarray) -> np.ndarray:
+    # Spearman's rank correlation between the reference scores and each
+    # column (iteration) of scores. Columns without variance are NaN.
+    ref_ranks = rank_average(ref_scores)
+    ref_ranks = (ref_ranks - ref_ranks.mean())[:, None]
+    ranks = rank_average(scores)
+    ranks -= ranks.mean(axis=0)
+    denominator = np.sqrt(np.sum(ref_ranks ** 2) * np.sum(ranks ** 2, axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sum(ref_ranks * ranks, axis=0) / denominator
+
+
+def compute_metrics(scopes: np.ndarray,
+                    sampling_values: list,
+                    scores: np.ndarray,
+                    ref_scores: np.ndarray,
+                    top_k: int) -> list:
+    # Returns a list of (scope, sampling_value, dependencies, rmse, mae,
+    # top_k_recall, rank_correlation) tuples. Dependencies are all ASes
+    # that are present in the reference or in any iteration of the
+    # sampling value; a missing score counts as zero. RMSE and MAE are
+    # computed over all dependencies and iterations, recall and rank
+    # correlation are the mean of the per-iteration values.
+    ret = list()
+    for scope in np.unique(scopes):
+        rows = scopes == scope
+        scope_scores = scores[rows]
+        scope_ref_scores = ref_scores[rows]
+        errors = scope_scores - scope_ref_scores[:, None, None]
+        relevant = (scope_ref_scores[:, None] > 0) \
+            | (scope_scores > 0).any(axis=2)
+        for sampling_value_idx, sampling_value in enumerate(sampling_values):
+            dependency_rows = relevant[:, sampling_value_idx]
+            dependencies = np.count_nonzero(dependency_rows)
+            if not dependencies:
+                continue
+            sv_errors = errors[dependency_rows, sampling_value_idx]
+            sv_scores = scope_scores[dependency_rows, sampling_value_idx]
+            sv_ref_scores = scope_ref_scores[dependency_rows]
+            rmse = np.sqrt(np.mean(sv_errors ** 2))
+            mae = np.mean(np.abs(sv_errors))
+
+            k = min(top_k, np.count_nonzero(sv_ref_scores))
+            if k:
+                ref_top = np.zeros(dependencies, dtype=bool)
+                ref_top[np.argsort(-sv_ref_scores, kind='stable')[:k]] = True
+                sampled_top = np.argsort(-sv_scores, axis=0,
+                                         kind='stable')[:k]
+                recall = np.mean(np.sum(ref_top[sampled_top], axis=0) / k)
+            else:
+                recall = np.nan
+
+            correlations = rank_correlation(sv_ref_scores, sv_scores)
+            correlations = correlations[np.isfinite(correlations)]
+            if correlations.size:
+                correlation = np.mean(correlations)
+            else:
+                correlation = np.nan
+            ret.append((scope, sampling_value, dependencies, rmse, mae,
+                        recall, correlation))
+    return ret
+
+
+def write_metrics(metrics: list, top_k: int, output_file: str) -> None:
+    with open(output_file, 'w') as f:
+        f.write(DATA_DELIMITER.join(['scope', 'sampling_value',
+                                     'dependencies', 'rmse', 'mae',
+                                     f'top_{top_k}_recall',
+                                     'rank_correlation'])
+                + '\n')
+        for row in metrics:
+            f.write(DATA_DELIMITER.join(map(str, row)) + '\n')
+
+
 def fill_missing_values(data: dict, iterations: int) -> None:
     # In order to get representative median values, we need to keep
     # track of AS dependencies that are only present in some iterations.
@@ -157,64 +502,220 @@ def get_diffs(ref_data: dict, scope_data: dict) -> dict:
     return ret
 
 
-def filter_dependencies(scope_data: dict, percentile: int) -> None:
+def filter_dependencies(scope_data: dict, percentile: int) -> (int, int):
+    # Returns the number of removed samples (score lists of a dependency
+    # for a sampling value) and of entirely removed dependencies.
     filtered_asns = list()
+    removed_samples = 0
     for asn in scope_data:
         filtered_sampling_values = list()
         for sampling_value in scope_data[asn]:
             if np.percentile(scope_data[asn][sampling_value], percentile, interpolation='lower') == 0:
-                print(f'Removing samples {scope_data[asn][sampling_value]}: {np.percentile(scope_data[asn][sampling_value], percentile, interpolation="lower")}')
             # if np.median(scope_data[asn][sampling_value]) == 0:
                 filtered_sampling_values.append(sampling_value)
-        if filtered_sampling_values:
-            print(f'Removing samples {filtered_sampling_values} from dependency {asn}')
+        removed_samples += len(filtered_sampling_values)
         for sampling_value in filtered_sampling_values:
             del scope_data[asn][sampling_value]
         if not scope_data[asn]:
             filtered_asns.append(asn)
-    if filtered_asns:
-        print(f'Removing dependencies entirely {filtered_asns}')
     for asn in filtered_asns:
         del scope_data[asn]
+    return removed_samples, len(filtered_asns)
 
 
-def plot_scope(scope: str, scope_diffs: dict, output_dir: str) -> None:
-    fa = plt.subplots()
+def parse_percentiles(arg: str) -> list:
+    # Accept a comma-separated list of percentiles, where each entry
+    # can also be an inclusive range, e.g., 50-99 or 50,75,90-99.
+    percentiles = set()
+    for entry in arg.split(','):
+        if '-' in entry:
+            start, end = entry.split('-', maxsplit=1)
+            percentiles.update(range(int(start), int(end) + 1))
+        else:
+            percentiles.add(int(entry))
+    if any(percentile < 0 or percentile > 100 for percentile in percentiles):
+        raise argparse.ArgumentTypeError(f'Percentiles need to be in range '
+                                         f'[0, 100]: {arg}')
+    return sorted(percentiles)
+
+
+def sweep_percentiles(ref_data: dict,
+                      scope_data: dict,
+                      percentiles: list) -> dict:
+    # Same filter as filter_dependencies, but evaluated for a list of
+    # percentiles at once and without modifying the scope data.
+    # Structure is percentile -> sampling_value -> asn -> list of diff
+    # arrays. The asn level is kept so that dependencies can be counted
+    # correctly when results of multiple scopes are merged.
+    ret = {percentile: defaultdict(lambda: defaultdict(list))
+           for percentile in percentiles}
+    percentiles = np.array(percentiles)
+    quantiles = percentiles / 100
+    for asn in scope_data:
+        ref_score = ref_data.get(asn, 0)
+        for sampling_value, score_list in scope_data[asn].items():
+            # Sort once and look up all percentiles from the sorted
+            # array. This is equivalent to np.percentile with
+            # interpolation='lower'.
+            scores = np.sort(score_list)
+            indices = np.floor(quantiles * (len(scores) - 1)).astype(int)
+            keep = scores[indices] != 0
+            if not keep.any():
+                continue
+            diffs = np.abs(ref_score - scores)
+            if ref_score == 0:
+                # No ref_score exists so filler values do not count as
+                # a difference.
+                diffs = diffs[scores != 0]
+            if not diffs.size:
+                continue
+            for percentile in percentiles[keep]:
+                ret[percentile][sampling_value][asn].append(diffs)
+    return ret
+
+
+def merge_sweep(total_sweep: dict, sweep: dict) -> None:
+    for percentile in sweep:
+        for sampling_value in sweep[percentile]:
+            for asn, diffs in sweep[percentile][sampling_value].items():
+                total_sweep[percentile][sampling_value][asn] += diffs
+
+
+def summarize_sweep(sweep: dict) -> list:
+    # Returns a list of (percentile, sampling_value, dependencies, min,
+    # median, max) tuples, i.e., the values shown by plot_summary for
+    # each percentile.
+    ret = list()
+    for percentile in sorted(sweep):
+        for sampling_value in sorted(sweep[percentile]):
+            asn_diffs = sweep[percentile][sampling_value]
+            diffs = np.concatenate([diff
+                                    for diff_list in asn_diffs.values()
+                                    for diff in diff_list])
+            ret.append((percentile,
+                        sampling_value,
+                        len(asn_diffs),
+                        np.min(diffs),
+                        np.median(diffs),
+                        np.max(diffs)))
+    return ret
+
+
+def write_sweep_summary(summary: list, output_file: str) -> None:
+    with open(output_file, 'w') as f:
+        f.write(DATA_DELIMITER.join(['percentile', 'sampling_value',
+                                     'dependencies', 'min', 'median', 'max'])
+                + '\n')
+        for row in summary:
+            f.write(DATA_DELIMITER.join(map(str, row)) + '\n')
+
+
+def plot_sweep(scope: str, summary: list, output: str) -> None:
+    curves = defaultdict(lambda: defaultdict(list))
+    for percentile, sampling_value, dependencies, _, median, _ in summary:
+        curves[percentile]['x_vals'].append(sampling_value)
+        curves[percentile]['medians'].append(median)
+        curves[percentile]['dependencies'].append(dependencies)
+    if not curves:
+        print(f'No dependencies left for scope {scope}')
+        return
+
+    plt = import_pyplot()
+    import matplotlib.colors
+    fa = plt.subplots(2, 1, sharex='col')
     fig: plt.Figure = fa[0]
-    ax: plt.Axes = fa[1]
+    ax: plt.Axes = fa[1][0]
+    ax2: plt.Axes = fa[1][1]
+    fig.set_size_inches(6.4, 7.2)
+
+    percentiles = sorted(curves.keys())
+    norm = matplotlib.colors.Normalize(vmin=min(percentiles),
+                                       vmax=max(percentiles))
+    cmap = plt.get_cmap('viridis')
+    for percentile in percentiles:
+        color = cmap(norm(percentile))
+        ax.plot(curves[percentile]['x_vals'], curves[percentile]['medians'],
+                c=color)
+        ax2.plot(curves[percentile]['x_vals'],
+                 curves[percentile]['dependencies'], c=color)
 
+    ax.set_title(f'Scope {scope}')
     ax.set_xscale('log')
+    ax.set_ylim(0, 1.05)
+    ax.set_yticks(np.arange(0, 1.1, 0.1))
+    ax.set_ylabel('Median hegemony score difference')
+    ax.grid(axis='y', ls='--')
 
-    ax2: plt.Axes = ax.twinx()
     ax2.set_yscale('log')
+    ax2.set_ylim(ymin=1)
+    ax2.set_ylabel('Dependencies')
+    ax2.tick_params(axis='x', labelrotation=20)
+    ax2.set_xlabel('Sampling value')
+    ax2.set_xlim(xmin=2)
+    ax2.grid(axis='y', ls='--')
 
-    scores = list()
-    labels = list()
-    x_vals = list()
-    mins = list()
+    fig.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=cmap),
+                 ax=[ax, ax2], label='Filter percentile')
+    fig.savefig(output, bbox_inches='tight')
+    plt.close(fig)
+
+
+def get_summary(scope_diffs: dict) -> list:
+    # Returns a list of (sampling_value, dependencies, min, median, max)
+    # tuples.
+    ret = list()
     # percentiles = [50]
     # percentile_values = list()
-    medians = list()
-    maxs = list()
-    asns = list()
     for sampling_value in sorted(scope_diffs.keys()):
-        x_vals.append(sampling_value)
-        labels.append(str(sampling_value))
-        asns.append(len(scope_diffs[sampling_value]))
         scores = list()
         for asn_scores in scope_diffs[sampling_value].values():
             scores += asn_scores
         if not scores:
             print(f'No dependencies left for sample {sampling_value}')
-            mins.append(0)
-            medians.append(0)
-            maxs.append(0)
+            ret.append((sampling_value, len(scope_diffs[sampling_value]),
+                        0, 0, 0))
             continue
-        mins.append(np.min(scores))
-        medians.append(np.median(scores))
         # percentile_values.append(np.percentile(scope_diffs[sampling_value], percentiles))
-        maxs.append(np.max(scores))
-        # scores.append(scope_diffs[sampling_value])
+        ret.append((sampling_value,
+                    len(scope_diffs[sampling_value]),
+                    np.min(scores),
+                    np.median(scores),
+                    np.max(scores)))
+    return ret
+
+
+def write_summary(summary: list, output_file: str) -> None:
+    with open(output_file, 'w') as f:
+        f.write(DATA_DELIMITER.join(['sampling_value', 'dependencies', 'min',
+                                     'median', 'max'])
+                + '\n')
+        for row in summary:
+            f.write(DATA_DELIMITER.join(map(str, row)) + '\n')
+
+
+def plot_summary(scope: str, summary: list, output: str) -> None:
+    plt = import_pyplot()
+    fa = plt.subplots()
+    fig: plt.Figure = fa[0]
+    ax: plt.Axes = fa[1]
+
+    ax.set_xscale('log')
+
+    ax2: plt.Axes = ax.twinx()
+    ax2.set_yscale('log')
+
+    x_vals = list()
+    mins = list()
+    medians = list()
+    maxs = list()
+    asns = list()
+    for sampling_value, dependencies, min_diff, median_diff, max_diff \
+            in summary:
+        x_vals.append(sampling_value)
+        asns.append(dependencies)
+        mins.append(min_diff)
+        medians.append(median_diff)
+        maxs.append(max_diff)
 
     # ax.boxplot(scores, labels=[l if (i + 1) % 2 else '' for i, l in enumerate(labels)])
     # ax.boxplot(scores, labels=labels)
@@ -238,8 +739,169 @@ def plot_scope(scope: str, scope_diffs: dict, output_dir: str) -> None:
     ax.legend([med_line, dep_line], ['median', 'dependencies'])
 
     fig.tight_layout()
-    plt.savefig(output_dir + scope + '-summary.pdf', bbox_inches='tight')
+    fig.savefig(output, bbox_inches='tight')
     # plt.show()
+    plt.close(fig)
+
+
+def get_dir_fingerprint(path: str) -> list:
+    # (name, size, mtime) of all data files in the directory. Used to
+    # detect added or modified iteration files.
+    ret = list()
+    for entry in os.scandir(path):
+        if not entry.is_file() or not entry.name.endswith(DATA_EXTENSION):
+            continue
+        stat = entry.stat()
+        ret.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    ret.sort()
+    return ret
+
+
+def load_store(store_file: str) -> dict:
+    if not os.path.exists(store_file):
+        return dict()
+    with open(store_file, 'r') as f:
+        return json.load(f)
+
+
+def write_store(store: dict, store_file: str) -> None:
+    # Write to a temporary file first so that an interrupted run does
+    # not leave a truncated store behind.
+    tmp_file = store_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(store, f)
+    os.replace(tmp_file, store_file)
+
+
+def update_store(store: dict,
+                 path: str,
+                 iterations: int,
+                 percentile: int,
+                 values: set = None) -> bool:
+    # The statistics of a sampling value only depend on the files of the
+    # sampling value itself, the reference data, and the parameters.
+    # Only sampling values with new or modified files are processed.
+    # Structure of the store is sampling_value -> {'files': fingerprint,
+    # 'scopes': scope -> (dependencies, min, median, max),
+    # 'global': (dependencies, min, median, max)}
+    # Returns True if the store was modified.
+    params = {'iterations': iterations,
+              'percentile': percentile,
+              'reference': get_dir_fingerprint(path + REFERENCE_DIR_NAME
+                                               + '/')}
+    modified = False
+    if store.get('params') != params:
+        if store:
+            print('Parameters or reference data changed. Discarding all '
+                  'stored statistics.')
+        store.clear()
+        store['params'] = params
+        store['sampling_values'] = dict()
+        modified = True
+    stored_values = store['sampling_values']
+
+    present_values = set()
+    ref_data = None
+    for entry in os.scandir(path):
+        if not entry.is_dir() or not entry.name.isdigit():
+            continue
+        # Statistics of values that are not selected are kept, only those
+        # of directories that were removed are discarded.
+        present_values.add(entry.name)
+        if values and entry.name not in values:
+            continue
+        sampling_path = path + entry.name + '/'
+        fingerprint = get_dir_fingerprint(sampling_path)
+        if entry.name in stored_values \
+                and stored_values[entry.name]['files'] == fingerprint:
+            continue
+        print(f'Processing sampling value {entry.name}')
+        if ref_data is None:
+            ref_data = load_per_sampling_value_data(path + REFERENCE_DIR_NAME
+                                                    + '/',
+                                                    defaultdict(dict))
+        sampling_value = int(entry.name)
+        data = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        data = load_per_sampling_value_data(sampling_path, data,
+                                            sampling_value)
+        fill_missing_values(data, iterations)
+        scope_stats = dict()
+        global_diffs = defaultdict(lambda: defaultdict(list))
+        for scope in data:
+            if scope not in ref_data:
+                print(f'Error: Missing reference data for scope {scope}',
+                      file=sys.stderr)
+                continue
+            filter_dependencies(data[scope], percentile)
+            scope_diffs = get_diffs(ref_data[scope], data[scope])
+            for stats in get_summary(scope_diffs):
+                scope_stats[str(scope)] = stats[1:]
+            for asn, diffs in scope_diffs[sampling_value].items():
+                global_diffs[sampling_value][asn] += diffs
+        global_stats = None
+        for stats in get_summary(global_diffs):
+            global_stats = stats[1:]
+        stored_values[entry.name] = {'files': fingerprint,
+                                     'scopes': scope_stats,
+                                     'global': global_stats}
+        modified = True
+
+    for sampling_value in set(stored_values.keys()) - present_values:
+        print(f'Removing statistics of missing sampling value '
+              f'{sampling_value}')
+        stored_values.pop(sampling_value)
+        modified = True
+    return modified
+
+
+def get_store_summaries(store: dict) -> dict:
+    # Convert the store into summaries as returned by get_summary.
+    ret = defaultdict(list)
+    for sampling_value in sorted(store['sampling_values'], key=int):
+        entry = store['sampling_values'][sampling_value]
+        for scope, stats in entry['scopes'].items():
+            ret[scope].append((int(sampling_value), *stats))
+        if entry['global'] is not None:
+            ret['global'].append((int(sampling_value), *entry['global']))
+    return ret
+
+
+def get_convergence(summaries: dict, tolerance: float) -> dict:
+    # Map each scope to the smallest sampling value for which the median
+    # difference is below the tolerance, or None. Sampling values without
+    # any differences have a median of 0 in their summary and are skipped.
+    ret = dict()
+    for scope, summary in summaries.items():
+        ret[scope] = None
+        for sampling_value, dependencies, _, median_diff, _ in summary:
+            if dependencies == 0:
+                continue
+            if median_diff < tolerance:
+                ret[scope] = sampling_value
+                break
+    return ret
+
+
+def write_convergence(convergence: dict,
+                      tolerance: float,
+                      output_file: str) -> None:
+    with open(output_file, 'w') as f:
+        f.write(DATA_DELIMITER.join(['scope', 'tolerance', 'sampling_value'])
+                + '\n')
+        for scope, sampling_value in convergence.items():
+            if sampling_value is None:
+                sampling_value = str()
+            f.write(DATA_DELIMITER.join(map(str, [scope,
+                                                  tolerance,
+                                                  sampling_value]))
+                    + '\n')
+
+
+def count_scores(data: dict) -> int:
+    return sum(len(score_list)
+               for scope_data in data.values()
+               for asn_data in scope_data.values()
+               for score_list in asn_data.values())
 
 
 def main() -> None:
@@ -250,8 +912,58 @@ def main() -> None:
                         help='comma-separated list of values to plot')
     parser.add_argument('-o', '--output', default='./',
                         help='Output directory (default: ./)')
+    parser.add_argument('-p', '--percentile', type=int, default=90,
+                        help='Remove the scores of a dependency for a '
+                             'sampling value if this percentile of the '
+                             'scores is zero (default: 90)')
+    parser.add_argument('-s', '--sweep', type=parse_percentiles,
+                        help='comma-separated list or ranges of percentiles '
+                             '(e.g., 50-99) for which the filter is '
+                             'evaluated. Writes a summary per percentile '
+                             'instead of the default plots.')
+    parser.add_argument('-i', '--iteration-sensitivity', action='store_true',
+                        help='compute the summary for the first k '
+                             'iterations, for k = 1..iterations, and plot it '
+                             'per scope and globally instead of the default '
+                             'plots')
+    parser.add_argument('-m', '--metrics', action='store_true',
+                        help='compute error metrics of the sampled scores '
+                             'compared to the reference instead of the '
+                             'default plots')
+    parser.add_argument('-k', '--top-k', type=int, default=10,
+                        help='number of top dependencies used for the '
+                             'recall metric (default: 10)')
+    parser.add_argument('-u', '--update-store', metavar='STORE',
+                        help='keep per-scope statistics in the specified '
+                             'store file and only process sampling values '
+                             'with new or modified files')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.05,
+                        help='report the smallest sampling value for which '
+                             'the median difference of a scope is below this '
+                             'value (used with --update-store, default: '
+                             '0.05)')
+    parser.add_argument('-D', '--database',
+                        help='read the scores from this database written by '
+                             'ingest-scores.py instead of the files in '
+                             'data_dir. The scope size is the name of '
+                             'data_dir (not used with --update-store)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of processes used to render figures '
+                             '(default: number of CPUs)')
+    parser.add_argument('-n', '--no-figures', action='store_true',
+                        help='only write data files')
+    add_profile_arguments(parser)
     args = parser.parse_args()
 
+    profiler = Profiler.from_args(args)
+    try:
+        run(args, profiler)
+    finally:
+        profiler.print_counters()
+        profiler.write()
+
+
+def run(args: argparse.Namespace, profiler: Profiler) -> None:
     data_dir = args.data_dir
     if not data_dir.endswith('/'):
         data_dir += '/'
@@ -260,26 +972,173 @@ def main() -> None:
     if not output_dir.endswith('/'):
         output_dir += '/'
 
-    ref_data, data = load_data(data_dir, args.values)
-    fill_missing_values(data, args.iterations)
-    strip_empty_sampling_values(data)
+    manifest = FigureManifest(output_dir)
+    scope_size = os.path.basename(os.path.normpath(data_dir))
+
+    if args.iteration_sensitivity:
+        with profiler.stage('load') as stage:
+            if args.database:
+                ref_data, data = load_iteration_data_from_db(
+                    args.database, scope_size, args.iterations, args.values)
+            else:
+                ref_data, data = load_iteration_data(
+                    data_dir, args.iterations, args.values)
+            if profiler.enabled:
+                stage.items = count_scores(data)
+        with profiler.stage('arrays'):
+            scopes, asns, sampling_values, scores, ref_scores = \
+                get_iteration_arrays(ref_data, data, args.iterations)
+        with profiler.stage('iteration sensitivity') as stage:
+            summary = iteration_sensitivity(scopes, asns, sampling_values,
+                                            scores, ref_scores,
+                                            args.percentile)
+            stage.items = args.iterations
+        write_iteration_sensitivity(summary, output_dir
+                                    + 'iteration-sensitivity'
+                                    + DATA_EXTENSION)
+        if not args.no_figures:
+            # Only pass the rows of its scope to each job.
+            scope_summaries = defaultdict(list)
+            for row in summary:
+                scope_summaries[row[0]].append(row)
+            plot_jobs = [(scope, scope_summary, output_dir + scope
+                          + '-iteration-sensitivity' + FIG_EXTENSION)
+                         for scope, scope_summary in scope_summaries.items()]
+            with profiler.stage('render') as stage:
+                render_figures(plot_iteration_sensitivity, plot_jobs,
+                               args.jobs, manifest)
+                stage.items = len(plot_jobs)
+        return
+
+    if args.metrics:
+        with profiler.stage('load') as stage:
+            if args.database:
+                ref_data, data = load_iteration_data_from_db(
+                    args.database, scope_size, args.iterations, args.values)
+            else:
+                ref_data, data = load_iteration_data(
+                    data_dir, args.iterations, args.values)
+            if profiler.enabled:
+                stage.items = count_scores(data)
+        with profiler.stage('arrays'):
+            scopes, _, sampling_values, scores, ref_scores = \
+                get_iteration_arrays(ref_data, data, args.iterations,
+                                     include_reference=True)
+        with profiler.stage('metrics') as stage:
+            metrics = compute_metrics(scopes, sampling_values, scores,
+                                      ref_scores, args.top_k)
+            stage.items = len(metrics)
+        write_metrics(metrics, args.top_k,
+                      output_dir + 'metrics' + DATA_EXTENSION)
+        return
+
+    if args.update_store:
+        if not os.path.isdir(data_dir + REFERENCE_DIR_NAME):
+            print(f'Error: Missing reference data directory '
+                  f'{data_dir + REFERENCE_DIR_NAME}', file=sys.stderr)
+            sys.exit(1)
+        with profiler.stage('update store'):
+            store = load_store(args.update_store)
+            if update_store(store, data_dir, args.iterations, args.percentile,
+                            args.values):
+                write_store(store, args.update_store)
+        summaries = get_store_summaries(store)
+        write_convergence(get_convergence(summaries, args.tolerance),
+                          args.tolerance,
+                          output_dir + 'convergence' + DATA_EXTENSION)
+        if not args.no_figures:
+            with profiler.stage('render') as stage:
+                render_figures(plot_summary,
+                               [(scope, summary,
+                                 output_dir + scope + '-summary'
+                                 + FIG_EXTENSION)
+                                for scope, summary in summaries.items()],
+                               args.jobs, manifest)
+                stage.items = len(summaries)
+        return
+
+    with profiler.stage('load') as stage:
+        if args.database:
+            ref_data, data = load_data_from_db(args.database, scope_size,
+                                               args.values)
+        else:
+            ref_data, data = load_data(data_dir, args.values)
+        if profiler.enabled:
+            stage.items = count_scores(data)
+    with profiler.stage('fill'):
+        fill_missing_values(data, args.iterations)
+    with profiler.stage('strip'):
+        strip_empty_sampling_values(data)
+
+    if args.sweep:
+        global_sweep = {percentile: defaultdict(lambda: defaultdict(list))
+                        for percentile in args.sweep}
+        plot_jobs = list()
+        with profiler.stage('sweep') as stage:
+            for scope in data:
+                if scope not in ref_data:
+                    print(f'Error: Missing reference data for scope {scope}',
+                          file=sys.stderr)
+                    continue
+                profiler.count('scopes')
+                stage.items += 1
+                scope_sweep = sweep_percentiles(ref_data[scope], data[scope],
+                                                args.sweep)
+                summary = summarize_sweep(scope_sweep)
+                write_sweep_summary(summary, output_dir + str(scope)
+                                    + '-percentile-sweep' + DATA_EXTENSION)
+                plot_jobs.append((str(scope), summary,
+                                  output_dir + str(scope)
+                                  + '-percentile-sweep' + FIG_EXTENSION))
+                merge_sweep(global_sweep, scope_sweep)
+            summary = summarize_sweep(global_sweep)
+            write_sweep_summary(summary, output_dir
+                                + 'global-percentile-sweep' + DATA_EXTENSION)
+            plot_jobs.append(('global', summary,
+                              output_dir + 'global-percentile-sweep'
+                              + FIG_EXTENSION))
+        if not args.no_figures:
+            with profiler.stage('render') as stage:
+                render_figures(plot_sweep, plot_jobs, args.jobs, manifest)
+                stage.items = len(plot_jobs)
+        return
 
     global_diffs = defaultdict(lambda: defaultdict(list))
+    plot_jobs = list()
 
     for scope in data:
-        print(f'Scope: {scope}')
         if scope not in ref_data:
             print(f'Error: Missing reference data for scope {scope}',
                   file=sys.stderr)
             continue
-        filter_dependencies(data[scope], 90)
-        scope_diffs = get_diffs(ref_data[scope], data[scope])
-        plot_scope(str(scope), scope_diffs, output_dir)
-        for sampling_value in scope_diffs:
-            for asn in scope_diffs[sampling_value]:
-                global_diffs[sampling_value][asn] += scope_diffs[sampling_value][asn]
-    print('Global scope')
-    plot_scope('global', global_diffs, output_dir)
+        profiler.count('scopes')
+        with profiler.stage('filter') as stage:
+            stage.items = len(data[scope])
+            removed_samples, removed_dependencies = \
+                filter_dependencies(data[scope], args.percentile)
+        profiler.count('removed samples', removed_samples)
+        profiler.count('removed dependencies', removed_dependencies)
+        with profiler.stage('diff') as stage:
+            stage.items = len(data[scope])
+            scope_diffs = get_diffs(ref_data[scope], data[scope])
+            summary = get_summary(scope_diffs)
+            write_summary(summary, output_dir + str(scope) + '-summary'
+                          + DATA_EXTENSION)
+            plot_jobs.append((str(scope), summary,
+                              output_dir + str(scope) + '-summary'
+                              + FIG_EXTENSION))
+            for sampling_value in scope_diffs:
+                for asn in scope_diffs[sampling_value]:
+                    global_diffs[sampling_value][asn] += scope_diffs[sampling_value][asn]
+    with profiler.stage('diff'):
+        summary = get_summary(global_diffs)
+        write_summary(summary, output_dir + 'global-summary' + DATA_EXTENSION)
+        plot_jobs.append(('global', summary,
+                          output_dir + 'global-summary' + FIG_EXTENSION))
+    if not args.no_figures:
+        with profiler.stage('render') as stage:
+            render_figures(plot_summary, plot_jobs, args.jobs, manifest)
+            stage.items = len(plot_jobs)
 
 
 if __name__ == '__main__':
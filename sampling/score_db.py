@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import sys
+
+DATA_EXTENSION = '.csv'
+DATA_DELIMITER = ','
+REFERENCE_DIR_NAME = 'ref'
+# Sampling value of the reference files in the files table.
+REFERENCE_VALUE = -1
+
+
+def read_scores(file: str):
+    # Yields (scope, asn, score) tuples of all valid data lines.
+    with open(file, 'r') as f:
+        # Skip headers
+        f.readline()
+        for line in f:
+            line_split = line.split(DATA_DELIMITER)
+            if len(line_split) < 3:
+                print(f'Error: Malformed data line: {line.strip()}',
+                      file=sys.stderr)
+                continue
+            try:
+                scope = int(line_split[0])
+                asn = int(line_split[1])
+                score = float(line_split[2])
+            except ValueError as e:
+                print(f'Error: Malformed data line: {line.strip()}: {e}',
+                      file=sys.stderr)
+                continue
+            yield scope, asn, score
+
+
+def get_iteration(file_name: str) -> int:
+    # Files are named <topic>_<sampling_value>_<iteration>.csv
+    return int(file_name[:-len(DATA_EXTENSION)].rsplit('_', maxsplit=1)[1])
+
+
+class ScoreDatabase:
+    """Hegemony scores of the varying-scope-sizes tree in SQLite. Scores
+    are keyed by (scope_size, scope, asn, sampling_value, iteration), so
+    the scores of one scope or one dependency are read with an indexed
+    range query instead of parsing every CSV file of a scope size. The
+    scope size is the name of its directory in the tree. Ingested files
+    are fingerprinted, so ingesting the tree again only reads new or
+    modified files. Every score references the file it was read from, so
+    that removing a file only removes its own scores, even if another
+    file (e.g., of a moved copy of the tree) replaced some of them.
+
+    The ingest methods do not commit, so that the files of a directory can
+    be ingested in one transaction (with db.connection: ...)."""
+
+    def __init__(self, db_file: str):
+        self.connection = sqlite3.connect(db_file)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'id INTEGER PRIMARY KEY, '
+            'path TEXT NOT NULL UNIQUE, '
+            'scope_size TEXT NOT NULL, '
+            'sampling_value INTEGER NOT NULL, '
+            'iteration INTEGER NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'mtime_ns INTEGER NOT NULL)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS scores ('
+            'scope_size TEXT NOT NULL, '
+            'scope INTEGER NOT NULL, '
+            'asn INTEGER NOT NULL, '
+            'sampling_value INTEGER NOT NULL, '
+            'iteration INTEGER NOT NULL, '
+            'score REAL NOT NULL, '
+            'file_id INTEGER NOT NULL REFERENCES files (id), '
+            'PRIMARY KEY (scope_size, scope, asn, sampling_value, '
+            'iteration)) WITHOUT ROWID')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS scores_asn '
+            'ON scores (asn, scope_size)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS scores_sampling_value '
+            'ON scores (scope_size, sampling_value, iteration)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS scores_file_id ON scores (file_id)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS reference ('
+            'scope_size TEXT NOT NULL, '
+            'scope INTEGER NOT NULL, '
+            'asn INTEGER NOT NULL, '
+            'score REAL NOT NULL, '
+            'file_id INTEGER NOT NULL REFERENCES files (id), '
+            'PRIMARY KEY (scope_size, scope, asn)) WITHOUT ROWID')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS reference_file_id '
+            'ON reference (file_id)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def remove_file(self, path: str) -> None:
+        # Removes the scores of an ingested file that were not replaced by
+        # another file since. Must be called in a transaction.
+        row = self.connection.execute(
+            'SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return
+        file_id, = row
+        self.connection.execute('DELETE FROM scores WHERE file_id = ?',
+                                (file_id,))
+        self.connection.execute('DELETE FROM reference WHERE file_id = ?',
+                                (file_id,))
+        self.connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    def ingest_file(self,
+                    path: str,
+                    scope_size: str,
+                    sampling_value: int,
+                    iteration: int) -> int:
+        # Replaces the scores of the file if it is new or was modified.
+        # Returns the number of ingested scores, or -1 if the file was
+        # not modified. Must be called in a transaction.
+        stat = os.stat(path)
+        row = self.connection.execute(
+            'SELECT size, mtime_ns FROM files WHERE path = ?',
+            (path,)).fetchone()
+        if row == (stat.st_size, stat.st_mtime_ns):
+            return -1
+        self.remove_file(path)
+        file_id = self.connection.execute(
+            'INSERT INTO files '
+            '(path, scope_size, sampling_value, iteration, size, '
+            'mtime_ns) VALUES (?, ?, ?, ?, ?, ?)',
+            (path, scope_size, sampling_value, iteration, stat.st_size,
+             stat.st_mtime_ns)).lastrowid
+        if sampling_value == REFERENCE_VALUE:
+            rows = [(scope_size, scope, asn, score, file_id)
+                    for scope, asn, score in read_scores(path)]
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO reference '
+                '(scope_size, scope, asn, score, file_id) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+        else:
+            rows = [(scope_size, scope, asn, sampling_value, iteration,
+                     score, file_id)
+                    for scope, asn, score in read_scores(path)]
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO scores '
+                '(scope_size, scope, asn, sampling_value, iteration, '
+                'score, file_id) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def remove_missing_files(self, scope_size: str, present: set) -> int:
+        # Removes the scores of files of scope_size that are not in
+        # present anymore. Returns the number of removed files. Must be
+        # called in a transaction.
+        missing = [path for path, in self.connection.execute(
+            'SELECT path FROM files WHERE scope_size = ?', (scope_size,))
+            if path not in present]
+        for path in missing:
+            self.remove_file(path)
+        return len(missing)
+
+    def get_scope_sizes(self) -> list:
+        return [scope_size for scope_size, in self.connection.execute(
+            'SELECT DISTINCT scope_size FROM files ORDER BY scope_size')]
+
+    def get_sampling_values(self, scope_size: str) -> list:
+        return [sampling_value for sampling_value, in self.connection.execute(
+            'SELECT DISTINCT sampling_value FROM files '
+            'WHERE scope_size = ? AND sampling_value != ? '
+            'ORDER BY sampling_value', (scope_size, REFERENCE_VALUE))]
+
+    def get_scores(self,
+                   scope_size: str,
+                   sampling_values: list = None,
+                   scope: int = None,
+                   asn: int = None):
+        # Yields (scope, asn, sampling_value, iteration, score) tuples of
+        # scope_size, optionally limited to some sampling values, one scope
+        # or one dependency.
+        query = 'SELECT scope, asn, sampling_value, iteration, score ' \
+                'FROM scores WHERE scope_size = ?'
+        params = [scope_size]
+        if scope is not None:
+            query += ' AND scope = ?'
+            params.append(scope)
+        if asn is not None:
+            query += ' AND asn = ?'
+            params.append(asn)
+        if sampling_values is not None:
+            query += f' AND sampling_value IN ' \
+                     f'({", ".join("?" * len(sampling_values))})'
+            params += sampling_values
+        yield from self.connection.execute(query, params)
+
+    def get_reference(self, scope_size: str, scope: int = None):
+        # Yields (scope, asn, score) tuples of the reference data.
+        query = 'SELECT scope, asn, score FROM reference WHERE scope_size = ?'
+        params = [scope_size]
+        if scope is not None:
+            query += ' AND scope = ?'
+            params.append(scope)
+        yield from self.connection.execute(query, params)
+
+    def get_asn_scores(self, asn: int):
+        # Yields (scope_size, scope, sampling_value, iteration, score)
+        # tuples of one dependency across all scope sizes.
+        yield from self.connection.execute(
+            'SELECT scope_size, scope, sampling_value, iteration, score '
+            'FROM scores WHERE asn = ?', (asn,))
+
+    def close(self) -> None:
+        self.connection.close()